@@ -2,62 +2,74 @@ from collections import defaultdict
 import os, sys, time
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
 from communication_utils import *
-from dotenv import load_dotenv
+from connection_pool import ConnectionPool
+from sharding import load_shard_map, request_keys
+import metrics
 
-load_dotenv()
+load_env_file(__file__)
 
 S1 = os.environ.get("S1")
 S2 = os.environ.get("S2")
 S3 = os.environ.get("S3")
 
 # List of server IPs
+SERVER_IDS = ['S1', 'S2', 'S3']
 SERVER_IPS = [S1, S2, S3]
+REQUEST_INTERVAL = float(os.environ.get("REQUEST_INTERVAL", 2))  # Seconds between requests
 
 class Client:
-    def __init__(self, server_port, client_id):
+    def __init__(self, server_port, client_id, request_interval=REQUEST_INTERVAL):
         self.server_ips = SERVER_IPS
         self.server_port = server_port
         self.client_id = client_id
-        self.sockets = {}
+        self.request_interval = request_interval
+        self.shard_map = load_shard_map()  # Routes each key to its replica group; None: a single group
+        self.keys = request_keys()
+        self.sockets = {}  # server ID -> socket leased for the request in flight
+        self.connected = set()  # (group, server ID) pairs the last request reached, to report changes
+        self.pool = ConnectionPool()
         self.request_number = 0
         self.server_responses = defaultdict(list)
 
-    def connect(self):
-        """Establish connections to all servers."""
-        for ip in self.server_ips:
-            self.attempt_connection(ip)
-
-    def attempt_connection(self, ip):
-        """Attempt to connect to a specific server IP."""
-        sock = connect_to_socket(ip, self.server_port)
-        if sock:
-            self.sockets[ip] = sock
-            printG(f"Connected to server at {ip}:{self.server_port}")
-        else:
-            printR(f"Failed to connect to server {ip}:{self.server_port}")
-
-    def reconnect(self):
-        """Attempt to reconnect to servers that are not connected."""
-        for ip in self.server_ips:
-            if ip not in self.sockets:
-                printY(f"Attempting to reconnect to server {ip}...")
-                self.attempt_connection(ip)
+    def groups(self):
+        return list(self.shard_map.groups) if self.shard_map else [None]
+
+    def servers(self, group):
+        """Server ID -> (ip, port) of a replica group (None: the one deployment described by the environment)."""
+        if self.shard_map:
+            return self.shard_map.server_addresses(group)
+        return {server_id: (ip, server_port(server_id, "SERVER_PORT", self.server_port))
+                for server_id, ip in zip(SERVER_IDS, self.server_ips)}
+
+    def lease_connections(self, group=None):
+        """Lease a connection to every server of a group for the next request; idle pooled ones are reused."""
+        for server_id, (ip, port) in self.servers(group).items():
+            sock = self.pool.lease(ip, port)
+            name = f"{server_id} of group {group}" if group else server_id
+            if sock:
+                self.sockets[server_id] = sock
+                if (group, server_id) not in self.connected:
+                    self.connected.add((group, server_id))
+                    printG(f"Connected to server {name} at {format_address(ip, port)}")
+            elif (group, server_id) in self.connected:
+                self.connected.discard((group, server_id))
+                printR(f"Lost connection to server {name} at {format_address(ip, port)}")
 
     def send_to_all_servers(self, message_type, **kwargs):
         """Send a message to all connected servers."""
         message = create_message(self.client_id, message_type, **kwargs)
-        for ip, sock in list(self.sockets.items()):  # Use list to avoid runtime dict changes
+        for server, sock in list(self.sockets.items()):  # Use list to avoid runtime dict changes
             try:
-                send(sock, message, ip)
+                send(sock, message, server)
             except Exception as e:
-                printR(f"Error sending to server {ip}: {e}")
-                self.sockets.pop(ip)
+                printR(f"Error sending to server {server}: {e}")
+                self.pool.discard(self.sockets.pop(server))
         self.request_number += 1
 
     def receive_from_all_servers(self):
         """Receive responses from all servers and detect duplicate states."""
         responses = []
-        for ip, sock in list(self.sockets.items()):
+        for server, sock in list(self.sockets.items()):
             try:
                 response = receive(sock, self.client_id, False)
                 if response:
@@ -69,39 +81,49 @@ class Client:
                         printY(f"request_num {state}: Discarded duplicate reply from {server_id}.")
                     else:
                         print_log(response, self.client_id, sent=False)
-                        responses.append((ip, response))
-                    self.server_responses[request_num].append((ip, response))
+                        responses.append((server, response))
+                    self.server_responses[request_num].append((server, response))
+                    self.pool.release(sock)
+                else:
+                    self.pool.discard(sock)
             except Exception as e:
-                printR(f"Error receiving from server {ip}: {e}")
-                self.sockets.pop(ip)
+                printR(f"Error receiving from server {server}: {e}")
+                self.pool.discard(sock)
+        self.sockets.clear()
         return responses
 
 
     def close_connections(self):
         """Close all connections."""
-        for ip, sock in list(self.sockets.items()):
-            sock.close()
-            printY(f"Connection to server {ip} closed.")
+        for server, sock in list(self.sockets.items()):
+            self.pool.discard(sock)
+            printY(f"Connection to server {server} closed.")
+        self.sockets.clear()
+        self.pool.close_all()
 
     def run(self):
         # Create a client instance (IP addresses are handled in the client file)
-        self.connect()
+        metrics.start_metrics()
         try:
             while True:
-                # Attempt reconnections to servers if any are disconnected
-                self.reconnect()
+                # Each request goes to the servers of the group owning its key. Connections go back
+                # to the pool after each reply, and are reopened if a server went away
+                key = self.keys[self.request_number % len(self.keys)]
+                self.lease_connections(self.shard_map.group_for(key) if self.shard_map else None)
 
                 # Send an update message and process responses
-                self.send_to_all_servers("increase", request_number=self.request_number)
+                self.send_to_all_servers("increase", key=key, request_number=self.request_number)
                 self.receive_from_all_servers()
 
-                time.sleep(2)  # Delay between requests
+                time.sleep(self.request_interval)  # Delay between requests
         except KeyboardInterrupt:
             printY("self exiting...")
         finally:
             # Send exit message to all servers and close the connections
-            self.send_to_all_servers("exit")
-            self.close_connections()
+            for group in self.groups():
+                self.lease_connections(group)
+                self.send_to_all_servers("exit")
+                self.close_connections()
     
     
         
@@ -3,10 +3,13 @@ import json
 import sys, os, threading
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
 from communication_utils import *
+import metrics
 
 reliable_server = "S1"
 available_servers = []
 assign_initial_reliable = False
+gfd_connected = False
+MEMBER_COUNT = 0
 
 def handle_GFD_message(sock, message):
     global MEMBER_COUNT
@@ -21,6 +24,7 @@ def handle_GFD_message(sock, message):
         if new_member_count < MEMBER_COUNT:
             printR(f"RM Membership Decreased: {new_member_count} available servers")
             printY(f"Attempting to Automatically Recover {server_id}")
+            metrics.counter("rm_recoveries", "Recovery commands issued", server=server_id).inc()
 
             # Send recovery command
             send(sock, create_message("RM", "recover_server", server_id=server_id), "GFD")
@@ -74,6 +78,8 @@ def promote_new_reliable(gfd_sock):
         new_reliable = None
 
     reliable_server = new_reliable
+    get_logger().info("reliable promoted", server_id=new_reliable)
+    metrics.counter("rm_reliable_promotions", "Reliable server promotions", server=str(new_reliable)).inc()
 
     # Notify GFD about the new reliable
     try:
@@ -83,16 +89,29 @@ def promote_new_reliable(gfd_sock):
     except Exception as e:
         printR(f"Failed to notify GFD about new reliable server: {e}")
 
+def health():
+    """Status for /health and /ready: ready while the GFD is connected."""
+    return {
+        "component": "RM",
+        "role": "rm",
+        "ready": gfd_connected,
+        "member_count": MEMBER_COUNT,
+        "servers": list(available_servers),
+        "reliable": reliable_server,
+    }
+
 def main():
     COMPONENT_NAME = "Replication Manager"
     COMPONENT_ID = "RM"
-    RM_IP = '127.0.0.1'
-    RM_PORT = 12346
+    RM_IP = listen_address(os.environ.get("RM_IP"), '127.0.0.1')
+    RM_PORT = env_port("RM_PORT", 12346)
     
-    global MEMBER_COUNT
+    global MEMBER_COUNT, gfd_connected
     MEMBER_COUNT = 0
 
     rm_socket = initialize_component(COMPONENT_ID, COMPONENT_NAME, RM_IP, RM_PORT, 1)
+    metrics.set_health(health)
+    metrics.start_metrics()
 
     printY("Waiting for GFD to connect...")
 
@@ -101,12 +120,14 @@ def main():
             # Accept a connection from the GFD
             conn, addr = rm_socket.accept()
             printG(f"Connected to GFD at {addr}")
+            gfd_connected = True
             while True:
                 message = receive(conn, COMPONENT_ID)
                 if not message:
                     printR("GFD disconnected.")
                     break
                 handle_GFD_message(conn, message)
+            gfd_connected = False
             conn.close()
             printY("Waiting to connect to GFD")  # Wait for GFD reconnection if disconnected
         except (socket.error, json.JSONDecodeError) as e:
@@ -4,66 +4,119 @@ from queue import Queue
 import threading
 import os, sys
 import errno
+import json
+import multiprocessing
+import selectors
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
 from communication_utils import *
-from dotenv import load_dotenv
+from kv_store import KVStore, CHANGELOG_SIZE, apply_request, request_key
+from sharding import load_shard_map
+from durability import open_storage
+from state_transfer import StateDonor, TransferInterrupted, receive_state
+from heartbeat import HeartbeatResponder, udp_heartbeats
+from gossip import gossip_membership
+import metrics
 
-load_dotenv()
+load_env_file(__file__)
 
 # Global Configurations
 COMPONENT_ID = os.environ.get("MY_SERVER_ID")
-SERVER_IP = '0.0.0.0'
-SERVER_PORT = 12346
+SERVER_IP = listen_address(os.environ.get(COMPONENT_ID or ""))  # 0.0.0.0 unless this server's address is unix:
+SERVER_PORT = server_port(COMPONENT_ID, "SERVER_PORT", 12346)
 LFD_ID = os.environ.get("MY_LFD_ID")
 LFD_IP = '127.0.0.1'
-LFD_PORT = 54321
+LFD_PORT = env_port("LFD_PORT", 54321)
+LFD_SOCKET = local_socket_path("LFD", LFD_PORT) if os.environ.get("LFD_TRANSPORT") == "unix" else None
 
 # NOTE: Might have to hardcode the reliable server IP
+RELIABLE_SERVER_ID = None
 RELIABLE_SERVER_IP = None
 RELIABLE_SERVER_PORT = 12351
 MY_IP = os.environ.get(COMPONENT_ID)
+MY_RELIABLE_PORT = server_port(COMPONENT_ID, "RELIABLE_SERVER_PORT", 12351)
+STATE_TRANSFER_ATTEMPTS = 3  # Connections a recovering server makes to finish one state transfer
+RELIABLE_WAIT = float(os.environ.get("RELIABLE_WAIT", 2))  # Seconds to wait at startup for the LFD's new_reliable
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", 1))  # > 1: worker processes share SERVER_PORT via SO_REUSEPORT
+WORKER_RESTART_DELAY = 1  # Seconds before a worker that exited is replaced
 SERVER_IPS = [
     os.environ.get("S1"),
     os.environ.get("S2"),
     os.environ.get("S3")  # Adjust to actual server IPs
 ]
-state = 0
+store = KVStore(int(os.environ.get("CHANGELOG_SIZE", CHANGELOG_SIZE)))
+storage = None  # durability.Storage when DATA_DIR is set
+donor = StateDonor(COMPONENT_ID, store)
+SHARD_MAP = load_shard_map()  # None unless this deployment is one of several replica groups
+SHARD_ID = os.environ.get("MY_SHARD_ID")
 lfd_socket = None
+heartbeat_responder = None  # Answers the LFD's UDP heartbeats (HEARTBEAT_TRANSPORT=udp)
+reliable_known = threading.Event()  # Set once the LFD has said which server is reliable (sent right after registration)
 clients = {}
 message_queue = Queue()
+serving = False  # Synced and listening: ready for clients
+
+CONNECTED_CLIENTS = metrics.gauge("server_connected_clients", "Client connections currently open")
+STORE_KEYS = metrics.gauge("server_store_keys", "Keys in the replicated store")
+STATE_TRANSFER_SECONDS = metrics.histogram("server_state_transfer_seconds", "Time to serve a request_state to a recovering replica")
 
 def connect_to_lfd():
-    global lfd_socket
+    global lfd_socket, heartbeat_responder
     try:
-        lfd_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        lfd_socket.connect((LFD_IP, LFD_PORT))
-        printG(f"Connected to LFD at {LFD_IP}:{LFD_PORT}")
-        registration_message = create_message(COMPONENT_ID, "register")
+        lfd_socket = connect_to_unix_socket(LFD_SOCKET) if LFD_SOCKET else connect_to_socket(LFD_IP, LFD_PORT)
+        if not lfd_socket:
+            return
+        printG(f"Connected to LFD at {LFD_SOCKET or f'{LFD_IP}:{LFD_PORT}'}")
+        heartbeat_fields = {}
+        if udp_heartbeats() or gossip_membership():
+            # With gossip, peer LFDs on other hosts probe it too before this server is declared dead
+            responder_ip = '0.0.0.0' if gossip_membership() else '127.0.0.1'
+            heartbeat_responder = heartbeat_responder or HeartbeatResponder(COMPONENT_ID, ip=responder_ip)
+            heartbeat_fields["heartbeat_port"] = heartbeat_responder.port
+        registration_message = create_message(COMPONENT_ID, "register", **heartbeat_fields)
         send(lfd_socket, registration_message, LFD_ID)
     except Exception as e:
         printR(f"Failed to connect to LFD: {e}")
         lfd_socket = None
 
 def handle_heartbeat():
-    global RELIABLE_SERVER_IP
+    global RELIABLE_SERVER_ID, RELIABLE_SERVER_IP, RELIABLE_SERVER_PORT
     while True:
-        if lfd_socket:
-            message = receive(lfd_socket, COMPONENT_ID)
-            if message and message.get("message") == "heartbeat":
+        message = receive(lfd_socket, COMPONENT_ID) if lfd_socket else None
+        if message:
+            if message.get("message") == "heartbeat":
                 heartbeat_message = create_message(COMPONENT_ID, "heartbeat acknowledgment")
                 send(lfd_socket, heartbeat_message, LFD_ID)
-            elif message and message.get("message") == "new_reliable":
+            elif message.get("message") == "new_reliable":
                 if(message.get("server_id") != None):
-                    RELIABLE_SERVER_IP = SERVER_IPS[int(message.get("server_id")[-1])-1]
+                    RELIABLE_SERVER_ID = message.get("server_id")
+                    RELIABLE_SERVER_IP = SERVER_IPS[int(RELIABLE_SERVER_ID[-1])-1]
+                    RELIABLE_SERVER_PORT = server_port(RELIABLE_SERVER_ID, "RELIABLE_SERVER_PORT", 12351)
                 else:
                     print("message was none")
-                
-        time.sleep(1)
+                reliable_known.set()
+        else:
+            time.sleep(1)  # No LFD connection; receive() already blocks between heartbeats
 
-def handle_request_state(client_socket):
-    global state
-    response = create_message(COMPONENT_ID, "state_response", state=state)
-    send(client_socket, response, "Requesting Server")
+def handle_request_state(client_socket, message):
+    """
+    Runs on its own thread so the request loop keeps serving. Sends the changes since
+    the requester's version if the change log still has them, else streams the whole
+    store in chunks (resuming an interrupted stream if the request names one).
+    """
+    try:
+        with STATE_TRANSFER_SECONDS.time():
+            delta = store.changes_since(message.get("lineage"), message.get("since", -1))
+            if delta is not None:
+                changes, version = delta
+                response = create_message(COMPONENT_ID, "state_response", delta=changes, since=message["since"],
+                                          version=version, lineage=store.lineage)
+                send(client_socket, response, "Requesting Server")
+            else:
+                donor.stream(client_socket, "Requesting Server", message)
+    except (TransferInterrupted, OSError) as e:
+        printY(f"State transfer to {message.get('component_id')} stopped: {e}")
+    finally:
+        client_socket.close()
 
 def accept_new_connections_reliable(server_socket):
     # Non-blocking mode
@@ -73,9 +126,10 @@ def accept_new_connections_reliable(server_socket):
         # Handle request_state message if received
         message = receive(client_socket, COMPONENT_ID)
         if message and message.get("message") == "request_state":
-            handle_request_state(client_socket)
+            threading.Thread(target=handle_request_state, args=(client_socket, message), daemon=True).start()
         else:
             clients[client_socket] = client_address
+            CONNECTED_CLIENTS.set(len(clients))
     except BlockingIOError:
         pass
     except Exception as e:
@@ -88,35 +142,38 @@ def accept_new_connections(server_socket):
         client_socket, client_address = server_socket.accept()
         printG(f"Client connected: {client_address}")
         clients[client_socket] = client_address
+        CONNECTED_CLIENTS.set(len(clients))
     except BlockingIOError:
         # No new connections, move on
         pass
     except Exception as e:
         printR(f"Error accepting client connection: {e}")
 
+def handle_client_request(message):
+    """Applies one client request to the store and returns the response."""
+    request_number = message.get("request_number", "unknown")
+    try:
+        if SHARD_MAP:
+            SHARD_MAP.check(SHARD_ID, request_key(message))
+        response_type, fields = apply_request(store, message)
+        response = create_message(COMPONENT_ID, response_type, request_number=request_number, **fields)
+    except ValueError as e:
+        printY(str(e))
+        response = create_message(COMPONENT_ID, "error", error=str(e), reason=type(e).__name__, request_number=request_number)
+    STORE_KEYS.set(len(store))
+    return response
+
 def process_client_messages():
-    global state
     for client_socket in list(clients.keys()):
         try:
             client_socket.setblocking(False)  # Allow non-blocking mode for receiving
             message = receive(client_socket, COMPONENT_ID)
             if not message:  # If no message is received, skip further processing
                 continue
+            received_at = time.perf_counter()
 
-            message_type = message.get("message", "unknown")
-            request_number = message.get("request_number", "unknown")
-            component_id = message.get("component_id", "unknown")
-
-            if message_type == "increase":
-                state += 1
-                response = create_message(COMPONENT_ID, "state increased", state=state, request_number=request_number)
-            elif message_type == "decrease":
-                state -= 1
-                response = create_message(COMPONENT_ID, "state decreased", state=state, request_number=request_number)
-            else:
-                printY(f"Unknown message type: {message_type}")
-            
-            message_queue.put((client_socket, response))
+            response = handle_client_request(message)
+            message_queue.put((client_socket, response, message.get("message", "unknown"), received_at))
         except BlockingIOError:
             # No data available for now; skip processing this socket
             continue
@@ -124,28 +181,173 @@ def process_client_messages():
             printR(f"Error processing client message: {e}")
             disconnect_client(client_socket)
 
+def start_workers():
+    """
+    Starts SERVER_WORKERS client-facing processes. Each accepts on SERVER_PORT (the
+    kernel spreads connections over them with SO_REUSEPORT), parses requests and
+    forwards them over a pipe to this process, which owns the store and sequences
+    every mutation. The replies go back over the same pipe to the accepting worker.
+    """
+    for worker in range(1, SERVER_WORKERS + 1):
+        start_worker(worker)
+    printG(f"Started {SERVER_WORKERS} workers on {format_address(SERVER_IP, SERVER_PORT)}")
+
+def start_worker(worker):
+    """Starts worker process `worker` and the sequencer thread that serves its pipe."""
+    context = multiprocessing.get_context("spawn")  # A fresh interpreter, not a fork of this threaded process
+    sequencer_end, worker_end = context.Pipe()
+    process = context.Process(target=run_worker, args=(worker, worker_end), daemon=True)
+    process.start()
+    worker_end.close()
+    threading.Thread(target=sequence_requests, args=(sequencer_end, worker, process), daemon=True).start()
+
+def sequence_requests(conn, worker, process):
+    """
+    Sequencer side of one worker's pipe: applies each batch of requests, makes it durable,
+    returns the replies. If the pipe breaks either way the worker is gone (or is made to
+    exit by closing it), and a replacement takes its place after WORKER_RESTART_DELAY;
+    the clients it had connected must reconnect.
+    """
+    try:
+        while True:
+            batch = conn.recv()
+            replies = [(client_id, handle_client_request(message)) for client_id, message, _ in batch]
+            if storage:
+                storage.wait(store.version)  # Replies go out only once their writes are durable
+            conn.send(replies)
+            for _, message, received_at in batch:
+                message_type = message.get("message", "unknown")
+                metrics.counter("server_requests", "Client requests served", type=message_type).inc()
+                metrics.histogram("server_request_seconds", "Request receipt to reply sent", type=message_type).observe(time.perf_counter() - received_at)
+    except (EOFError, OSError):
+        printR(f"Worker {worker} exited. Restarting it in {WORKER_RESTART_DELAY}s.")
+    conn.close()  # A worker still running exits once its end of the pipe closes
+    process.join(WORKER_RESTART_DELAY)
+    time.sleep(WORKER_RESTART_DELAY)
+    start_worker(worker)
+
+def run_worker(worker, conn):
+    """
+    Body of a worker process: a select loop over its listener and clients that sends
+    the requests read in each pass to the sequencer as one batch. A thread writes the
+    replies back; the worker exits when the sequencer's end of the pipe closes.
+    """
+    listener = create_listener(SERVER_IP, SERVER_PORT, 128, reuse_port=True)
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ)
+    connections = {}  # client ID -> socket
+    buffers = {}      # client ID -> bytes after the last complete message
+    threading.Thread(target=reply_to_clients, args=(conn, connections), daemon=True).start()
+    next_id = 0
+    while True:
+        batch = []
+        for key, _ in selector.select():
+            if key.fileobj is listener:
+                client_socket, client_address = listener.accept()
+                printG(f"Client connected to worker {worker}: {client_address}")
+                next_id += 1
+                connections[next_id] = client_socket
+                buffers[next_id] = b""
+                selector.register(client_socket, selectors.EVENT_READ, next_id)
+                continue
+            client_id = key.data
+            try:
+                data = key.fileobj.recv(65536)
+            except OSError:
+                data = b""
+            if not data:
+                selector.unregister(key.fileobj)
+                connections.pop(client_id).close()
+                del buffers[client_id]
+                continue
+            received_at = time.perf_counter()  # Once the request is read, not while select() waited for it
+            *lines, buffers[client_id] = (buffers[client_id] + data).split(b"\n")
+            for line in lines:
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                print_log(message, COMPONENT_ID, sent=False)
+                batch.append((client_id, message, received_at))
+        if batch:
+            try:
+                conn.send(batch)
+            except OSError:
+                os._exit(1)  # The sequencer is gone
+
+def reply_to_clients(conn, connections):
+    """Worker thread: sends each batch of replies from the sequencer, one vectored write per client."""
+    while True:
+        try:
+            replies = conn.recv()
+        except (EOFError, OSError):
+            os._exit(1)  # The sequencer is gone; free the port for its replacement
+        by_client = {}
+        for client_id, response in replies:
+            by_client.setdefault(client_id, []).append(response)
+        for client_id, responses in by_client.items():
+            client_socket = connections.get(client_id)
+            if not client_socket:
+                continue  # Disconnected while its requests were in flight
+            try:
+                send_many(client_socket, responses, f"Client {client_id}")
+            except OSError:
+                pass  # The select loop sees the disconnect
+
 def synchronize_state():
-    global state
+    """Pulls the state from the reliable server, resuming an interrupted stream where it stopped."""
+    partial = None
+    for attempt in range(1, STATE_TRANSFER_ATTEMPTS + 1):
+        try:
+            pull_state(partial, retries=STATE_TRANSFER_ATTEMPTS - attempt)
+            return
+        except TransferInterrupted as e:
+            partial = e.state
+            printY(f"{e} (attempt {attempt} of {STATE_TRANSFER_ATTEMPTS}).")
+    printR("Could not complete the state transfer from the reliable server.")
+
+def pull_state(partial=None, retries=0):
+    sock = connect_to_socket(RELIABLE_SERVER_IP, RELIABLE_SERVER_PORT, timeout=3)  # Strict timeout for the connection
+    if not sock:
+        printY("Reliable server unavailable. Skipping synchronization.")
+        return
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(3)  # Set a strict timeout for the connection
-        sock.connect((RELIABLE_SERVER_IP, RELIABLE_SERVER_PORT))
-        printG(f"Connected to reliable server at {RELIABLE_SERVER_IP}:{RELIABLE_SERVER_PORT}")
+        printG(f"Connected to reliable server at {format_address(RELIABLE_SERVER_IP, RELIABLE_SERVER_PORT)}")
 
-        # Send request_state message
-        request_message = create_message(COMPONENT_ID, "request_state")
+        # Send request_state message; since/lineage let the reliable server answer with just the delta,
+        # and an interrupted stream is resumed from where it stopped (the donor keeps it while retries are left)
+        resume = partial.resume_fields() if partial else {}
+        request_message = create_message(COMPONENT_ID, "request_state", since=store.version, lineage=store.lineage,
+                                         retries=retries, **resume)
         send(sock, request_message, "Reliable Server")
 
         # Receive the state from the reliable server with a timeout
-        sock.settimeout(2)  # Timeout for receiving the state response
+        sock.settimeout(2)  # Timeout for receiving the state response (and each chunk of a stream)
         response = receive(sock, COMPONENT_ID)
-        if response and response.get("message") == "state_response":
-            state = response.get("state", state)
-            printG(f"State synchronized with reliable server. New state: {state}")
+        # A newer local version only means more state within the same lineage; from another history
+        # the reliable server's snapshot wins regardless of version, as a checkpoint does on a passive backup
+        same_history = response and response.get("lineage") == store.lineage
+        if same_history and response.get("message") in ("state_response", "state_begin") and response.get("version", 0) < store.version:
+            printY(f"Reliable server is at version {response.get('version', 0)}, behind the local state at {store.version}. Keeping local state.")
+        elif response and response.get("message") == "state_response" and "delta" in response:
+            store.apply_delta(response["delta"], response.get("since"), response.get("version", 0), response.get("lineage"))
+            if storage:
+                storage.wait(store.version)
+            STORE_KEYS.set(len(store))
+            printG(f"State synchronized with reliable server: {len(response['delta'])} changed keys, now at version {store.version}")
+        elif response and response.get("message") == "state_begin":
+            incoming = receive_state(sock, response, COMPONENT_ID, partial)
+            store.load(incoming.data, incoming.version, incoming.lineage)
+            if storage:
+                storage.snapshot()
+            STORE_KEYS.set(len(store))
+            printG(f"State synchronized with reliable server: {len(store)} keys at version {store.version}")
         else:
             printY("No valid state response received from reliable server.")
+    except TransferInterrupted:
+        raise
     except socket.timeout:
-        printY(f"Synchronization timed out while waiting for the reliable server at {RELIABLE_SERVER_IP}:{RELIABLE_SERVER_PORT}")
+        printY(f"Synchronization timed out while waiting for the reliable server at {format_address(RELIABLE_SERVER_IP, RELIABLE_SERVER_PORT)}")
     except socket.error as e:
         if e.errno in (errno.ECONNREFUSED, errno.ETIMEDOUT):
             printY("Reliable server unavailable. Skipping synchronization.")
@@ -159,8 +361,10 @@ def synchronize_state():
 def flush_message_queue():
     while not message_queue.empty():
         try:
-            client_socket, response = message_queue.get_nowait()
+            client_socket, response, message_type, received_at = message_queue.get_nowait()
             send(client_socket, response, f"Client@{clients[client_socket]}")
+            metrics.counter("server_requests", "Client requests served", type=message_type).inc()
+            metrics.histogram("server_request_seconds", "Request receipt to reply sent", type=message_type).observe(time.perf_counter() - received_at)
         except KeyError:
             printR("Attempted to send message to a disconnected client.")
         except Exception as e:
@@ -168,41 +372,67 @@ def flush_message_queue():
 
 def disconnect_client(client_socket):
     client_address = clients.pop(client_socket, None)
+    CONNECTED_CLIENTS.set(len(clients))
     if client_address:
         printR(f"Client disconnected: {client_address}")
     client_socket.close()
 
+def health():
+    """Status for /health and /ready: ready once state is synced and clients are accepted."""
+    return {
+        "component": COMPONENT_ID,
+        "role": "replica",
+        "ready": serving,
+        "reliable": RELIABLE_SERVER_ID,  # As far as this server has been told
+        "version": store.version,
+        "keys": len(store),
+        "clients": len(clients),
+        "queued_messages": message_queue.qsize(),
+        "lfd_connected": lfd_socket is not None,
+        "workers": SERVER_WORKERS,
+    }
+
 def main():
+    global storage, serving
     isReliableServer = COMPONENT_ID == "S1"
-    
+
+    storage = open_storage(store, COMPONENT_ID)
+    if storage:
+        printG(f"Recovered {len(store)} keys at version {store.version} from {storage.directory} ({storage.recovered} WAL records replayed).")
+    metrics.set_health(health)
+    metrics.start_metrics()
     connect_to_lfd()
     threading.Thread(target=handle_heartbeat, daemon=True).start()
-    time.sleep(2)
-    if (RELIABLE_SERVER_IP != None and RELIABLE_SERVER_IP != MY_IP): 
-        print(RELIABLE_SERVER_IP)
-        print("hi")
+    if lfd_socket and not reliable_known.wait(RELIABLE_WAIT):
+        printY(f"No new_reliable from the LFD within {RELIABLE_WAIT}s.")
+    if (RELIABLE_SERVER_ID != None and RELIABLE_SERVER_ID != COMPONENT_ID): 
+        printY(f"Synchronizing state from reliable server {RELIABLE_SERVER_ID} at {format_address(RELIABLE_SERVER_IP, RELIABLE_SERVER_PORT)}.")
         synchronize_state()
 
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((SERVER_IP, SERVER_PORT))
-    server_socket.listen(5)
-    printG(f"Server listening on {SERVER_IP}:{SERVER_PORT}")
+    server_socket = None
+    if SERVER_WORKERS > 1 and not is_unix_address(SERVER_IP):
+        start_workers()
+    else:
+        if SERVER_WORKERS > 1:
+            printY("SERVER_WORKERS needs SO_REUSEPORT, which Unix domain sockets lack; serving clients from this process.")
+        server_socket = create_listener(SERVER_IP, SERVER_PORT, 5)
+        printG(f"Server listening on {format_address(SERVER_IP, SERVER_PORT)}")
 
-    
-    server_socket2 = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket2.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket2.bind((MY_IP, RELIABLE_SERVER_PORT))
-    server_socket2.listen(5)
+    server_socket2 = create_listener(MY_IP, MY_RELIABLE_PORT, 5)
+    server_socket2.setblocking(False)  # Polled from the main loop like the client listener
 
     # Start the heartbeat thread
 
+    serving = True
     try:
         while True:
-            accept_new_connections(server_socket)  # Non-blocking, checks for connections
-            process_client_messages()  # Process any client messages
             accept_new_connections_reliable(server_socket2)
-            flush_message_queue()  # Send responses to clients
+            if server_socket:
+                accept_new_connections(server_socket)  # Non-blocking, checks for connections
+                process_client_messages()  # Process any client messages
+                if storage and not message_queue.empty():
+                    storage.wait(store.version)  # Replies go out only once their writes are durable
+                flush_message_queue()  # Send responses to clients
             time.sleep(0.1)  # Prevent high CPU usage
     except KeyboardInterrupt:
         printY("Server shutting down.")
@@ -211,7 +441,9 @@ def main():
             lfd_socket.close()
         for client in list(clients.keys()):
             disconnect_client(client)
-        server_socket.close()
+        if server_socket:
+            server_socket.close()
         printR("Server terminated.")
 if __name__ == '__main__':
+    wait_until_activated()
     main()
\ No newline at end of file
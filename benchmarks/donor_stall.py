@@ -0,0 +1,107 @@
+"""
+How much a state transfer stalls a donor's writes. One thread applies incr as
+fast as it can and records each call's latency. Another thread serves one state
+transfer to a receiver over loopback TCP, with the snapshot taken either:
+
+    copy   store.snapshot(): the whole store is copied under the store lock
+    view   store.view(): copy-on-write, read a chunk at a time (what the donor uses)
+
+    python benchmarks/donor_stall.py --keys 1000000
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+from communication_utils import *
+from kv_store import KVStore
+import state_transfer
+
+
+class CopiedView:
+    """A StoreView look-alike over a full copy, i.e. the donor before copy-on-write views."""
+
+    def __init__(self, store):
+        data, self.version, self.lineage = store.snapshot()
+        self.count = len(data)
+        self.items = list(data.items())
+        self.open = True
+
+    def entries(self, position, limit):
+        return self.items[position:position + limit], min(position + limit, self.count)
+
+    def close(self):
+        self.open = False
+
+
+def run(keys, mode):
+    store = KVStore()
+    store.load({f"key-{i}": i for i in range(keys)})
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    receiver_sock = socket.create_connection(listener.getsockname())
+    donor_sock, _ = listener.accept()
+    listener.close()
+
+    latencies = []
+    transfer_window = []
+    stop = threading.Event()
+
+    def writer():
+        n = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            store.incr(f"key-{n % keys}")
+            latencies.append((started, time.perf_counter() - started))
+            n += 1
+
+    def donate():
+        donor = state_transfer.StateDonor("S1", store)
+        started = time.perf_counter()
+        view = CopiedView(store) if mode == "copy" else store.view()
+        transfer = state_transfer.Transfer(view)
+        donor.stream(donor_sock, "S2", transfer=transfer)
+        transfer_window.extend([started, time.perf_counter()])
+
+    def receive_all():
+        begin = receive(receiver_sock, "S2", False)
+        state_transfer.receive_state(receiver_sock, begin, "S2")
+
+    threading.Thread(target=writer).start()
+    time.sleep(0.3)
+    receiving = threading.Thread(target=receive_all)
+    receiving.start()
+    donate()
+    receiving.join()
+    stop.set()
+    donor_sock.close()
+    receiver_sock.close()
+
+    start, end = transfer_window
+    during = sorted(latency for at, latency in latencies if start <= at <= end)
+    return {
+        "transfer_s": end - start,
+        "writes": len(during),
+        "p99_ms": during[int(0.99 * (len(during) - 1))] * 1000,
+        "max_ms": during[-1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Donor write latency during a state transfer.")
+    parser.add_argument('--keys', type=int, nargs='+', default=[100000, 1000000])
+    args = parser.parse_args()
+
+    print(f"{'keys':>9}{'snapshot':>10}{'transfer s':>12}{'writes':>9}{'p99 ms':>9}{'max ms':>9}")
+    for keys in args.keys:
+        for mode in ("copy", "view"):
+            r = run(keys, mode)
+            print(f"{keys:>9}{mode:>10}{r['transfer_s']:>12.2f}{r['writes']:>9}{r['p99_ms']:>9.2f}{r['max_ms']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
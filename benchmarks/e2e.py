@@ -0,0 +1,147 @@
+"""
+End-to-end benchmark: launches RM, GFD, three LFD + server pairs and N clients
+on localhost, drives load, and reports throughput and p50/p99/p999 latency.
+With --shards N, N such replica groups are started and keys are spread over
+them by consistent hashing.
+
+    python benchmarks/e2e.py --mode both --clients 4 --duration 20
+    python benchmarks/e2e.py --mode passive --loop open --rate 50 --clients 2
+    python benchmarks/e2e.py --mode passive --shards 3 --keys 1000 --clients 6
+    python benchmarks/e2e.py --mode passive --transport unix
+
+Component output is kept in the printed working directory for inspection.
+"""
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from topology import Topology, REPO_ROOT
+from metrics import percentile
+
+
+def component_env(args):
+    """Environment added to every component: LOG_LEVEL plus each --env NAME=VALUE."""
+    env = {"LOG_LEVEL": args.log_level}
+    for item in args.env:
+        name, _, value = item.partition("=")
+        env[name] = value
+    return env
+
+
+def start_topologies(mode, args, base_port, stack):
+    """Starts one replica group, or args.shards of them sharing a shard map."""
+    if args.shards <= 1:
+        topologies = [Topology(mode, base_port=base_port, heartbeat_freq=args.heartbeat_freq,
+                               checkpoint_interval=args.checkpoint_interval, extra_env=component_env(args),
+                               transport=args.transport)]
+        shard_env = {}
+    else:
+        topologies = [Topology(mode, base_port=base_port + 50 * shard, heartbeat_freq=args.heartbeat_freq,
+                               checkpoint_interval=args.checkpoint_interval, transport=args.transport)
+                      for shard in range(args.shards)]
+        shard_config = os.path.join(tempfile.mkdtemp(prefix=f"bench-{mode}-shards-"), "shards.json")
+        with open(shard_config, "w") as f:
+            json.dump({"groups": {f"G{n + 1}": t.endpoints() for n, t in enumerate(topologies)}}, f, indent=2)
+        shard_env = {"SHARD_CONFIG": shard_config}
+        for n, topology in enumerate(topologies):
+            topology.extra_env = {**component_env(args), "MY_SHARD_ID": f"G{n + 1}", **shard_env}
+    for topology in topologies:
+        stack.enter_context(topology)
+    for topology in topologies:
+        topology.wait_ready()
+    return topologies, shard_env
+
+
+def run_mode(mode, args, base_port):
+    with contextlib.ExitStack() as stack:
+        topologies, shard_env = start_topologies(mode, args, base_port, stack)
+        topology = topologies[0]  # Client logs and results go to the first group's directory
+        clients = []
+        for number in range(1, args.clients + 1):
+            output = os.path.join(topology.workdir, f"client{number}.json")
+            command = [sys.executable, os.path.join(REPO_ROOT, "benchmarks", "load_client.py"),
+                       "--mode", mode, "--client_id", f"C{number}", "--duration", str(args.warmup + args.duration),
+                       "--loop", args.loop, "--rate", str(args.rate), "--think", str(args.think), "--keys", str(args.keys),
+                       "--read_ratio", str(args.read_ratio), "--read_policy", args.read_policy,
+                       "--max_lag", str(args.max_lag), "--output", output]
+            log = open(os.path.join(topology.workdir, f"client{number}.out"), "w")
+            clients.append((subprocess.Popen(command, env=topology.env(LOG_CONSOLE="0", **shard_env), stdout=log, stderr=subprocess.STDOUT), output))
+
+        results = []
+        for process, output in clients:
+            process.wait()
+            if process.returncode != 0 or not os.path.exists(output):
+                print(f"  client failed, see {output.replace('.json', '.out')}")
+                continue
+            with open(output) as f:
+                results.append(json.load(f))
+
+    latencies = sorted(latency for result in results for sent_at, latency in result["samples"]
+                       if sent_at >= args.warmup)
+    sent = sum(result["sent"] for result in results)
+    completed = sum(len(result["samples"]) for result in results)
+    return {
+        "mode": mode,
+        "clients": len(results),
+        "shards": len(topologies),
+        "throughput": len(latencies) / args.duration,
+        "p50_ms": percentile(latencies, 50) * 1e3,
+        "p99_ms": percentile(latencies, 99) * 1e3,
+        "p999_ms": percentile(latencies, 99.9) * 1e3,
+        "sent": sent,
+        "lost": sent - completed,
+        "workdir": ", ".join(t.workdir for t in topologies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end throughput/latency benchmark on localhost.")
+    parser.add_argument('--mode', choices=['active', 'passive', 'both'], default='both')
+    parser.add_argument('--clients', type=int, default=3)
+    parser.add_argument('--duration', type=float, default=10, help="Measured seconds of load (after warmup).")
+    parser.add_argument('--warmup', type=float, default=2, help="Seconds of load discarded at the start.")
+    parser.add_argument('--loop', choices=['closed', 'open'], default='closed')
+    parser.add_argument('--rate', type=float, default=10, help="Open loop: requests per second per client.")
+    parser.add_argument('--think', type=float, default=0, help="Closed loop: seconds between requests.")
+    parser.add_argument('--keys', type=int, default=0, help="Spread requests over this many keys (0: single counter).")
+    parser.add_argument('--read_ratio', type=float, default=0, help="Share of requests that are gets.")
+    parser.add_argument('--read_policy', choices=['linearizable', 'bounded'], default='linearizable',
+                        help="Passive mode: gets go to the primary, or to backups with bounded staleness.")
+    parser.add_argument('--max_lag', type=int, default=-1, help="Bounded reads: versions a backup may trail (-1: any).")
+    parser.add_argument('--shards', type=int, default=1, help="Replica groups to partition keys over (use with --keys).")
+    parser.add_argument('--heartbeat_freq', type=float, default=1)
+    parser.add_argument('--transport', choices=['tcp', 'unix'], default='tcp',
+                        help="unix: every component listens on a Unix domain socket in the working directory.")
+    parser.add_argument('--checkpoint_interval', type=int, default=1)
+    parser.add_argument('--log_level', default="INFO", help="LOG_LEVEL for every component.")
+    parser.add_argument('--env', action='append', default=[], metavar="NAME=VALUE",
+                        help="Extra environment for every component, e.g. --env BATCH_MAX_SIZE=64 (repeatable).")
+    parser.add_argument('--base_port', type=int, default=20000)
+    parser.add_argument('--json', help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    modes = ['active', 'passive'] if args.mode == 'both' else [args.mode]
+    results = []
+    for index, mode in enumerate(modes):
+        result = run_mode(mode, args, args.base_port + 50 * max(2, args.shards) * index)
+        results.append(result)
+        time.sleep(0.5)
+
+    print(f"{'mode':<9}{'shards':>7}{'clients':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'p999 ms':>10}{'lost':>7}")
+    for r in results:
+        print(f"{r['mode']:<9}{r['shards']:>7}{r['clients']:>8}{r['throughput']:>10.1f}{r['p50_ms']:>10.2f}"
+              f"{r['p99_ms']:>10.2f}{r['p999_ms']:>10.2f}{r['lost']:>7}")
+    for r in results:
+        print(f"  {r['mode']} logs: {r['workdir']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
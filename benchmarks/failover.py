@@ -0,0 +1,241 @@
+"""
+Failover benchmark: kills one server process of a running localhost deployment
+while a client drives load, then rebuilds the failover timeline from the
+components' JSON-lines logs and reports each stage as an offset from the kill.
+
+passive: LFD detects -> GFD removes -> RM promotes -> GFD forwards new_primary
+         -> the new primary's LFD passes it on -> the server flips its role
+         -> client sees its next reply
+active:  LFD detects -> GFD removes -> RM promotes a new reliable server (only if
+         the reliable one died) -> GFD forwards new_reliable -> client sees its next reply
+
+    python benchmarks/failover.py --mode passive --runs 20
+    python benchmarks/failover.py --mode both --runs 10 --target S2 --heartbeat_freq 0.5
+    python benchmarks/failover.py --mode passive --fault hang --env HEARTBEAT_TRANSPORT=udp
+
+With --supervise the LFDs run their servers (SERVER_COMMAND), and the timeline
+goes on to the restart and the replacement rejoining the membership. Add
+--env WARM_STANDBY=1 to have each LFD keep a warm standby server ready.
+
+With --fault hang the server is stopped (SIGSTOP) instead: its connections stay
+open, so only heartbeats that go unanswered can reveal it. --stall resumes it
+(SIGCONT) after that many seconds, a pause the failure detector should ride out:
+a run where it is still "detected" is a false failover.
+
+    python benchmarks/failover.py --mode passive --fault hang --stall 2 --heartbeat_freq 0.5 --env MEMBERSHIP=gossip
+
+The kill lands at --kill_after plus a random offset within one heartbeat period,
+so detection time is sampled over the whole heartbeat cycle.
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+
+from topology import Topology, REPO_ROOT, SERVER_IDS
+from metrics import percentile
+
+PASSIVE_STAGES = [
+    ("detected", "LFD", "server declared dead"),
+    ("removed", "GFD", "replica removed"),
+    ("promoted", "RM", "primary promoted"),
+    ("forwarded", "GFD", "new primary forwarded"),
+    ("lfd notified", "NEW LFD", "new primary received"),
+    ("role flip", "NEW", "promoted to primary"),
+    ("lease acquired", "NEW", "lease acquired"),  # Only with --lease
+    ("restarted", "LFD", "server started"),       # Only with --supervise
+    ("rejoined", "GFD", "replica added"),
+]
+ACTIVE_STAGES = [
+    ("detected", "LFD", "server declared dead"),
+    ("removed", "GFD", "replica removed"),
+    ("promoted", "RM", "reliable promoted"),
+    ("forwarded", "GFD", "new reliable forwarded"),
+    ("restarted", "LFD", "server started"),       # Only with --supervise
+    ("rejoined", "GFD", "replica added"),
+]
+
+
+def read_events(path):
+    if not os.path.exists(path):
+        return []
+    events = []
+    with open(path) as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                pass  # A process killed mid-write can leave a partial last line
+    return events
+
+
+def first_after(events, name, after, server_id=None):
+    for event in events:
+        if event["event"] == name and event["ts"] >= after and (server_id is None or event.get("server_id") == server_id):
+            return event
+    return None
+
+
+def last_before(events, name, before):
+    found = None
+    for event in events:
+        if event["event"] == name and event["ts"] < before:
+            found = event
+    return found
+
+
+def resolve_target(topology, target, now):
+    """Maps primary/reliable/backup to a server ID using the RM's promotion events."""
+    if target in SERVER_IDS:
+        return target
+    event_name = "primary promoted" if topology.mode == 'passive' else "reliable promoted"
+    promoted = last_before(read_events(os.path.join(topology.workdir, "RM.jsonl")), event_name, now)
+    current = promoted.get("server_id") if promoted else SERVER_IDS[0]
+    if target in ("primary", "reliable"):
+        return current
+    return next(server_id for server_id in SERVER_IDS if server_id != current)
+
+
+def client_recovery(result, killed_at):
+    """
+    Returns (wall time, latency) of the request stuck across the failover: the slowest
+    one completed after the kill. If it is no slower than twice the p99 from before the
+    kill, the failure was invisible to the client and the first reply after the kill
+    is returned instead.
+    """
+    before, after = [], []
+    for sent_at, latency in result["samples"]:
+        completed = result["started"] + sent_at + latency
+        if completed < killed_at:
+            before.append(latency)
+        else:
+            after.append((completed, latency))
+    if not after:
+        return None
+    slowest = max(after, key=lambda sample: sample[1])
+    usual = percentile(before, 99) if before else 0
+    return slowest if slowest[1] > 2 * usual else min(after)
+
+
+def run_once(mode, args, base_port):
+    extra_env = {"LOG_LEVEL": "INFO", "PRIMARY_LEASE": str(args.lease)}
+    for item in args.env:
+        name, _, value = item.partition("=")
+        extra_env[name] = value
+    topology = Topology(mode, base_port=base_port, heartbeat_freq=args.heartbeat_freq,
+                        checkpoint_interval=args.checkpoint_interval, extra_env=extra_env, supervise=args.supervise)
+    kill_delay = args.kill_after + random.uniform(0, args.heartbeat_freq)
+    with topology:
+        topology.wait_ready()
+        output = os.path.join(topology.workdir, "client.json")
+        command = [sys.executable, os.path.join(REPO_ROOT, "benchmarks", "load_client.py"),
+                   "--mode", mode, "--client_id", "C1", "--duration", str(kill_delay + args.settle),
+                   "--think", str(args.think), "--output", output]
+        log = open(os.path.join(topology.workdir, "client.out"), "w")
+        client = subprocess.Popen(command, env=topology.env(LOG_CONSOLE="0"), stdout=log, stderr=subprocess.STDOUT)
+
+        time.sleep(kill_delay)
+        target = resolve_target(topology, args.target, time.time())
+        killed_at = time.time()
+        topology.kill(target, signal.SIGSTOP if args.fault == "hang" else signal.SIGKILL)
+        if args.fault == "hang" and args.stall:
+            time.sleep(args.stall)
+            topology.kill(target, signal.SIGCONT)
+        client.wait()
+        time.sleep(2 * topology.heartbeat_freq)  # Let the remaining stages land in the logs
+
+    timeline = {"target": target, "workdir": topology.workdir}
+    logs = {name: read_events(os.path.join(topology.workdir, f"{name}.jsonl")) for name in ("GFD", "RM")}
+    logs["LFD"] = read_events(os.path.join(topology.workdir, f"LFD{target[-1]}.jsonl"))
+    stages = PASSIVE_STAGES if mode == 'passive' else ACTIVE_STAGES
+    promoted_to = None
+    for stage, source, event_name in stages:
+        if source in ("NEW", "NEW LFD"):
+            if promoted_to is None:
+                continue
+            name = promoted_to if source == "NEW" else f"LFD{promoted_to[-1]}"
+            events = read_events(os.path.join(topology.workdir, f"{name}.jsonl"))
+        else:
+            events = logs[source]
+        server_id = target if stage in ("detected", "removed", "rejoined") else None
+        event = first_after(events, event_name, killed_at, server_id)
+        if event:
+            timeline[stage] = event["ts"] - killed_at
+            if stage == "promoted":
+                promoted_to = event.get("server_id")
+
+    if os.path.exists(output):
+        with open(output) as f:
+            recovery = client_recovery(json.load(f), killed_at)
+        if recovery:
+            timeline["client recovered"] = recovery[0] - killed_at
+            timeline["client stall"] = recovery[1]
+    return timeline
+
+
+def report(mode, timelines):
+    stages = [stage for stage, _, _ in (PASSIVE_STAGES if mode == 'passive' else ACTIVE_STAGES)]
+    stages += ["client recovered", "client stall"]
+    print(f"\n{mode}: {len(timelines)} runs, killed {', '.join(sorted(set(t['target'] for t in timelines)))}")
+    print(f"  {'stage (s after kill)':<22}{'runs':>6}{'p50 ms':>10}{'p90 ms':>10}{'max ms':>10}")
+    for stage in stages:
+        values = sorted(t[stage] for t in timelines if stage in t)
+        if not values:
+            print(f"  {stage:<22}{0:>6}{'-':>10}{'-':>10}{'-':>10}")
+            continue
+        print(f"  {stage:<22}{len(values):>6}{percentile(values, 50) * 1e3:>10.1f}"
+              f"{percentile(values, 90) * 1e3:>10.1f}{values[-1] * 1e3:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Failover timeline benchmark on localhost.")
+    parser.add_argument('--mode', choices=['active', 'passive', 'both'], default='both')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--target', default=None,
+                        help="Server to kill: primary, reliable, backup or a server ID "
+                             "(default: primary in passive mode, reliable in active mode).")
+    parser.add_argument('--kill_after', type=float, default=2, help="Seconds of load before the kill.")
+    parser.add_argument('--settle', type=float, default=6, help="Seconds of load after the kill.")
+    parser.add_argument('--think', type=float, default=0, help="Client seconds between requests.")
+    parser.add_argument('--heartbeat_freq', type=float, default=1)
+    parser.add_argument('--checkpoint_interval', type=int, default=1)
+    parser.add_argument('--lease', type=float, default=0, help="Passive primary lease in seconds (0: no leases).")
+    parser.add_argument('--fault', choices=['kill', 'hang'], default='kill',
+                        help="kill: SIGKILL the server; hang: SIGSTOP it, so its sockets stay open but nothing answers.")
+    parser.add_argument('--stall', type=float, default=0,
+                        help="With --fault hang: resume the server after this many seconds (0: never).")
+    parser.add_argument('--supervise', action='store_true', help="The LFDs start and restart their servers.")
+    parser.add_argument('--env', action='append', default=[], metavar="NAME=VALUE",
+                        help="Extra environment for every component, e.g. --env HEARTBEAT_TRANSPORT=udp.")
+    parser.add_argument('--base_port', type=int, default=21000)
+    parser.add_argument('--json', help="Also write every timeline to this file.")
+    args = parser.parse_args()
+
+    modes = ['active', 'passive'] if args.mode == 'both' else [args.mode]
+    results = {}
+    for index, mode in enumerate(modes):
+        mode_args = argparse.Namespace(**vars(args))
+        if mode_args.target is None:
+            mode_args.target = "primary" if mode == 'passive' else "reliable"
+        timelines = []
+        for run in range(args.runs):
+            # Fresh ports every run so lingering sockets of the last one never interfere
+            timeline = run_once(mode, mode_args, args.base_port + 100 * (index * args.runs + run))
+            print(f"  {mode} run {run + 1}: " + ", ".join(
+                f"{k}={v * 1e3:.0f}ms" for k, v in timeline.items() if isinstance(v, float)))
+            timelines.append(timeline)
+        results[mode] = timelines
+
+    for mode, timelines in results.items():
+        report(mode, timelines)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
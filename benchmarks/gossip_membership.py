@@ -0,0 +1,88 @@
+"""
+SWIM gossip membership (common/gossip.py) against group size. N members on
+loopback UDP join through the first one; once every member sees all N, one
+member is stopped and the benchmark records when the others first suspect it,
+when the first and the last of them declare it dead, and how many datagrams each
+member sent per period. The GFD, by contrast, sends and receives one heartbeat per
+LFD per period, so its load grows linearly with N.
+
+    python benchmarks/gossip_membership.py --members 10 50 100 --interval 0.5
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+from gossip import GossipMember, ALIVE, SUSPECT, DEAD
+
+
+def run(size, interval, timeout):
+    events = {}   # (observer, status) -> time first seen, for the stopped member
+    lock = threading.Lock()
+    victim_id = f"M{size - 1}"
+
+    def watcher(observer):
+        def on_change(member_id, entry):
+            if member_id == victim_id:
+                with lock:
+                    events.setdefault((observer, entry["status"]), time.monotonic())
+        return on_change
+
+    seed = GossipMember("M0", ip='127.0.0.1', interval=interval, on_change=watcher("M0")).start()
+    members = [seed] + [GossipMember(f"M{i}", seeds=[seed.address], ip='127.0.0.1', interval=interval,
+                                     on_change=watcher(f"M{i}")).start() for i in range(1, size)]
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        if all(sum(e["status"] == ALIVE for e in m.view().values()) == size for m in members):
+            break
+        time.sleep(interval / 4)
+    else:
+        raise TimeoutError(f"{size} members did not converge in {timeout}s")
+    converged = time.monotonic() - started
+
+    events.clear()
+    sent_before = sum(m.sent for m in members)
+    victim = members[-1]
+    survivors = members[:-1]
+    stopped_at = time.monotonic()
+    victim.stop()
+    while time.monotonic() - stopped_at < timeout:
+        with lock:
+            if all((m.member_id, DEAD) in events for m in survivors):
+                break
+        time.sleep(interval / 4)
+    elapsed = time.monotonic() - stopped_at
+    sent = sum(m.sent for m in survivors) - (sent_before - victim.sent)
+    for member in survivors:
+        member.stop()
+
+    suspected = [at for (_, status), at in events.items() if status == SUSPECT]
+    dead = sorted(at for (_, status), at in events.items() if status == DEAD)
+    return {
+        "converge_s": converged,
+        "suspect_s": min(suspected) - stopped_at if suspected else float("nan"),
+        "first_dead_s": dead[0] - stopped_at if dead else float("nan"),
+        "all_dead_s": dead[-1] - stopped_at if len(dead) == len(survivors) else float("nan"),
+        "per_member_period": sent / len(survivors) / (elapsed / interval),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SWIM membership detection time and load against group size.")
+    parser.add_argument('--members', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--interval', type=float, default=0.5, help="Protocol period in seconds.")
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    print(f"{'members':>8}{'converge s':>12}{'suspect s':>11}{'1st dead s':>12}{'all dead s':>12}{'msgs/member/period':>20}")
+    for size in args.members:
+        r = run(size, args.interval, args.timeout)
+        print(f"{size:>8}{r['converge_s']:>12.2f}{r['suspect_s']:>11.2f}{r['first_dead_s']:>12.2f}"
+              f"{r['all_dead_s']:>12.2f}{r['per_member_period']:>20.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+LFD <-> server heartbeat round trip over each local transport. A thread answers
+heartbeats the way the servers do (receive, send an acknowledgment) while the main
+thread sends them back to back the way the LFD does, with the same messages and
+the same send()/receive() framing.
+
+    tcp    loopback TCP (the default)
+    unix   Unix domain socket (LFD_TRANSPORT=unix)
+
+    python benchmarks/heartbeat_rtt.py --rounds 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+from communication_utils import *
+from metrics import percentile
+
+
+def answer_heartbeats(sock):
+    while True:
+        message = receive(sock, "S1", False)
+        if not message:
+            return
+        send(sock, create_message("S1", "heartbeat acknowledgment"), "LFD1", False)
+
+
+def run(transport, rounds):
+    if transport == "unix":
+        path = os.path.join(tempfile.mkdtemp(prefix="heartbeat-"), "lfd.sock")
+        listener = create_unix_listener(path, 1)
+        server = connect_to_unix_socket(path)
+    else:
+        listener = create_listener('127.0.0.1', 0, 1)
+        server = connect_to_socket('127.0.0.1', listener.getsockname()[1])
+    lfd, _ = listener.accept()
+    listener.close()
+    threading.Thread(target=answer_heartbeats, args=(server,), daemon=True).start()
+
+    samples = []
+    started = time.perf_counter()
+    for _ in range(rounds):
+        sent_at = time.perf_counter()
+        send(lfd, create_message("LFD1", "heartbeat", lease_seconds=None), "S1", False)
+        receive(lfd, "LFD1", False)
+        samples.append(time.perf_counter() - sent_at)
+    elapsed = time.perf_counter() - started
+    lfd.close()
+    server.close()
+    return samples, rounds / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Heartbeat round trip per LFD transport.")
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'transport':<10}{'heartbeats/s':>14}{'p50 us':>9}{'p99 us':>9}{'max us':>9}")
+    for transport in ("tcp", "unix"):
+        samples, rate = run(transport, args.rounds)
+        ordered = sorted(samples)
+        print(f"{transport:<10}{rate:>14.0f}{percentile(ordered, 50) * 1e6:>9.1f}"
+              f"{percentile(ordered, 99) * 1e6:>9.1f}{ordered[-1] * 1e6:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""
+Load generator for one client, run as its own process by e2e.py.
+
+active:  sends every request to all connected servers; the first reply completes it
+         (the same duplicate suppression the real active client does).
+passive: asks the RM for the primary, sends to it, and follows primary changes.
+
+closed loop: one outstanding request, optionally followed by --think seconds.
+open loop:   requests are sent at --rate per second regardless of replies.
+
+--read_ratio turns that share of requests into gets. With --read_policy bounded,
+passive-mode gets go round-robin to the backups with min_version set to the newest
+version this client has seen in the group minus --max_lag (0: read-your-writes,
+-1: any checkpoint); a backup that is behind answers StaleRead and the get is
+retried at the primary.
+
+With $SHARD_CONFIG set, every key is routed to its replica group through the
+shard map; otherwise the single deployment described by the environment is used.
+
+Writes one JSON object to --output with the latency of every completed request.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+from communication_utils import *
+from sharding import load_shard_map
+
+SERVER_IDS = ['S1', 'S2', 'S3']
+REQUEST_TIMEOUT = 5
+LEASE_RETRY_DELAY = 0.05
+
+
+class ReplicaGroup:
+    """Connections of one client to one replica group (its RM and servers)."""
+
+    def __init__(self, client, name, rm_address, servers):
+        self.client = client
+        self.name = name
+        self.rm_address = rm_address
+        self.servers = servers    # server ID -> (host, port)
+        self.sockets = {}         # server ID -> socket
+        self.primary = None
+        self.last_version = 0     # Newest store version seen in any reply from this group
+        self.next_backup = 0
+        self.lock = threading.Lock()
+
+    def connect(self, deadline):
+        if self.client.mode == 'passive':
+            rm_socket = None
+            while rm_socket is None and time.time() < deadline:
+                rm_socket = connect_to_socket(*self.rm_address)
+            threading.Thread(target=self.listen_to_rm, args=(rm_socket,), daemon=True).start()
+            while self.primary is None and time.time() < deadline:
+                time.sleep(0.05)
+            if self.client.read_policy == 'bounded':
+                for server_id in self.servers:
+                    if server_id != self.primary:
+                        self.connect_server(server_id)  # Best effort; reads fall back to the primary
+            wanted = lambda: [self.primary] if self.primary else []
+        else:
+            wanted = lambda: list(self.servers)
+        while time.time() < deadline:
+            for server_id in wanted():
+                if server_id not in self.sockets:
+                    self.connect_server(server_id)
+            if wanted() and all(server_id in self.sockets for server_id in wanted()):
+                return
+            time.sleep(0.1)
+        raise TimeoutError(f"{self.client.client_id} could not connect to {wanted()} of group {self.name}")
+
+    def connect_server(self, server_id):
+        sock = connect_to_socket(*self.servers[server_id], timeout=1)
+        if sock:
+            with self.lock:
+                self.sockets[server_id] = sock
+            threading.Thread(target=self.read_replies, args=(server_id, sock), daemon=True).start()
+
+    def listen_to_rm(self, sock):
+        while True:
+            message = receive(sock, self.client.client_id, False)
+            if not message:
+                return
+            if message.get("message") == "primary_server":
+                with self.client.completed:
+                    self.primary = message.get("primary_server")
+                    self.client.epoch += 1
+                    self.client.completed.notify_all()
+
+    def read_replies(self, server_id, sock):
+        while True:
+            message = receive(sock, self.client.client_id, False)
+            if not message:
+                with self.lock:
+                    if self.sockets.get(server_id) is sock:
+                        del self.sockets[server_id]
+                return
+            if isinstance(message.get("version"), int):
+                self.last_version = max(self.last_version, message["version"])
+            if message.get("reason") == "StaleRead":
+                retry = self.client.in_flight.get(message.get("request_number"))
+                if retry:
+                    self.send(retry, to_backup=False)
+                continue
+            if message.get("reason") == "NoLease":
+                # The primary is waiting for its lease (e.g. right after a failover)
+                retry = self.client.in_flight.get(message.get("request_number"))
+                if retry:
+                    threading.Timer(LEASE_RETRY_DELAY, self.send, (retry, False)).start()
+                continue
+            self.client.complete(message.get("request_number"))
+
+    def send(self, message, to_backup=None):
+        if to_backup is None:
+            to_backup = message["message"] == "get" and self.client.read_policy == 'bounded'
+        if self.client.mode == 'passive' and self.primary and self.primary not in self.sockets:
+            self.connect_server(self.primary)
+        with self.lock:
+            targets = list(self.sockets.items())
+        if self.client.mode == 'passive':
+            backups = [(server_id, sock) for server_id, sock in targets if server_id != self.primary]
+            if to_backup and backups:
+                self.next_backup += 1
+                targets = [backups[self.next_backup % len(backups)]]
+                if self.client.max_lag >= 0:
+                    message = dict(message, min_version=max(0, self.last_version - self.client.max_lag))
+            else:
+                targets = [(server_id, sock) for server_id, sock in targets if server_id == self.primary]
+        for server_id, sock in targets:
+            try:
+                send(sock, message, server_id, False)
+            except OSError:
+                pass
+
+
+class LoadClient:
+    def __init__(self, mode, client_id, keys=0, shard_map=None, read_ratio=0, read_policy='linearizable', max_lag=-1):
+        self.mode = mode
+        self.client_id = client_id
+        self.keys = keys          # > 0: incr a random one of this many keys instead of "increase"
+        self.shard_map = shard_map
+        self.read_ratio = read_ratio
+        self.read_policy = read_policy
+        self.max_lag = max_lag    # Versions a bounded read may trail the newest one seen; -1: unbounded
+        self.in_flight = {}       # request number -> message, until its reply arrives
+        self.sent_at = {}         # request number -> perf_counter() at send
+        self.latencies = {}       # request number -> seconds to first reply
+        self.completed = threading.Condition()
+        self.epoch = 0            # Bumped on every primary change, in any group
+
+        if shard_map:
+            self.groups = {name: ReplicaGroup(self, name, shard_map.rm_address(name), shard_map.server_addresses(name))
+                           for name in shard_map.groups}
+        else:
+            rm_address = (os.environ.get("RM_IP", "127.0.0.1"), env_port("RM_CLIENT_PORT", 13579))
+            servers = {server_id: (os.environ.get(server_id, "127.0.0.1"), server_port(server_id, "SERVER_PORT", 12346))
+                       for server_id in SERVER_IDS}
+            self.groups = {None: ReplicaGroup(self, None, rm_address, servers)}
+
+    def connect(self, timeout=15):
+        deadline = time.time() + timeout
+        for group in self.groups.values():
+            group.connect(deadline)
+
+    def complete(self, request_number):
+        now = time.perf_counter()
+        with self.completed:
+            if request_number in self.sent_at and request_number not in self.latencies:
+                self.latencies[request_number] = now - self.sent_at[request_number]
+                self.in_flight.pop(request_number, None)
+                self.completed.notify_all()
+
+    def create_request(self, request_number):
+        if self.read_ratio and random.random() < self.read_ratio:
+            key = f"k{random.randrange(self.keys)}" if self.keys else "state"
+            return create_message(self.client_id, "get", key=key, request_number=request_number)
+        if self.keys:
+            return create_message(self.client_id, "incr", key=f"k{random.randrange(self.keys)}", request_number=request_number)
+        return create_message(self.client_id, "increase", request_number=request_number)
+
+    def send_request(self, message):
+        """Sends a request; a retry keeps the original send time so its latency includes the outage."""
+        group = self.shard_map.group_for(message.get("key", "state")) if self.shard_map else None
+        self.sent_at.setdefault(message["request_number"], time.perf_counter())
+        self.in_flight.setdefault(message["request_number"], message)
+        self.groups[group].send(message)
+
+    def run_closed(self, duration, think):
+        end = time.perf_counter() + duration
+        request_number = 0
+        while time.perf_counter() < end:
+            message = self.create_request(request_number)
+            self.send_request(message)
+            deadline = time.perf_counter() + REQUEST_TIMEOUT
+            while time.perf_counter() < deadline:
+                epoch = self.epoch
+                with self.completed:
+                    self.completed.wait_for(lambda: request_number in self.latencies or self.epoch != epoch,
+                                            timeout=deadline - time.perf_counter())
+                if request_number in self.latencies:
+                    break
+                if self.epoch != epoch:
+                    self.send_request(message)  # Retry against the new primary
+            request_number += 1
+            if think:
+                time.sleep(think)
+
+    def run_open(self, duration, rate):
+        start = time.perf_counter()
+        request_number = 0
+        while True:
+            scheduled = start + request_number / rate
+            if scheduled - start >= duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.send_request(self.create_request(request_number))
+            request_number += 1
+        # Give in-flight requests a chance to complete
+        with self.completed:
+            self.completed.wait_for(lambda: len(self.latencies) >= len(self.sent_at), timeout=REQUEST_TIMEOUT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single benchmark client.")
+    parser.add_argument('--mode', choices=['active', 'passive'], required=True)
+    parser.add_argument('--client_id', default="C1")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds of load.")
+    parser.add_argument('--loop', choices=['closed', 'open'], default='closed')
+    parser.add_argument('--rate', type=float, default=10, help="Open loop: requests per second.")
+    parser.add_argument('--think', type=float, default=0, help="Closed loop: seconds between a reply and the next request.")
+    parser.add_argument('--keys', type=int, default=0, help="Spread requests as incr over this many keys (0: plain increase).")
+    parser.add_argument('--read_ratio', type=float, default=0, help="Share of requests that are gets.")
+    parser.add_argument('--read_policy', choices=['linearizable', 'bounded'], default='linearizable',
+                        help="Passive mode: send gets to the primary, or to backups with min_version.")
+    parser.add_argument('--max_lag', type=int, default=-1, help="Bounded reads: versions a backup may trail (-1: any).")
+    parser.add_argument('--output', required=True, help="Path of the JSON result file.")
+    args = parser.parse_args()
+
+    client = LoadClient(args.mode, args.client_id, args.keys, load_shard_map(), args.read_ratio, args.read_policy, args.max_lag)
+    client.connect()
+    started = time.perf_counter()
+    started_wall = time.time()
+    if args.loop == 'closed':
+        client.run_closed(args.duration, args.think)
+    else:
+        client.run_open(args.duration, args.rate)
+
+    with client.completed:
+        samples = [(client.sent_at[n] - started, latency) for n, latency in client.latencies.items()]
+    with open(args.output, "w") as output:
+        json.dump({
+            "client_id": args.client_id,
+            "started": started_wall,  # Wall clock matching sample offset 0, to line up with component logs
+            "sent": len(client.sent_at),
+            "samples": samples,  # (seconds since load started at send time, latency seconds)
+        }, output)
+
+
+if __name__ == '__main__':
+    main()
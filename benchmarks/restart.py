@@ -0,0 +1,98 @@
+"""
+Restart cost against store size. For each size, a store is snapshotted to disk and
+then receives --writes more writes. A replica restarting from that directory is
+compared with one that needs the whole store from a peer:
+
+    recover   map the snapshot, replay the WAL written since, answer one get
+    full      encode, decode and load the whole store, as a full state transfer does
+    delta     encode, decode and apply the changes since the snapshot's version
+
+    python benchmarks/restart.py --keys 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+from kv_store import KVStore
+from durability import Storage
+
+
+def transfer(message):
+    """Round-trips a message through the wire encoding; returns (decoded, bytes)."""
+    encoded = json.dumps(message).encode()
+    return json.loads(encoded), len(encoded)
+
+
+def run(keys, writes, directory):
+    store = KVStore()
+    storage = Storage(store, directory, snapshot_every=10 ** 9)
+    storage.recover()
+    store.load({f"k{i}": i for i in range(keys)}, 0, store.lineage)
+    started = time.perf_counter()
+    storage.snapshot()
+    snapshot_seconds = time.perf_counter() - started
+    snapshot_version = store.version
+    for _ in range(writes):
+        store.incr(f"k{random.randrange(keys)}")
+    storage.wait(store.version)
+
+    started = time.perf_counter()
+    restarted = KVStore()
+    Storage(restarted, directory).recover()
+    restarted.get("k0")
+    recover_seconds = time.perf_counter() - started
+    assert restarted.version == store.version
+
+    started = time.perf_counter()
+    data, version, lineage = store.snapshot()
+    message, full_bytes = transfer({"store": data, "version": version, "lineage": lineage})
+    KVStore().load(message["store"], message["version"], message["lineage"])
+    full_seconds = time.perf_counter() - started
+
+    peer = KVStore()
+    peer.load_mapped(restarted.base)  # The restarted replica, as it was before replaying the WAL
+    started = time.perf_counter()
+    changes, version = store.changes_since(peer.lineage, snapshot_version)
+    message, delta_bytes = transfer({"delta": changes, "since": snapshot_version, "version": version, "lineage": store.lineage})
+    peer.apply_delta(message["delta"], message["since"], message["version"], message["lineage"])
+    delta_seconds = time.perf_counter() - started
+    assert peer.to_dict() == store.to_dict()
+
+    return {
+        "keys": keys,
+        "snapshot_mb": sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory) if f.endswith(".kvs")) / 1e6,
+        "snapshot_s": snapshot_seconds,
+        "recover_ms": recover_seconds * 1000,
+        "full_ms": full_seconds * 1000,
+        "full_mb": full_bytes / 1e6,
+        "delta_ms": delta_seconds * 1000,
+        "delta_kb": delta_bytes / 1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replica restart time against store size.")
+    parser.add_argument('--keys', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--writes', type=int, default=1000, help="Writes after the snapshot, replayed from the WAL.")
+    parser.add_argument('--dir', help="Directory for the data (default: a temporary directory).")
+    args = parser.parse_args()
+
+    print(f"{'keys':>9}{'file MB':>9}{'write s':>9}{'recover ms':>12}{'full ms':>10}{'full MB':>9}{'delta ms':>10}{'delta KB':>10}")
+    for keys in args.keys:
+        directory = tempfile.mkdtemp(prefix="restart-", dir=args.dir)
+        try:
+            r = run(keys, args.writes, directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        print(f"{r['keys']:>9}{r['snapshot_mb']:>9.1f}{r['snapshot_s']:>9.2f}{r['recover_ms']:>12.1f}"
+              f"{r['full_ms']:>10.1f}{r['full_mb']:>9.1f}{r['delta_ms']:>10.1f}{r['delta_kb']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
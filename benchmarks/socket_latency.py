@@ -0,0 +1,88 @@
+"""
+Request/reply latency over loopback for each socket tuning profile.
+
+Every round the client writes --writes small messages back to back and then waits
+for a single reply. With Nagle enabled the second write is held until the first is
+ACKed, and the server (still waiting for the rest of the request) delays that ACK,
+which is the classic ~40 ms stall. --writes 1 is the plain one-message request/reply.
+
+With --transport unix the same exchange runs over a Unix domain socket (a unix:
+address), where the tuning options that apply are only the buffer sizes.
+
+    python benchmarks/socket_latency.py --rounds 200 --writes 2
+    python benchmarks/socket_latency.py --rounds 5000 --writes 1 --transport tcp unix --profiles latency
+"""
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+from communication_utils import *
+from socket_tuning import SOCKET_PROFILES
+from metrics import percentile
+
+
+def echo_server(listener, writes):
+    conn, _ = listener.accept()
+    expected = writes * len(payload(0))
+    try:
+        while True:
+            data = b""
+            while len(data) < expected:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    return
+                data += chunk
+            conn.sendall(b"ok")
+    finally:
+        conn.close()
+
+
+def payload(i):
+    return b"%08d" % (i % 100000000)
+
+
+def run_profile(profile, rounds, writes, transport="tcp"):
+    host = f"unix:{os.path.join(tempfile.mkdtemp(prefix='latency-'), 'echo')}" if transport == "unix" else '127.0.0.1'
+    listener = create_listener(host, 0, 1, profile)
+    port = 0 if transport == "unix" else listener.getsockname()[1]
+    threading.Thread(target=echo_server, args=(listener, writes), daemon=True).start()
+
+    sock = connect_to_socket(host, port, profile=profile)
+    samples = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        for _ in range(writes):
+            sock.sendall(payload(i))
+        reply = b""
+        while len(reply) < 2:
+            reply += sock.recv(2)
+        samples.append(time.perf_counter() - start)
+    sock.close()
+    listener.close()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback latency per socket tuning profile.")
+    parser.add_argument('--rounds', type=int, default=200, help="Request/reply rounds per profile.")
+    parser.add_argument('--writes', type=int, default=2, help="Writes per request before waiting for the reply.")
+    parser.add_argument('--profiles', nargs='+', default=list(SOCKET_PROFILES), help="Profiles to compare.")
+    parser.add_argument('--transport', nargs='+', choices=['tcp', 'unix'], default=['tcp'])
+    args = parser.parse_args()
+
+    print(f"{'transport':<11}{'profile':<12}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for transport in args.transport:
+        for profile in args.profiles:
+            samples = run_profile(profile, args.rounds, args.writes, transport)
+            mean = sum(samples) / len(samples)
+            print(f"{transport:<11}{profile:<12}{mean * 1e3:>10.3f}{percentile(samples, 50) * 1e3:>10.3f}"
+                  f"{percentile(samples, 99) * 1e3:>10.3f}{max(samples) * 1e3:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Server startup time: process start to first served request. A running deployment
+loses one server (SIGKILL). Once the GFD has dropped it, the server is started again,
+and the benchmark polls its client port with a get until one is answered. It reports,
+from the spawn:
+
+    listening   the client port accepts connections
+    registered  the GFD adds the replica back (LFD registration)
+    first reply the first get is answered
+    ready       its /ready says it wants load (a passive backup: once it has a checkpoint)
+
+    python benchmarks/startup.py --mode both --runs 5
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+from topology import Topology, SERVER_IDS
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+from communication_utils import *
+from metrics import percentile
+
+
+def first_reply(host, port, deadline):
+    """Times (connected, answered) of the first get the server at host:port answers, polling every 10 ms."""
+    connected = None
+    while time.time() < deadline:
+        try:
+            sock = socket.create_connection((host, port), timeout=1)
+        except OSError:
+            time.sleep(0.01)
+            continue
+        connected = connected or time.time()
+        try:
+            send(sock, create_message("C9", "get", key="startup", request_number=1), "Server", False)
+            reply = receive(sock, "C9", False)
+            if reply and reply.get("message") != "error":
+                return connected, time.time()
+        except OSError:
+            pass
+        finally:
+            sock.close()
+        time.sleep(0.01)
+    return connected, None
+
+
+def ready_at(topology, server_id, deadline, result):
+    while time.time() < deadline:
+        status = topology.health(server_id, "/ready")
+        if status and status.get("ready"):
+            result.append(time.time())
+            return
+        time.sleep(0.01)
+
+
+def registered_at(topology, server_id, after):
+    path = os.path.join(topology.workdir, "GFD.jsonl")
+    with open(path) as f:
+        for line in f:
+            event = json.loads(line)
+            if event.get("event") == "replica added" and event.get("server_id") == server_id and event["ts"] >= after:
+                return event["ts"]
+    return None
+
+
+def run(mode, args):
+    results = []
+    topology = Topology(mode, base_port=args.base_port, heartbeat_freq=args.heartbeat_freq,
+                        extra_env={"LOG_LEVEL": "INFO"})
+    with topology:
+        topology.wait_ready()
+        for _ in range(args.runs):
+            topology.kill(args.server)
+            deadline = time.time() + args.timeout
+            while topology.membership_size() > len(SERVER_IDS) - 1 and time.time() < deadline:
+                time.sleep(0.05)
+            started = time.time()
+            topology.start_server(args.server)
+            ready = []
+            poller = threading.Thread(target=ready_at, args=(topology, args.server, started + args.timeout, ready))
+            poller.start()
+            listening, replied = first_reply(topology.host(args.server), topology.server_port(args.server),
+                                             started + args.timeout)
+            poller.join()
+            time.sleep(0.2)  # Let the GFD's log catch up
+            registered = registered_at(topology, args.server, started)
+            results.append({stage: at - started if at else None for stage, at in
+                            (("listening", listening), ("registered", registered), ("first reply", replied),
+                             ("ready", ready[0] if ready else None))})
+            print(f"  {mode} run {len(results)}: " + ", ".join(
+                f"{stage}={value * 1e3:.0f}ms" for stage, value in results[-1].items() if value is not None))
+            while topology.membership_size() < len(SERVER_IDS) and time.time() < deadline:
+                time.sleep(0.05)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server process start to first served request.")
+    parser.add_argument('--mode', choices=['active', 'passive', 'both'], default='both')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--server', default='S2', choices=SERVER_IDS, help="Server to restart (not the primary/reliable S1).")
+    parser.add_argument('--heartbeat_freq', type=float, default=0.5)
+    parser.add_argument('--timeout', type=float, default=20)
+    parser.add_argument('--base_port', type=int, default=22000)
+    args = parser.parse_args()
+
+    modes = ['active', 'passive'] if args.mode == 'both' else [args.mode]
+    report = {}
+    for index, mode in enumerate(modes):
+        args.base_port += 100 * index
+        report[mode] = run(mode, args)
+
+    print(f"\n{'mode':<9}{'stage':<13}{'runs':>6}{'p50 ms':>10}{'max ms':>10}")
+    for mode, results in report.items():
+        for stage in ("listening", "registered", "first reply", "ready"):
+            values = sorted(r[stage] for r in results if r[stage] is not None)
+            if values:
+                print(f"{mode:<9}{stage:<13}{len(values):>6}{percentile(values, 50) * 1e3:>10.1f}{values[-1] * 1e3:>10.1f}")
+            else:
+                print(f"{mode:<9}{stage:<13}{0:>6}{'-':>10}{'-':>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Whole-store transfer over loopback TCP: the old single state_response message
+against the chunked stream (common/state_transfer.py), for several store sizes.
+Also reports the largest message each one puts on the wire, which bounds the
+receiver's buffer.
+
+    python benchmarks/state_stream.py --keys 10000 100000 1000000
+"""
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+from communication_utils import *
+from kv_store import KVStore
+import state_transfer
+
+
+def loopback_pair():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return server, client
+
+
+def single_message(store):
+    donor_sock, receiver_sock = loopback_pair()
+
+    def donate():
+        data, version, lineage = store.snapshot()
+        send(donor_sock, create_message("S1", "state_response", store=data, version=version, lineage=lineage), "S2", False)
+
+    started = time.perf_counter()
+    threading.Thread(target=donate).start()
+    response = receive(receiver_sock, "S2", False)
+    KVStore().load(response["store"], response["version"], response["lineage"])
+    elapsed = time.perf_counter() - started
+    donor_sock.close()
+    receiver_sock.close()
+    return elapsed, len(json.dumps(response))
+
+
+def chunked(store):
+    donor_sock, receiver_sock = loopback_pair()
+    donor = state_transfer.StateDonor("S1", store)
+    started = time.perf_counter()
+    threading.Thread(target=donor.stream, args=(donor_sock, "S2")).start()
+    begin = receive(receiver_sock, "S2", False)
+    incoming = state_transfer.receive_state(receiver_sock, begin, "S2")
+    KVStore().load(incoming.data, incoming.version, incoming.lineage)
+    elapsed = time.perf_counter() - started
+    donor_sock.close()
+    receiver_sock.close()
+    chunk = dict(list(incoming.data.items())[:state_transfer.CHUNK_KEYS])
+    return elapsed, len(json.dumps(chunk))  # A chunk's payload line, the largest line on the wire
+
+
+def main():
+    parser = argparse.ArgumentParser(description="State transfer: one message vs chunked stream.")
+    parser.add_argument('--keys', type=int, nargs='+', default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    print(f"{'keys':>9}{'single s':>10}{'largest MB':>12}{'chunked s':>11}{'largest MB':>12}")
+    for keys in args.keys:
+        store = KVStore()
+        store.load({f"key-{i}": i * 7919 for i in range(keys)})
+        single_seconds, single_bytes = single_message(store)
+        chunked_seconds, chunk_bytes = chunked(store)
+        print(f"{keys:>9}{single_seconds:>10.2f}{single_bytes / 1e6:>12.2f}{chunked_seconds:>11.2f}{chunk_bytes / 1e6:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""
+Launches a full deployment on localhost as separate processes:
+RM, GFD, and three LFD + server pairs, each on its own ports.
+
+Every process gets the same environment (server addresses and per-server ports),
+plus its own MY_SERVER_ID / MY_LFD_ID / LFD_PORT. Console output goes to
+<workdir>/<name>.out and structured logs to <workdir>/<name>.jsonl.
+With transport="unix" every component listens on Unix domain sockets in <workdir>.
+With supervise=True the LFDs run (and restart) their servers from SERVER_COMMAND.
+"""
+import json
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(REPO_ROOT, 'common'))
+from communication_utils import is_unix_address, unix_socket_path
+SERVER_IDS = ['S1', 'S2', 'S3']
+
+
+class Topology:
+    def __init__(self, mode, base_port=20000, workdir=None, heartbeat_freq=1, checkpoint_interval=1, extra_env=None,
+                 transport="tcp", supervise=False):
+        if mode not in ('active', 'passive'):
+            raise ValueError(f"Unknown replication mode '{mode}'")
+        if transport not in ('tcp', 'unix'):
+            raise ValueError(f"Unknown transport '{transport}'")
+        self.transport = transport
+        self.supervise = supervise  # The LFDs run their servers (SERVER_COMMAND) instead of this class
+        self.mode = mode
+        self.base_port = base_port
+        self.workdir = workdir or tempfile.mkdtemp(prefix=f"bench-{mode}-")
+        self.heartbeat_freq = heartbeat_freq
+        self.checkpoint_interval = checkpoint_interval
+        self.extra_env = extra_env or {}
+        self.processes = {}  # name -> Popen
+
+        # Port layout: base+0 GFD, +1 RM, +2 RM client listener, +3 GFD metrics, +4 RM metrics,
+        # then 10 ports per server pair starting at base+10 (+4 server metrics, +5 LFD metrics).
+        self.gfd_port = base_port
+        self.rm_port = base_port + 1
+        self.rm_client_port = base_port + 2
+        self.gfd_metrics_port = base_port + 3
+        self.rm_metrics_port = base_port + 4
+
+    def pair_port(self, server_id, offset):
+        return self.base_port + 10 * (SERVER_IDS.index(server_id) + 1) + offset
+
+    def server_port(self, server_id):
+        return self.pair_port(server_id, 0)
+
+    def metrics_port(self, name):
+        """Port serving /metrics, /health and /ready for GFD, RM, S<n> or LFD<n>."""
+        if name in ("GFD", "RM"):
+            return self.gfd_metrics_port if name == "GFD" else self.rm_metrics_port
+        return self.pair_port(f"S{name[-1]}", 5 if name.startswith("LFD") else 4)
+
+    def health(self, name, path="/health"):
+        """A component's /health (or /ready) status, None if it does not answer."""
+        try:
+            response = urllib.request.urlopen(f"http://127.0.0.1:{self.metrics_port(name)}{path}", timeout=1)
+        except urllib.error.HTTPError as e:
+            response = e  # /ready answers 503 with the same body while not ready
+        except OSError:
+            return None
+        try:
+            return json.loads(response.read())
+        except ValueError:
+            return None
+
+    def host(self, name):
+        """Address of a component: 127.0.0.1, or a unix: address in the working directory."""
+        return f"unix:{os.path.join(self.workdir, name.lower())}" if self.transport == "unix" else "127.0.0.1"
+
+    def endpoints(self):
+        """This deployment's entry in a shard map (see common/sharding.py)."""
+        return {
+            "rm": f"{self.host('RM')}:{self.rm_client_port}",
+            "servers": {server_id: f"{self.host(server_id)}:{self.server_port(server_id)}" for server_id in SERVER_IDS},
+        }
+
+    def env(self, **extra):
+        """Environment shared by every process of this deployment (clients included)."""
+        env = dict(os.environ)
+        env.update({
+            "GFD_IP": self.host("GFD"),
+            "GFD_PORT": str(self.gfd_port),
+            "RM_IP": self.host("RM"),
+            "RM_PORT": str(self.rm_port),
+            "RM_CLIENT_PORT": str(self.rm_client_port),
+            "PYTHONUNBUFFERED": "1",
+            "LEASE_RENEWAL_INTERVAL": str(2 * self.heartbeat_freq),  # The GFD and the LFDs share --heartbeat_freq
+        })
+        if self.transport == "unix":
+            env["LFD_TRANSPORT"] = "unix"
+        for server_id in SERVER_IDS:
+            env[server_id] = self.host(server_id)
+            env[f"{server_id}_SERVER_PORT"] = str(self.pair_port(server_id, 0))
+            env[f"{server_id}_CHECKPOINT_PORT"] = str(self.pair_port(server_id, 1))
+            env[f"{server_id}_RELIABLE_SERVER_PORT"] = str(self.pair_port(server_id, 2))
+        env.update(self.extra_env)
+        env.update(extra)
+        return env
+
+    def spawn(self, name, script, args=(), **env):
+        out = open(os.path.join(self.workdir, f"{name}.out"), "w")
+        env.setdefault("LOG_FILE", os.path.join(self.workdir, f"{name}.jsonl"))
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_ROOT, script), *args],
+            cwd=self.workdir, env=self.env(**env), stdout=out, stderr=subprocess.STDOUT,
+        )
+        self.processes[name] = process
+        return process
+
+    def server_args(self):
+        return ("--checkpoint_interval", str(self.checkpoint_interval)) if self.mode == 'passive' else ()
+
+    def start_server(self, server_id):
+        """(Re)starts the server process of one pair."""
+        number = server_id[-1]
+        return self.spawn(server_id, f"{self.mode}_replication/server.py", self.server_args(),
+                          MY_SERVER_ID=server_id, MY_LFD_ID=f"LFD{number}",
+                          LFD_PORT=str(self.pair_port(server_id, 3)), **self.lfd_socket_env(server_id),
+                          METRICS_PORT=str(self.pair_port(server_id, 4)))
+
+    def server_command(self, server_id):
+        """SERVER_COMMAND for a supervising LFD: the server inherits its environment, plus its own log and metrics port."""
+        return shlex.join(["env", f"LOG_FILE={os.path.join(self.workdir, f'{server_id}.jsonl')}",
+                           f"METRICS_PORT={self.pair_port(server_id, 4)}", sys.executable,
+                           os.path.join(REPO_ROOT, f"{self.mode}_replication/server.py"), *self.server_args()])
+
+    def supervised_pid(self, server_id):
+        """
+        PID of the server a supervising LFD is running, from the LFD's "server started"
+        log events (needs LOG_LEVEL=INFO). A warm standby is a child of the LFD as well,
+        so the process tree alone cannot tell which child is live.
+        """
+        pid = None
+        try:
+            with open(os.path.join(self.workdir, f"LFD{server_id[-1]}.jsonl")) as f:
+                for line in f:
+                    event = json.loads(line)
+                    if event.get("event") == "server started":
+                        pid = event["pid"]
+        except (OSError, ValueError):
+            pass
+        return pid
+
+    def lfd_socket_env(self, server_id):
+        """LFD_SOCKET for one pair when the components run with LFD_TRANSPORT=unix, else nothing."""
+        if self.env().get("LFD_TRANSPORT") != "unix":
+            return {}
+        return {"LFD_SOCKET": os.path.join(self.workdir, f"LFD{server_id[-1]}.sock")}
+
+    def start(self):
+        self.spawn("RM", f"{self.mode}_replication/rm.py", METRICS_PORT=str(self.rm_metrics_port))
+        wait_for_port(self.rm_port, self.host("RM"))
+        self.spawn("GFD", "common/gfd.py", ("--heartbeat_freq", str(self.heartbeat_freq)), METRICS_PORT=str(self.gfd_metrics_port))
+        wait_for_port(self.gfd_port, self.host("GFD"))
+        for server_id in SERVER_IDS:
+            number = server_id[-1]
+            supervised = {"SERVER_COMMAND": self.server_command(server_id)} if self.supervise else {}
+            self.spawn(f"LFD{number}", "common/lfd.py", ("--heartbeat_freq", str(self.heartbeat_freq)),
+                       MY_LFD_ID=f"LFD{number}", MY_SERVER_ID=server_id,
+                       LFD_PORT=str(self.pair_port(server_id, 3)), METRICS_PORT=str(self.pair_port(server_id, 5)),
+                       **self.lfd_socket_env(server_id), **supervised)
+        for server_id in SERVER_IDS if not self.supervise else ():
+            if self.lfd_socket_env(server_id):
+                wait_for_path(self.lfd_socket_env(server_id)["LFD_SOCKET"])
+            else:
+                wait_for_port(self.pair_port(server_id, 3))
+            self.start_server(server_id)
+        return self
+
+    def wait_ready(self, members=3, timeout=30):
+        """Waits until the GFD membership holds `members` replicas and every server accepts clients."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.membership_size() >= members:
+                break
+            time.sleep(0.2)
+        else:
+            raise TimeoutError(f"Membership did not reach {members} within {timeout}s (logs in {self.workdir})")
+        for server_id in SERVER_IDS:
+            wait_for_port(self.server_port(server_id), self.host(server_id), timeout=max(1, deadline - time.time()))
+
+    def membership_size(self):
+        try:
+            body = urllib.request.urlopen(f"http://127.0.0.1:{self.gfd_metrics_port}/metrics", timeout=1).read().decode()
+        except OSError:
+            return 0
+        for line in body.splitlines():
+            if line.startswith("gfd_membership_size "):
+                return int(float(line.split()[1]))
+        return 0
+
+    def kill(self, name, sig=signal.SIGKILL):
+        if self.supervise and name in SERVER_IDS:
+            pid = self.supervised_pid(name)
+            if pid:
+                os.kill(pid, sig)
+            return
+        process = self.processes.get(name)
+        if process and process.poll() is None:
+            process.send_signal(sig)
+            if sig not in (signal.SIGSTOP, signal.SIGCONT):
+                process.wait()
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        deadline = time.time() + 3
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=max(0.1, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def wait_for_path(path, timeout=10):
+    """Waits until a process has bound a Unix domain socket at path."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if os.path.exists(path):
+            return
+        time.sleep(0.05)
+    raise TimeoutError(f"Nothing listening on {path} after {timeout}s")
+
+
+def wait_for_port(port, host="127.0.0.1", timeout=10):
+    """
+    Waits until a process listens on host:port. Probing by connecting would look like
+    a new peer to the RM, GFD, LFD and servers, so this instead tries to bind the
+    port itself and treats "address in use" as the listener being up. A unix: host is
+    up once its socket file exists.
+    """
+    if is_unix_address(host):
+        return wait_for_path(unix_socket_path(host, port), timeout)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            probe.bind((host, port))
+        except OSError:
+            return
+        finally:
+            probe.close()
+        time.sleep(0.05)
+    raise TimeoutError(f"Nothing listening on {host}:{port} after {timeout}s")
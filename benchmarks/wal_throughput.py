@@ -0,0 +1,77 @@
+"""
+Durable write throughput of the KV store: N threads each apply incr and wait for
+durability, as a server request thread does, under every fsync policy and with
+no WAL at all. Also checks that recovery reproduces the store.
+
+    python benchmarks/wal_throughput.py --threads 8 --seconds 3
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
+from kv_store import KVStore
+from durability import Storage
+
+
+def run(policy, threads, seconds, keys, directory):
+    store = KVStore()
+    storage = None
+    if policy != "memory":
+        storage = Storage(store, directory, fsync_policy=policy, snapshot_every=50000)
+        storage.recover()
+    counts = [0] * threads
+    stop = time.perf_counter() + seconds
+
+    def worker(index):
+        n = 0
+        while time.perf_counter() < stop:
+            store.incr(f"k{(index * 7919 + n) % keys}")
+            if storage:
+                storage.wait(store.version)
+            n += 1
+        counts[index] = n
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    recovered = None
+    if storage:
+        if policy == "interval":
+            time.sleep(2 * storage.fsync_interval)
+        storage.wait(store.version)
+        copy = KVStore()
+        Storage(copy, directory, fsync_policy="batch").recover()
+        recovered = copy.to_dict() == store.to_dict()
+    return sum(counts) / seconds, recovered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WAL fsync policy throughput.")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--keys', type=int, default=1000)
+    parser.add_argument('--dir', help="Directory for the WAL (default: a temporary directory).")
+    args = parser.parse_args()
+
+    print(f"{'policy':<10}{'ops/s':>10}{'vs memory':>11}{'recovered':>11}")
+    baseline = None
+    for policy in ("memory", "interval", "batch", "always"):
+        directory = tempfile.mkdtemp(prefix="wal-", dir=args.dir)
+        try:
+            rate, recovered = run(policy, args.threads, args.seconds, args.keys, directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        baseline = baseline or rate
+        print(f"{policy:<10}{rate:>10.0f}{rate / baseline:>10.2f}x{'-' if recovered is None else str(recovered):>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,15 @@
+import errno
 import socket
 import json
+import os
+import stat
+import sys
+import tempfile
 import time
+import weakref
+from socket_tuning import tune_socket, tune_listener
+from logger import get_logger
+import metrics
 
 # Define color functions for printing
 def printG(skk): print(f"\033[92m{skk}\033[00m")         # Green
@@ -19,46 +28,200 @@ def create_message(component_id, message_type, **kwargs):
         **kwargs
     }
 
+BIND_RETRY = float(os.environ.get("BIND_RETRY", 0.05))  # First delay before retry_bind retries a busy address
+BIND_TIMEOUT = float(os.environ.get("BIND_TIMEOUT", 30))  # Seconds retry_bind keeps retrying before it gives up
+
+SEND_SECONDS = metrics.histogram("send_seconds", "Time spent in sendall() per message")
+_message_metrics = {}
+
+def count_message(direction, message_type, size):
+    """Counts a sent/received message and its size, per message type."""
+    key = (direction, message_type)
+    pair = _message_metrics.get(key)
+    if pair is None:
+        pair = _message_metrics[key] = (
+            metrics.counter(f"messages_{direction}", f"Messages {direction}", type=message_type),
+            metrics.counter(f"bytes_{direction}", f"Bytes {direction}", type=message_type),
+        )
+    pair[0].inc()
+    pair[1].inc(size)
+
+# Messages are newline-delimited JSON (json.dumps never emits a raw newline).
+# Bytes read past the end of a message are kept here until the next receive() on that socket.
+_receive_buffers = weakref.WeakKeyDictionary()
+
 def send(sock, message, receiver, print_message=True):
     """Sends a message through the provided socket."""
     try:
-        sock.sendall(json.dumps(message).encode())
+        data = json.dumps(message).encode() + b"\n"
+        start = time.perf_counter()
+        sock.sendall(data)
+        SEND_SECONDS.observe(time.perf_counter() - start)
+        count_message("sent", message.get("message"), len(data))
+        if print_message:
+            print_log(message, receiver, sent=True)
+    except socket.error as e:
+        print(f"\033[91mFailed to send message to {receiver}: {e}\033[00m")
+        raise
+
+def send_framed(sock, message, payload, receiver, print_message=True):
+    """
+    Sends a message followed by payload (bytes without a newline) as a raw line of its
+    own, in one write, so the receiver gets the exact bytes (see receive_frame()).
+    """
+    try:
+        data = json.dumps(message).encode() + b"\n"
+        start = time.perf_counter()
+        if hasattr(sock, "sendmsg"):
+            pending = [memoryview(data), memoryview(payload), memoryview(b"\n")]
+            while pending:
+                sent = sock.sendmsg(pending)
+                while pending and sent >= len(pending[0]):
+                    sent -= len(pending.pop(0))
+                if sent:
+                    pending[0] = pending[0][sent:]
+        else:
+            sock.sendall(data + payload + b"\n")
+        SEND_SECONDS.observe(time.perf_counter() - start)
+        count_message("sent", message.get("message"), len(data) + len(payload) + 1)
         if print_message:
             print_log(message, receiver, sent=True)
     except socket.error as e:
         print(f"\033[91mFailed to send message to {receiver}: {e}\033[00m")
         raise
 
+IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") and "SC_IOV_MAX" in os.sysconf_names else 1024
+
+def send_many(sock, messages, receiver, print_message=True):
+    """Sends several messages with one vectored write (sendmsg) instead of one sendall() each."""
+    try:
+        buffers = [json.dumps(message).encode() + b"\n" for message in messages]
+        start = time.perf_counter()
+        if hasattr(sock, "sendmsg"):
+            pending, first = [memoryview(data) for data in buffers], 0
+            while first < len(pending):
+                sent = sock.sendmsg(pending[first:first + IOV_MAX])
+                # Skip what was written; a partial write leaves the rest of one buffer
+                while first < len(pending) and sent >= len(pending[first]):
+                    sent -= len(pending[first])
+                    first += 1
+                if sent:
+                    pending[first] = pending[first][sent:]
+        else:
+            sock.sendall(b"".join(buffers))
+        SEND_SECONDS.observe(time.perf_counter() - start)
+        for message, data in zip(messages, buffers):
+            count_message("sent", message.get("message"), len(data))
+            if print_message:
+                print_log(message, receiver, sent=True)
+    except socket.error as e:
+        print(f"\033[91mFailed to send messages to {receiver}: {e}\033[00m")
+        raise
+
 def receive(sock, receiver, print_message=True):
+    """
+    Receives one message. Returns None if the peer closed the connection, the socket
+    timed out or would block (partial data is kept for the next call), or the message is invalid.
+    """
+    line = receive_frame(sock)
+    if line is None:
+        return None
     try:
-        data = sock.recv(1024).decode()
-        if not data:
-            return None
-        message = json.loads(data)
+        message = json.loads(line)
+        count_message("received", message.get("message"), len(line) + 1)
         if print_message:
             print_log(message, receiver, sent=False)
         return message
-    except (socket.error, json.JSONDecodeError) as e:
+    except (json.JSONDecodeError, UnicodeDecodeError):
         return None
 
+def receive_frame(sock):
+    """Receives one line as raw bytes (without the newline), e.g. a send_framed() payload. None like receive()."""
+    buffer = _receive_buffers.get(sock, b"")
+    try:
+        while b"\n" not in buffer:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return None
+            buffer += chunk
+        line, _, buffer = buffer.partition(b"\n")
+        return line
+    except socket.error:
+        return None
+    finally:
+        _receive_buffers[sock] = buffer
+
+def has_buffered_message(sock):
+    """True if a complete message is already buffered for this socket (so select() would not report it)."""
+    return b"\n" in _receive_buffers.get(sock, b"")
+
+def has_buffered_data(sock):
+    """True if bytes read from this socket are still buffered, whether or not they make up a whole message."""
+    return bool(_receive_buffers.get(sock))
+
 def print_log(message, receiver, sent=True):
-    """Formats and prints log messages consistently."""
-    message_type = message.get("message", "Unknown")
-    timestamp = message.get("timestamp", "Unknown")
-    sender = message.get("component_id", "Unknown")
-    details = {k: v for k, v in message.items() if k not in ["component_id", "timestamp", "message"]}
-    color = "\033[96m" if sent else "\033[95m"  # Cyan for sent, Purple for received
-    reset = "\033[00m"
-    
-    print(f"{color}{timestamp}: {sender} \u2192 {receiver} ({message_type}){reset}")
-    if details:
-        for key, value in details.items():
-            print(f"{color}  {key}: {value}{reset}")
+    """Queues a sent/received message for the logger's sinks; formatting and printing happen off the caller's thread."""
+    get_logger().log("INFO", "message sent" if sent else "message received",
+                     sample_key=message.get("message"), message=message, receiver=receiver)
+
+def load_env_file(script):
+    """
+    Loads the first .env file found from the script's directory upwards into os.environ,
+    as load_dotenv() does from a script; python-dotenv is imported only if there is one.
+    """
+    directory = os.path.dirname(os.path.abspath(script))
+    while True:
+        path = os.path.join(directory, ".env")
+        if os.path.isfile(path):
+            from dotenv import load_dotenv
+            load_dotenv(path)
+            return
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return
+        directory = parent
+
+def env_port(name, default):
+    """Reads a port from the environment, e.g. env_port("GFD_PORT", 12345)."""
+    return int(os.environ.get(name, default))
+
+def server_port(server_id, name, default):
+    """
+    Port of a specific server, so several servers can share one host.
+    server_port("S2", "CHECKPOINT_PORT", 12347) reads S2_CHECKPOINT_PORT, then CHECKPOINT_PORT, then the default.
+    """
+    return int(os.environ.get(f"{server_id}_{name}", os.environ.get(name, default)))
+
+UNIX_PREFIX = "unix:"
+
+def is_unix_address(ip):
+    """True for a unix:<path prefix> address, which names Unix domain sockets instead of a host."""
+    return isinstance(ip, str) and ip.startswith(UNIX_PREFIX)
+
+def unix_socket_path(ip, port):
+    """
+    Socket file for port at a unix: address: unix:/run/replica/s1 with port 12346 is
+    /run/replica/s1-12346.sock, so a component keeps one address for all its listeners.
+    """
+    return f"{ip[len(UNIX_PREFIX):]}-{port}.sock"
+
+def format_address(ip, port):
+    return unix_socket_path(ip, port) if is_unix_address(ip) else f"{ip}:{port}"
+
+def listen_address(address, default='0.0.0.0'):
+    """Where a component listens: its own address if that is a unix: address (peers dial the same path), else default."""
+    return address if is_unix_address(address) else default
 
-def connect_to_socket(ip, port, timeout=5):
-    """Attempts to connect to a socket and returns the socket object."""
+def connect_to_socket(ip, port, timeout=5, profile=None):
+    """
+    Attempts to connect to a socket and returns the socket object, tuned with the given socket profile.
+    ip may be a unix: address (see unix_socket_path).
+    """
+    if is_unix_address(ip):
+        return connect_to_unix_socket(unix_socket_path(ip, port), timeout, profile)
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tune_socket(sock, profile)
         sock.settimeout(timeout)
         sock.connect((ip, port))
         sock.settimeout(None)  # Disable timeout after connection
@@ -68,36 +231,127 @@ def connect_to_socket(ip, port, timeout=5):
         return None  # Red for errors
     
 
-def initialize_component(component_id, component_name, ip, port, max_connections):
+def local_socket_path(name, port):
+    """
+    Unix domain socket path standing in for 127.0.0.1:port, for components on the same
+    host: $<name>_SOCKET if set, else <tmp>/<name>-<port>.sock.
+    """
+    return os.environ.get(f"{name}_SOCKET") or os.path.join(tempfile.gettempdir(), f"{name.lower()}-{port}.sock")
+
+def connect_to_unix_socket(path, timeout=5, profile=None):
+    """Like connect_to_socket, for a Unix domain socket listening at path."""
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        tune_socket(sock, profile)  # Buffer sizes apply; the TCP options are skipped
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.settimeout(None)
+        return sock
+    except socket.error as e:
+        print(f"\033[91mFailed to connect to {path}: {e}\033[00m")
+        return None
+
+def create_unix_listener(path, max_connections, profile=None):
+    """
+    Creates a listening Unix domain socket at path, replacing a socket file left behind
+    by an earlier run. Raises OSError (EADDRINUSE) if a live server still listens there.
+    """
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    probe.setblocking(False)  # A live listener with a full backlog would block connect() instead of refusing it
+    try:
+        try:
+            probe.connect(path)
+        except BlockingIOError:
+            pass  # Backlog full: someone is listening
+        raise OSError(errno.EADDRINUSE, f"{path} is in use by a running server")
+    except ConnectionRefusedError:
+        if stat.S_ISSOCK(os.lstat(path).st_mode):
+            os.unlink(path)  # Nobody accepts on it: left behind by a process that exited
+    except FileNotFoundError:
+        pass
+    finally:
+        probe.close()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        tune_socket(sock, profile)
+        sock.bind(path)
+        sock.listen(max_connections)
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+def retry_bind(create, address):
+    """
+    Returns create(), a new listening socket, retrying while the address cannot be bound
+    (e.g. while the process being replaced still holds it), first after BIND_RETRY seconds
+    and then twice as long each time, up to a second. Raises the last error once
+    BIND_TIMEOUT seconds have passed. address names the listener in the error.
+    """
+    deadline = time.monotonic() + BIND_TIMEOUT
+    delay = BIND_RETRY
+    while True:
+        try:
+            return create()
+        except socket.error as e:
+            if time.monotonic() + delay > deadline:
+                printR(f"Could not listen on {address} within {BIND_TIMEOUT} seconds: {e}")
+                raise
+            time.sleep(delay)
+            delay = min(1, delay * 2)
+
+def create_listener(ip, port, max_connections, profile=None, reuse_port=False):
+    """
+    Creates a tuned listening socket, retrying a busy address (see retry_bind). ip may be
+    a unix: address; Unix domain sockets have no SO_REUSEPORT, so reuse_port is ignored.
+    """
+    if is_unix_address(ip):
+        path = unix_socket_path(ip, port)
+        return retry_bind(lambda: create_unix_listener(path, max_connections, profile), path)
+    return retry_bind(lambda: _create_tcp_listener(ip, port, max_connections, profile, reuse_port), format_address(ip, port))
+
+def _create_tcp_listener(ip, port, max_connections, profile, reuse_port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        tune_listener(sock, profile, reuse_port)
+        sock.bind((ip, port))
+        sock.listen(max_connections)
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+def initialize_component(component_id, component_name, ip, port, max_connections, profile=None, reuse_port=False):
     """
     Initializes a component by setting up its socket and printing startup details.
 
     Args:
         component_id (str): Identifier for the component (e.g., "RM", "GFD").
-        ip (str): IP address the component will bind to.
+        ip (str): IP address the component will bind to, or a unix: address.
         port (int): Port the component will bind to.
         max_connections (int): Maximum number of connections the component will allow (default is 1).
+        profile (str or dict): Socket tuning profile (see socket_tuning.py); defaults to $SOCKET_PROFILE or "latency".
+        reuse_port (bool): Set SO_REUSEPORT so several processes can accept on the same port.
     
     Returns:
         socket.socket: The initialized and bound socket.
     """
     print("=====================================================")
     print(f"      {component_name} ({component_id})       ")
-    print(f"{component_id} active on {ip}:{port}")
+    print(f"{component_id} active on {format_address(ip, port)}")
     print("-----------------------------------------------------")
 
-    while True:
-        try:
-            # Create and configure the socket
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.bind((ip, port))
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            sock.listen(max_connections)
-            break
-        except: 
-            time.sleep(1)
-            continue
-        
+    return create_listener(ip, port, max_connections, profile, reuse_port)
 
-    return sock
+def wait_until_activated():
+    """
+    Called by a server before main(). In a warm standby (SERVER_STANDBY=1, spawned by an
+    LFD's Supervisor) it blocks until the supervisor writes a line to stdin, so interpreter
+    start, imports and configuration are already done when the server is needed. An
+    EOF means the supervisor is gone, and the standby exits.
+    """
+    if os.environ.get("SERVER_STANDBY") != "1":
+        return
+    if not sys.stdin.readline():
+        sys.exit(0)
 
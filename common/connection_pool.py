@@ -0,0 +1,126 @@
+import socket
+import select
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from communication_utils import *
+
+
+class ConnectionPool:
+    """
+    Keeps outgoing connections open between requests so callers don't pay a TCP
+    handshake every time they talk to the same (host, port).
+
+    Callers lease a socket, use it, then release it back. A socket that failed
+    mid-use should be discarded instead so it is never handed out again.
+    """
+
+    def __init__(self, max_idle=30, max_idle_per_endpoint=4, timeout=5, profile=None):
+        self.max_idle = max_idle                            # Seconds an unused connection may sit in the pool
+        self.max_idle_per_endpoint = max_idle_per_endpoint  # Idle connections kept per (host, port)
+        self.timeout = timeout                              # Connect timeout for new connections
+        self.profile = profile                              # Socket tuning profile for new connections
+        self.idle = defaultdict(list)                       # (host, port) -> [(sock, released_at)]
+        self.leased = {}                                    # sock -> (host, port)
+        self.lock = threading.Lock()
+
+    def lease(self, host, port):
+        """Returns a healthy connection to (host, port), reusing an idle one when possible."""
+        key = (host, port)
+        with self.lock:
+            self._evict_idle()
+            idle = self.idle[key]
+            while idle:
+                sock, _ = idle.pop()
+                if is_healthy(sock):
+                    self.leased[sock] = key
+                    return sock
+                sock.close()
+
+        sock = connect_to_socket(host, port, self.timeout, self.profile)
+        if sock:
+            with self.lock:
+                self.leased[sock] = key
+        return sock
+
+    def release(self, sock):
+        """Returns a leased connection to the pool for reuse."""
+        with self.lock:
+            key = self.leased.pop(sock, None)
+            if key is None:
+                return
+            idle = self.idle[key]
+            if len(idle) < self.max_idle_per_endpoint:
+                idle.append((sock, time.time()))
+                return
+        sock.close()
+
+    def discard(self, sock):
+        """Closes a leased connection that must not be reused (e.g. after a send/receive error)."""
+        with self.lock:
+            self.leased.pop(sock, None)
+        try:
+            sock.close()
+        except socket.error:
+            pass
+
+    @contextmanager
+    def connection(self, host, port):
+        """Leases a connection for the duration of a with-block; errors discard it instead of releasing it."""
+        sock = self.lease(host, port)
+        if sock is None:
+            raise ConnectionError(f"Unable to connect to {host}:{port}")
+        try:
+            yield sock
+        except Exception:
+            self.discard(sock)
+            raise
+        else:
+            self.release(sock)
+
+    def evict_idle(self):
+        """Closes idle connections older than max_idle."""
+        with self.lock:
+            self._evict_idle()
+
+    def close_all(self):
+        """Closes every idle and leased connection."""
+        with self.lock:
+            for idle in self.idle.values():
+                for sock, _ in idle:
+                    sock.close()
+            self.idle.clear()
+            for sock in list(self.leased.keys()):
+                sock.close()
+            self.leased.clear()
+
+    def _evict_idle(self):
+        cutoff = time.time() - self.max_idle
+        for key, idle in list(self.idle.items()):
+            fresh = []
+            for sock, released_at in idle:
+                if released_at < cutoff:
+                    sock.close()
+                else:
+                    fresh.append((sock, released_at))
+            if fresh:
+                self.idle[key] = fresh
+            else:
+                del self.idle[key]
+
+
+def is_healthy(sock):
+    """
+    Checks an idle connection without blocking. An idle socket should have nothing
+    to read; if it is readable the peer has closed it, reset it, or sent stray data,
+    and none of those are safe to reuse. Neither is one whose earlier receive() read
+    past the last message: the next reply would be parsed after those bytes.
+    """
+    try:
+        if sock.fileno() < 0 or has_buffered_data(sock):
+            return False
+        readable, _, errored = select.select([sock], [], [sock], 0)
+        return not readable and not errored
+    except (socket.error, ValueError):
+        return False
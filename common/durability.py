@@ -0,0 +1,261 @@
+import glob
+import json
+import os
+import threading
+import time
+
+import metrics
+from snapshot_file import MappedSnapshot, write_snapshot
+
+FSYNC_POLICIES = ("always", "batch", "interval")
+SNAPSHOT_READ_KEYS = 4096  # Keys copied per hold of the store lock while snapshotting
+
+FSYNC_SECONDS = metrics.histogram("wal_fsync_seconds", "Time per WAL write + fsync")
+RECORDS_PER_FSYNC = metrics.counter("wal_records", "Records made durable (records / fsyncs = group commit size)")
+FSYNCS = metrics.counter("wal_fsyncs", "WAL fsync calls")
+SNAPSHOTS = metrics.counter("wal_snapshots", "Snapshots written")
+
+
+class Storage:
+    """
+    Write-ahead log plus snapshots for a KVStore.
+
+    The store calls record() under its lock for every mutation, so WAL records are
+    appended in version order as [version, key, value] (value None for a delete).
+    Callers make a reply durable with wait(version) before sending it:
+
+        always    record() writes and fsyncs every mutation before the store lock is
+                  released, so writes are serialized on fsync
+        batch     group commit: the first waiter writes and fsyncs everything queued
+                  so far; waiters covered by that fsync return without their own
+        interval  wait() returns at once; a writer thread fsyncs every fsync_interval
+                  (up to one interval of acknowledged writes can be lost)
+
+    Every snapshot_every records the WAL is rotated and the store written to
+    snapshot-<first segment not covered>.kvs (see snapshot_file) on a background
+    thread, so no request waits for the dump; recover() maps the newest snapshot and
+    replays the newer WAL segments, so restart time depends on snapshot_every rather
+    than on the size of the store.
+    """
+
+    def __init__(self, store, directory, fsync_policy="batch", fsync_interval=0.05, snapshot_every=10000):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync_policy}', expected one of {FSYNC_POLICIES}")
+        self.store = store
+        self.directory = directory
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        os.makedirs(directory, exist_ok=True)
+
+        self.pending = []             # Encoded records not yet written
+        self.pending_version = 0      # Version of the newest pending record
+        self.durable_version = 0
+        self.records_since_snapshot = 0
+        self.segment = None
+        self.wal = None
+        self.io_lock = threading.Lock()           # Serializes writes, fsyncs and rotation
+        self.durable = threading.Lock()           # Guards pending/durable_version
+        self.snapshot_lock = threading.Lock()     # One snapshot at a time, so segments are deleted in order
+        self.snapshotting = False                 # A background snapshot is running (guarded by io_lock)
+        self.writer = None
+
+    # Recovery
+
+    def recover(self):
+        """Maps the newest snapshot and replays newer WAL records into the store. Returns the records replayed."""
+        version, first_segment = 0, 0
+        snapshots = self._numbered("snapshot-", ".kvs")
+        if snapshots:
+            first_segment = snapshots[-1]
+            self.store.load_mapped(MappedSnapshot(self._snapshot_path(first_segment)))
+            version = self.store.version
+        lineage = self.store.lineage
+
+        replayed = 0
+        for segment in self._numbered("wal-", ".log"):
+            if segment < first_segment:
+                continue
+            with open(self._segment_path(segment)) as f:
+                for line in f:
+                    try:
+                        record_version, key, value = json.loads(line)
+                    except ValueError:
+                        break  # Torn write at the tail of the last segment
+                    if key is None:
+                        # A lineage change (store.fork()): versions from here on count a new
+                        # history, so they are not compared with the old one's
+                        if value == lineage:
+                            continue  # Already the snapshot's lineage
+                        lineage = value
+                    # Records at the snapshot's own version are re-applied: a delta from a
+                    # peer logs several keys at one version, and rewriting a value is harmless
+                    elif record_version < version:
+                        continue
+                    self.store.replay(record_version, key, value)
+                    version = record_version
+                    replayed += 1
+
+        self.durable_version = self.pending_version = version
+        self._open_segment((self._numbered("wal-", ".log") or [first_segment - 1])[-1] + 1)
+        self.store.journal = self.record
+        if self.fsync_policy == "interval":
+            self.writer = threading.Thread(target=self._run, daemon=True)
+            self.writer.start()
+        return replayed
+
+    # Logging
+
+    def record(self, version, key, value):
+        """Called by the store, under its lock, for every mutation."""
+        line = json.dumps([version, key, value]) + "\n"
+        with self.durable:
+            self.pending.append(line)
+            self.pending_version = version
+        if self.fsync_policy == "always":
+            with self.io_lock:
+                self._write_pending()
+
+    def wait(self, version):
+        """Returns once every record up to version is durable (per the fsync policy)."""
+        if self.fsync_policy == "batch":
+            while self.durable_version < version:
+                with self.io_lock:
+                    # Whoever gets the lock first fsyncs for everyone queued behind it
+                    if self.durable_version < version:
+                        self._write_pending()
+        self._snapshot_if_due()
+
+    def _write_pending(self):
+        """Writes and fsyncs every pending record. Caller holds io_lock."""
+        with self.durable:
+            lines, version = self.pending, self.pending_version
+            self.pending = []
+        if lines:
+            start = time.perf_counter()
+            self.wal.write("".join(lines))
+            self.wal.flush()
+            os.fsync(self.wal.fileno())
+            FSYNC_SECONDS.observe(time.perf_counter() - start)
+            FSYNCS.inc()
+            RECORDS_PER_FSYNC.inc(len(lines))
+            self.records_since_snapshot += len(lines)
+        with self.durable:
+            self.durable_version = max(self.durable_version, version)
+
+    def _snapshot_if_due(self):
+        """Starts a background snapshot once snapshot_every records have been written since the last one."""
+        if self.records_since_snapshot >= self.snapshot_every and not self.snapshotting and self.io_lock.acquire(blocking=False):
+            # Only one thread starts the snapshot; the others, and this one, carry on
+            try:
+                due = self.records_since_snapshot >= self.snapshot_every and not self.snapshotting
+                if due:
+                    self.records_since_snapshot = 0
+                    self.snapshotting = True
+            finally:
+                self.io_lock.release()
+            if due:
+                threading.Thread(target=self._snapshot_in_background, daemon=True).start()
+
+    def _snapshot_in_background(self):
+        try:
+            self.snapshot()
+        finally:
+            self.snapshotting = False
+
+    def _run(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            with self.io_lock:
+                self._write_pending()
+            self._snapshot_if_due()
+
+    # Snapshots
+
+    def snapshot(self):
+        """
+        Rotates the WAL, then writes the whole store to a new snapshot file (atomically,
+        via rename) and deletes the older snapshots and the segments it covers. Records
+        appended after the rotation may also be in the snapshot; recover() skips them
+        by version.
+        """
+        with self.snapshot_lock:
+            with self.io_lock:
+                self._write_pending()
+                next_segment = self.segment + 1
+                self._open_segment(next_segment)
+                self.records_since_snapshot = 0
+
+            view = self.store.view()  # Read a piece at a time, so writers are not held up for the whole copy
+            data = {}
+            while True:
+                entries = view.read(SNAPSHOT_READ_KEYS)
+                if not entries:
+                    break
+                data.update(entries)
+            version, lineage = view.version, view.lineage
+            path = self._snapshot_path(next_segment)
+            with open(path + ".tmp", "wb") as f:
+                write_snapshot(f, data, version, lineage)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            _fsync_directory(self.directory)
+            for snapshot in self._numbered("snapshot-", ".kvs"):
+                if snapshot < next_segment:
+                    os.remove(self._snapshot_path(snapshot))  # A store reading through it keeps its mapping
+            for segment in self._numbered("wal-", ".log"):
+                if segment < next_segment:
+                    os.remove(self._segment_path(segment))
+            SNAPSHOTS.inc()
+
+    def _open_segment(self, segment):
+        if self.wal:
+            self.wal.close()
+        self.segment = segment
+        self.wal = open(self._segment_path(segment), "a")
+        _fsync_directory(self.directory)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"wal-{segment:08d}.log")
+
+    def _snapshot_path(self, segment):
+        return os.path.join(self.directory, f"snapshot-{segment:08d}.kvs")
+
+    def _numbered(self, prefix, suffix):
+        """Sorted numbers of the files named <prefix><8 digits><suffix>."""
+        paths = glob.glob(os.path.join(self.directory, f"{prefix}*{suffix}"))
+        return sorted(int(os.path.basename(path)[len(prefix):-len(suffix)]) for path in paths)
+
+
+def _fsync_directory(directory):
+    """Makes file creations/renames in directory durable (a no-op where directories cannot be opened)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def open_storage(store, component_id):
+    """
+    Returns a recovered Storage for this server when $DATA_DIR is set, else None.
+        DATA_DIR        directory; each server uses DATA_DIR/<server ID>
+        FSYNC_POLICY    always / batch / interval (default batch)
+        FSYNC_INTERVAL  seconds between fsyncs for the interval policy (default 0.05)
+        SNAPSHOT_EVERY  WAL records between snapshots (default 10000)
+    """
+    directory = os.environ.get("DATA_DIR")
+    if not directory:
+        return None
+    storage = Storage(
+        store, os.path.join(directory, component_id or "server"),
+        fsync_policy=os.environ.get("FSYNC_POLICY", "batch"),
+        fsync_interval=float(os.environ.get("FSYNC_INTERVAL", 0.05)),
+        snapshot_every=int(os.environ.get("SNAPSHOT_EVERY", 10000)),
+    )
+    storage.recovered = storage.recover()
+    return storage
@@ -1,15 +1,37 @@
 import socket
+import argparse
+import os
 import time
 import threading
 from communication_utils import *
+from heartbeat import HeartbeatMonitor
+from gossip import GossipMember, gossip_membership, ALIVE, DEAD
+import metrics
 
 COMPONENT_ID = "GFD"
 membership = {}
 lfd_connections = {}  # Map LFD component IDs to their connections
 member_count = 0
+membership_epoch = 0    # Bumped on every membership change
 lock = threading.Lock()
 rm_socket = None
 heartbeat_interval = 5
+heartbeat_sent_at = {}  # LFD component ID -> perf_counter() of the last heartbeat sent to it
+lfd_monitors = {}       # LFD component ID -> HeartbeatMonitor, for LFDs heartbeated over UDP
+gossip = None           # GossipMember when MEMBERSHIP=gossip
+gossip_replicas = {}    # LFD component ID -> (the replica its gossip entry reports, that replica's registration number)
+gossip_commands = {}    # LFD component ID -> {command: {"seq", "server_id"}}, published in the GFD's gossip entry
+command_seq = int(time.time() * 1000)  # Numbers gossip_commands, so an LFD acts on each once; a restarted GFD keeps counting up
+lease_monitor = None    # HeartbeatMonitor renewing the primary's lease when membership is gossiped
+
+# Primary lease, granted on the RM's behalf and renewed with every heartbeat to the primary's LFD
+primary_server = None
+lease_duration = 0      # Seconds, from the RM's new_primary; 0 means leases are off
+lease_holder = None
+lease_expires = 0.0     # time.monotonic() at which the last lease granted to lease_holder ends
+
+MEMBERSHIP_SIZE = metrics.gauge("gfd_membership_size", "Replicas currently in the membership")
+CONNECTED_LFDS = metrics.gauge("gfd_connected_lfds", "LFDs currently connected")
 
 def register_with_rm(rm_ip, rm_port):
     """Registers GFD with RM by opening a persistent connection and sending the initial member count."""
@@ -31,8 +53,13 @@ def handle_lfd_connection(conn, addr):
         # Retrieve and print the component_id from the LFD's registration message
         component_id = message.get("component_id", "Unknown")
         printP(f"Received registration from {component_id} at {addr}")
-        lfd_connections[component_id] = conn  # Store the LFD connection
-        threading.Thread(target=send_heartbeat_continuously, args=(conn, addr, component_id), daemon=True).start()
+        with lock:
+            lfd_connections[component_id] = conn  # Store the LFD connection
+        CONNECTED_LFDS.set(len(lfd_connections))
+        if message.get("heartbeat_port") and isinstance(addr, tuple):
+            threading.Thread(target=monitor_lfd, args=(conn, (addr[0], message["heartbeat_port"]), component_id), daemon=True).start()
+        else:
+            threading.Thread(target=send_heartbeat_continuously, args=(conn, addr, component_id), daemon=True).start()
 
         # Handle further messages from this LFD in a loop
         while True:
@@ -50,7 +77,12 @@ def handle_lfd_connection(conn, addr):
         printR(f"Error receiving message from LFD at {addr}: {e}")
     finally:
         conn.close()
-        lfd_connections.pop(component_id, None)  # Remove the LFD connection on disconnect
+        with lock:
+            lfd_connections.pop(component_id, None)  # Remove the LFD connection on disconnect
+        monitor = lfd_monitors.pop(component_id, None)
+        if monitor:
+            monitor.stop()
+        CONNECTED_LFDS.set(len(lfd_connections))
 
 def handle_lfd_message(message):
     action = message.get("message", "")
@@ -60,55 +92,148 @@ def handle_lfd_message(message):
     elif action == "remove replica" and server_id:
         delete_replica(server_id)
     elif action == "heartbeat acknowledgment":
-        pass
+        component_id = message.get("component_id")
+        sent_at = heartbeat_sent_at.pop(component_id, None)
+        if sent_at is not None:
+            metrics.histogram("gfd_heartbeat_rtt_seconds", "GFD to LFD heartbeat round trip", lfd=component_id).observe(time.perf_counter() - sent_at)
     else:
         printLP(f"Unknown action '{action}' from LFD")
 
+def forward_to_lfd(server_id, message):
+    """
+    Sends a command to the LFD of server_id; False if that LFD is not connected. With
+    gossip membership the LFDs keep no connection to the GFD: the command goes into the
+    GFD's gossip entry, which reaches every LFD, and its LFD is pinged at once.
+    """
+    global command_seq
+    lfd_id = f"LFD{server_id[-1]}"
+    if gossip:
+        entry = gossip.view().get(lfd_id)
+        if not entry or entry["status"] == DEAD:
+            return False
+        with lock:
+            command_seq += 1
+            gossip_commands.setdefault(lfd_id, {})[message["message"]] = {"seq": command_seq, "server_id": server_id}
+            commands = {lfd: dict(pending) for lfd, pending in gossip_commands.items()}
+        gossip.update_data(commands=commands)
+        gossip.push(lfd_id)
+        return True
+    lfd_connection = lfd_connections.get(lfd_id)
+    if not lfd_connection:
+        return False
+    send(lfd_connection, message, lfd_id)
+    return True
+
 def handle_rm_message(message):
     """Handles messages from the RM."""
-    global lfd_connections
     action = message.get("message", "")
     server_id = message.get("server_id", "")
     if action == "recover_server" and server_id:
-        lfd_connection = lfd_connections.get(f"LFD{server_id[-1]}")
-        if lfd_connection:
-            try:
-                recovery_message = create_message(COMPONENT_ID, "recover_server", server_id=server_id)
-                send(lfd_connection, recovery_message, f"LFD{server_id[-1]}")
+        try:
+            recovery_message = create_message(COMPONENT_ID, "recover_server", server_id=server_id)
+            if forward_to_lfd(server_id, recovery_message):
                 printG(f"Forwarded recovery message to LFD for server {server_id}")
-            except socket.error as e:
-                printR(f"Failed to forward recovery message to LFD for server {server_id}: {e}")
-        else:
-            printR(f"No LFD found for server {server_id}. Recovery message not sent.")
+            else:
+                printR(f"No LFD found for server {server_id}. Recovery message not sent.")
+        except socket.error as e:
+            printR(f"Failed to forward recovery message to LFD for server {server_id}: {e}")
     elif action == "new_primary" and server_id:
-        lfd_connection = lfd_connections.get(f"LFD{server_id[-1]}")
-        if lfd_connection:
-            try:
-                election_message = create_message(COMPONENT_ID, "new_primary", server_id=server_id)
-                send(lfd_connection, election_message, f"LFD{server_id[-1]}")
+        global primary_server, lease_duration
+        primary_server, lease_duration = server_id, message.get("lease", 0)
+        if lease_monitor:
+            lease_monitor.stop()  # renew_primary_lease() moves on to the new primary's LFD
+        try:
+            # With gossip the lease is not in the command: it comes with the UDP heartbeats renew_primary_lease() sends
+            election_message = create_message(COMPONENT_ID, "new_primary", server_id=server_id,
+                                              lease_seconds=None if gossip else grant_lease(server_id))
+            if forward_to_lfd(server_id, election_message):
                 printG(f"New Primary:  {server_id}")
-            except socket.error as e:
-                printR(f"Failed New Primary {server_id}: {e}")
-        else:
-            printR(f"No LFD found for server {server_id}. Election message not sent.")
+                get_logger().info("new primary forwarded", server_id=server_id)
+            else:
+                printR(f"No LFD found for server {server_id}. Election message not sent.")
+        except socket.error as e:
+            printR(f"Failed New Primary {server_id}: {e}")
     elif action == "new_reliable" and server_id:
-        lfd_connection = lfd_connections.get(f"LFD{server_id[-1]}")
-        if lfd_connection:
-            try:
-                reliable_message = create_message(COMPONENT_ID, "new_reliable", server_id=server_id)
-                send(lfd_connection, reliable_message, f"LFD{server_id[-1]}")
+        try:
+            reliable_message = create_message(COMPONENT_ID, "new_reliable", server_id=server_id)
+            if forward_to_lfd(server_id, reliable_message):
                 printG(f"New Reliable Server: {server_id}")
-            except socket.error as e:
-                printR(f"Failed to send reliable server message to {server_id}: {e}")
-        else:
-            printR(f"No LFD found for server {server_id}. Reliable server message not sent.")
+                get_logger().info("new reliable forwarded", server_id=server_id)
+            else:
+                printR(f"No LFD found for server {server_id}. Reliable server message not sent.")
+        except socket.error as e:
+            printR(f"Failed to send reliable server message to {server_id}: {e}")
+
 
+def grant_lease(server_id):
+    """
+    Grants or renews the primary lease for server_id and returns its length in seconds,
+    or None. Only a duration is sent: each hop (LFD, server) counts it down on its own
+    monotonic clock from when the grant arrives, so no two hosts' clocks are compared.
+    A new holder only gets a lease once the previous holder's has run out, so a deposed
+    primary can never serve reads while its successor accepts writes.
+    """
+    global lease_holder, lease_expires
+    with lock:
+        if not lease_duration or server_id != primary_server or server_id not in membership:
+            return None
+        now = time.monotonic()
+        if server_id != lease_holder:
+            if now < lease_expires:
+                return None
+            lease_holder = server_id
+        lease_expires = now + lease_duration
+        return lease_duration
+
+
+def lease_for(component_id):
+    """The lease to renew with a heartbeat to this LFD: only the primary's LFD gets one."""
+    return grant_lease(primary_server) if primary_server and component_id == f"LFD{primary_server[-1]}" else None
+
+def monitor_lfd(conn, address, component_id):
+    """
+    Heartbeats an LFD over UDP (it registered a heartbeat_port), apart from the TCP
+    connection that carries commands. An LFD that stops answering is cut off as if
+    its connection had dropped.
+    """
+    rtt = metrics.histogram("gfd_heartbeat_rtt_seconds", "GFD to LFD heartbeat round trip", lfd=component_id)
+    monitor = lfd_monitors[component_id] = HeartbeatMonitor(COMPONENT_ID, component_id, address, heartbeat_interval,
+                                                            fields=lambda: {"lease_seconds": lease_for(component_id)}, on_rtt=rtt.observe)
+    monitor.run()
+    if monitor.stopped:
+        return  # The connection closed first
+    printR(f"LFD {component_id} stopped answering heartbeats.")
+    get_logger().info("lfd unresponsive", lfd=component_id)
+    try:
+        conn.shutdown(socket.SHUT_RDWR)  # Wakes the connection's reader, which cleans up
+    except OSError:
+        pass
+    conn.close()
+
+def renew_primary_lease():
+    """
+    With gossip membership, the only heartbeats the GFD sends: UDP heartbeats to the
+    primary's LFD, at the heartbeat_port its gossip entry advertises, each renewing the
+    lease. Gossip decides membership, so a run that ends on missed heartbeats just starts over.
+    """
+    global lease_monitor
+    while True:
+        lfd_id = f"LFD{primary_server[-1]}" if primary_server else None
+        entry = gossip.view().get(lfd_id) if lfd_id else None
+        if not entry or entry["status"] == DEAD or not entry["data"].get("heartbeat_port"):
+            time.sleep(heartbeat_interval)
+            continue
+        rtt = metrics.histogram("gfd_heartbeat_rtt_seconds", "GFD to LFD heartbeat round trip", lfd=lfd_id)
+        lease_monitor = HeartbeatMonitor(COMPONENT_ID, lfd_id, (entry["address"][0], entry["data"]["heartbeat_port"]), heartbeat_interval,
+                                         fields=lambda: {"lease_seconds": lease_for(lfd_id)}, on_rtt=rtt.observe)
+        lease_monitor.run()
 
 def send_heartbeat_continuously(conn, addr, component_id):
-    """Sends heartbeat messages continuously to an LFD."""
+    """Sends heartbeat messages continuously to an LFD; the primary's LFD also gets the lease renewal."""
     while True:
         try:
-            message = create_message(COMPONENT_ID, "heartbeat")
+            message = create_message(COMPONENT_ID, "heartbeat", lease_seconds=lease_for(component_id))
+            heartbeat_sent_at[component_id] = time.perf_counter()
             send(conn, message, component_id)
             time.sleep(heartbeat_interval)
         except socket.error as e:
@@ -116,25 +241,56 @@ def send_heartbeat_continuously(conn, addr, component_id):
             conn.close()
             break
 
+def handle_gossip_change(member_id, entry):
+    """
+    Aggregates the LFDs' gossip: an LFD reporting a server adds it, and an LFD the group
+    declares dead, or one reporting no server, takes its replica out of the membership.
+    Gossip only keeps an LFD's latest entry, so a server that died and registered again
+    in between shows up as a new registration number: it is removed and added again.
+    """
+    if not member_id.startswith("LFD"):
+        return
+    replica, registration = entry["data"].get("replica"), entry["data"].get("registration")
+    previous = gossip_replicas.get(member_id)
+    if entry["status"] == DEAD or not replica:
+        with lock:
+            gossip_replicas.pop(member_id, None)
+        if previous:
+            if entry["status"] == DEAD:
+                get_logger().info("lfd declared dead", lfd=member_id, server_id=previous[0])
+            delete_replica(previous[0])
+    elif entry["status"] == ALIVE:
+        if previous and previous != (replica, registration):
+            delete_replica(previous[0])  # Restarted (or replaced) since we last heard
+        with lock:
+            gossip_replicas[member_id] = (replica, registration)
+        add_replica(replica)
+
 def add_replica(replica_id):
     """Adds a replica to the membership and notifies RM."""
-    global member_count
+    global member_count, membership_epoch
     with lock:
         if replica_id not in membership:
             membership[replica_id] = time.time()
             member_count += 1
+            membership_epoch += 1
+            MEMBERSHIP_SIZE.set(member_count)
             printG(f"Replica '{replica_id}' added to membership.")
+            get_logger().info("replica added", server_id=replica_id, member_count=member_count)
             print_membership()
             send_update_to_rm(replica_id)
 
 def delete_replica(server_id):
     """Removes a replica from the membership and notifies RM."""
-    global member_count
+    global member_count, membership_epoch
     with lock:
         if server_id in membership:
             del membership[server_id]
             member_count -= 1
+            membership_epoch += 1
+            MEMBERSHIP_SIZE.set(member_count)
             printR(f"Replica '{server_id}' deleted from membership.")
+            get_logger().info("replica removed", server_id=server_id, member_count=member_count)
             print_membership()
             send_update_to_rm(server_id)
 
@@ -148,6 +304,25 @@ def send_update_to_rm(server_id):
     else:
         printR("No active connection to RM.")
 
+def health():
+    """Status for /health and /ready: ready once connected to the RM."""
+    with lock:  # The metrics thread reads while handler threads change these
+        members, epoch = list(membership), membership_epoch
+        lfds = list(lfd_connections) if not gossip else list(gossip_replicas)
+        holder, expires = lease_holder, lease_expires
+    return {
+        "component": COMPONENT_ID,
+        "role": "gfd",
+        "ready": rm_socket is not None,
+        "membership": sorted(members),
+        "membership_epoch": epoch,
+        "lfds": sorted(lfds),
+        "primary": primary_server,
+        "lease_holder": holder,
+        "lease_remaining": max(0.0, expires - time.monotonic()) if holder else None,
+        "gossip_members": len(gossip.members) if gossip else None,
+    }
+
 def print_membership():
     """Prints the current membership list."""
     printP("Current Membership List:")
@@ -159,24 +334,40 @@ def print_membership():
         printP("  [No replicas currently in membership]")
 
 def main():
-    GFD_IP = '0.0.0.0'
-    GFD_PORT = 12345
-    RM_IP = '127.0.0.1'
-    RM_PORT = 12346
+    global heartbeat_interval, gossip
+    parser = argparse.ArgumentParser(description="Global Fault Detector (GFD).")
+    parser.add_argument('--heartbeat_freq', type=float, default=5, help="Heartbeat frequency in seconds (also the lease renewal period).")
+    args = parser.parse_args()
+    heartbeat_interval = args.heartbeat_freq
+
+    GFD_IP = listen_address(os.environ.get("GFD_IP"))
+    GFD_PORT = env_port("GFD_PORT", 12345)
+    RM_IP = os.environ.get("RM_IP", '127.0.0.1')
+    RM_PORT = env_port("RM_PORT", 12346)
 
     server_socket = initialize_component(COMPONENT_ID, "Global Fault Detector", GFD_IP, GFD_PORT, 5)
+    metrics.set_health(health)
+    metrics.start_metrics()
+
+    if gossip_membership():
+        advertised = os.environ.get("GFD_IP")
+        gossip = GossipMember(COMPONENT_ID, data={"role": "gfd"}, on_change=handle_gossip_change,
+                              port=env_port("GOSSIP_PORT", GFD_PORT),
+                              advertise=advertised if advertised and not is_unix_address(advertised) else None).start()
+        printP(f"Gossip membership on UDP {gossip.address[0]}:{gossip.address[1]}")
+        threading.Thread(target=renew_primary_lease, daemon=True).start()
 
     # Register with RM
     register_with_rm(RM_IP, RM_PORT)
 
+    # Listen for RM messages in a separate thread (one reader per socket)
+    if rm_socket:
+        threading.Thread(target=handle_rm_connection, args=(rm_socket,), daemon=True).start()
+
     try:
         while True:
             conn, addr = server_socket.accept()
             threading.Thread(target=handle_lfd_connection, args=(conn, addr), daemon=True).start()
-
-            # Listen for RM messages in a separate thread
-            if rm_socket:
-                threading.Thread(target=handle_rm_connection, args=(rm_socket,), daemon=True).start()
     except KeyboardInterrupt:
         printY("GFD interrupted by user.")
     finally:
@@ -188,8 +379,10 @@ def handle_rm_connection(sock):
     try:
         while True:
             message = receive(sock, COMPONENT_ID)
-            if message:
-                handle_rm_message(message)
+            if not message:
+                printR("Connection to RM lost.")
+                break
+            handle_rm_message(message)
     except socket.error as e:
         printR(f"Connection to RM lost: {e}")
 
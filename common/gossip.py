@@ -0,0 +1,328 @@
+import json
+import math
+import os
+import random
+import socket
+import threading
+import time
+
+from communication_utils import *
+import metrics
+
+MEMBERSHIP = os.environ.get("MEMBERSHIP", "gfd")                       # "gossip": LFDs run SWIM membership, the GFD aggregates it
+GOSSIP_INTERVAL = float(os.environ.get("GOSSIP_INTERVAL", 1))           # Protocol period: each member probes one other per period
+GOSSIP_INDIRECT = int(os.environ.get("GOSSIP_INDIRECT", 3))             # Members asked to probe a target that missed its ack
+GOSSIP_SUSPECT_PERIODS = float(os.environ.get("GOSSIP_SUSPECT_PERIODS", 3))  # Times log2(members): periods before a suspect is dead
+MAX_PIGGYBACK = 8       # Updates carried per message
+RETRANSMIT_MULT = 3     # Times log2(members): messages each update rides on
+JOIN_CHUNK = 50         # Members per datagram when answering a join
+
+ALIVE, SUSPECT, DEAD = "alive", "suspect", "dead"
+
+MESSAGES_SENT = metrics.counter("gossip_messages_sent", "Gossip datagrams sent")
+SUSPICIONS = metrics.counter("gossip_suspicions", "Members suspected after a failed direct and indirect probe")
+MEMBERS_ALIVE = metrics.gauge("gossip_members_alive", "Members this node believes alive, itself included")
+
+
+def gossip_membership():
+    return MEMBERSHIP == "gossip"
+
+
+class GossipMember:
+    """
+    SWIM membership over UDP. Every period a member probes one other member, taken
+    round robin from a shuffled list: a ping, and if no ack comes within a third of
+    the period, a ping_req through GOSSIP_INDIRECT other members, which ping the target
+    and relay its ack. A target that answers neither is suspected. Unless it refutes
+    the suspicion by gossiping a higher incarnation, it is declared dead after
+    GOSSIP_SUSPECT_PERIODS * log2(members) periods.
+
+    Membership changes (alive/suspect/dead with an incarnation, plus the member's
+    `data`) ride on pings and acks, each on RETRANSMIT_MULT * log2(members) messages,
+    so a change reaches everyone in O(log n) periods while each member sends O(1)
+    messages per period however large the group is. on_change(member_id, entry) is
+    called for every change this member learns about another one.
+
+    probe() lends the same indirection to non-members: other members heartbeat a
+    HeartbeatResponder on the caller's behalf (how an LFD checks its server).
+    """
+
+    def __init__(self, member_id, seeds=(), data=None, on_change=None, interval=None, ip='0.0.0.0', port=0, advertise=None):
+        self.member_id = member_id
+        self.seeds = [tuple(seed) for seed in seeds]
+        self.data = dict(data or {})
+        self.on_change = on_change
+        self.interval = interval or GOSSIP_INTERVAL
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((ip, port))
+        self.address = (advertise or _local_ip(ip, self.seeds), self.sock.getsockname()[1])
+        self.incarnation = 0
+        self.members = {}       # member ID -> entry (the update dict last applied, plus changed_at)
+        self.updates = {}       # member ID -> transmissions left for its latest entry
+        self.pending = {}       # seq -> Event for our own probes, or (requester address, its seq, sent at) for relayed ones
+        self.probe_order = []
+        self.seq = 0
+        self.sent = 0           # Datagrams sent by this member
+        self.lock = threading.Lock()
+        self.stopped = False
+        self._refresh_self()
+
+    def start(self):
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+        threading.Thread(target=self._probe_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stops taking part (for tests: looks like a crash to the others)."""
+        self.stopped = True
+        self.sock.close()
+
+    def update_data(self, **fields):
+        """Changes this member's data; a new incarnation makes the change win everywhere."""
+        with self.lock:
+            self.data.update(fields)
+            self.incarnation += 1
+            self._refresh_self()
+
+    def probe(self, address, helpers=None, timeout=None):
+        """
+        Asks up to `helpers` alive members to send a heartbeat to the HeartbeatResponder at
+        address and relay its acknowledgment. True if one came back within timeout, False
+        if none did, None if there was no member to ask.
+        """
+        acked = threading.Event()
+        seq = self._register(acked)
+        with self.lock:
+            candidates = [entry for m, entry in self.members.items() if m != self.member_id and entry["status"] == ALIVE]
+        chosen = random.sample(candidates, min(helpers or GOSSIP_INDIRECT, len(candidates)))
+        for helper in chosen:
+            self._send(helper["address"], "probe_req", seq=seq, target_address=list(address))
+        if chosen:
+            acked.wait(timeout or self.interval)
+        with self.lock:
+            self.pending.pop(seq, None)
+        return acked.is_set() if chosen else None
+
+    def push(self, member_id):
+        """Pings member_id now, so the newest updates (e.g. our own data) reach it without waiting for dissemination."""
+        with self.lock:
+            entry = self.members.get(member_id)
+        if entry and entry["status"] != DEAD:
+            try:
+                self._send(entry["address"], "ping", seq=None)
+            except OSError:
+                pass  # Dissemination still delivers the update
+
+    def view(self):
+        """Member ID -> entry, as this member currently sees the group."""
+        with self.lock:
+            return {member_id: dict(entry) for member_id, entry in self.members.items()}
+
+    # Probing
+
+    def _probe_loop(self):
+        while not self.stopped:
+            started = time.monotonic()
+            try:
+                if len(self.members) == 1:
+                    for seed in self.seeds:
+                        self._send(seed, "join")  # Until someone answers; the seed may start after us
+                target = self._next_target()
+                if target:
+                    self._probe(target)
+                self._expire(started)
+            except OSError:
+                if self.stopped:
+                    return
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def _next_target(self):
+        with self.lock:
+            while self.probe_order:
+                target = self.members.get(self.probe_order.pop())
+                if target and target["status"] != DEAD:
+                    return target
+            self.probe_order = [m for m, entry in self.members.items() if m != self.member_id and entry["status"] != DEAD]
+            random.shuffle(self.probe_order)
+            return self.members[self.probe_order.pop()] if self.probe_order else None
+
+    def _probe(self, target):
+        acked = threading.Event()
+        seq = self._register(acked)
+        self._send(target["address"], "ping", seq=seq)
+        if not acked.wait(self.interval / 3):
+            with self.lock:
+                helpers = [entry for m, entry in self.members.items()
+                           if m not in (self.member_id, target["id"]) and entry["status"] == ALIVE]
+            for helper in random.sample(helpers, min(GOSSIP_INDIRECT, len(helpers))):
+                self._send(helper["address"], "ping_req", seq=seq, target=target["id"], target_address=target["address"])
+            acked.wait(self.interval * 0.6)
+        with self.lock:
+            self.pending.pop(seq, None)
+        if not acked.is_set():
+            self._suspect(target["id"])
+
+    def _suspect(self, member_id):
+        with self.lock:
+            entry = self.members.get(member_id)
+            if not entry or entry["status"] != ALIVE:
+                return
+            changed = self._store(dict(entry, status=SUSPECT))
+        SUSPICIONS.inc()
+        self._notify([changed])
+
+    def _expire(self, now):
+        """Declares dead the suspects that did not refute in time, and forgets unanswered relays."""
+        changes = []
+        with self.lock:
+            timeout = GOSSIP_SUSPECT_PERIODS * max(1, math.log2(len(self.members))) * self.interval
+            for entry in list(self.members.values()):
+                if entry["status"] == SUSPECT and now - entry["changed_at"] > timeout:
+                    changes.append(self._store(dict(entry, status=DEAD)))
+            for seq, waiter in list(self.pending.items()):
+                if isinstance(waiter, tuple) and now - waiter[2] > 2 * self.interval:
+                    del self.pending[seq]
+            MEMBERS_ALIVE.set(sum(1 for entry in self.members.values() if entry["status"] != DEAD))
+        self._notify(changes)
+
+    # Messages
+
+    def _receive_loop(self):
+        while not self.stopped:
+            try:
+                data, sender = self.sock.recvfrom(65536)
+                message = json.loads(data)
+            except (OSError, ValueError):
+                if self.stopped:
+                    return
+                continue
+            changes = []
+            with self.lock:
+                for update in message.get("updates", []):
+                    changed = self._merge(update)
+                    if changed:
+                        changes.append(changed)
+            self._notify(changes)
+            try:
+                self._handle(message, sender)
+            except OSError:
+                pass
+
+    def _handle(self, message, sender):
+        kind = message.get("message")
+        if kind == "join":
+            with self.lock:
+                entries = [_public(entry) for entry in self.members.values()]
+            for start in range(0, len(entries), JOIN_CHUNK):
+                self._send(sender, "ack", seq=None, members=entries[start:start + JOIN_CHUNK])
+        elif kind == "ping":
+            self._send(sender, "ack", seq=message.get("seq"))
+        elif kind == "ping_req":
+            relay_seq = self._register((sender, message.get("seq"), time.monotonic()))
+            self._send(tuple(message["target_address"]), "ping", seq=relay_seq)
+        elif kind == "probe_req":
+            # The target is a HeartbeatResponder, not a member: a plain heartbeat, no gossip
+            relay_seq = self._register((sender, message.get("seq"), time.monotonic()))
+            self._send(tuple(message["target_address"]), "heartbeat", piggyback=False, seq=relay_seq)
+        elif kind in ("ack", "heartbeat acknowledgment"):
+            changes = []
+            with self.lock:
+                for update in message.get("members", []):  # Answer to a join
+                    changed = self._merge(update)
+                    if changed:
+                        changes.append(changed)
+                waiter = self.pending.pop(message.get("seq"), None)
+            self._notify(changes)
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+            elif waiter:
+                self._send(waiter[0], "ack", seq=waiter[1])
+
+    def _send(self, address, kind, piggyback=True, **fields):
+        if piggyback:
+            with self.lock:
+                fields["updates"] = self._piggyback()
+        message = create_message(self.member_id, kind, **fields)
+        self.sock.sendto(json.dumps(message).encode(), tuple(address))
+        self.sent += 1
+        MESSAGES_SENT.inc()
+
+    def _register(self, waiter):
+        with self.lock:
+            self.seq += 1
+            self.pending[self.seq] = waiter
+            return self.seq
+
+    # Member list (callers hold self.lock)
+
+    def _piggyback(self):
+        """The updates sent least so far, counting this transmission against them."""
+        chosen = sorted(self.updates, key=self.updates.get, reverse=True)[:MAX_PIGGYBACK]
+        for member_id in chosen:
+            self.updates[member_id] -= 1
+            if self.updates[member_id] <= 0:
+                del self.updates[member_id]
+        return [_public(self.members[member_id]) for member_id in chosen]
+
+    def _merge(self, update):
+        """Applies a gossiped entry if it is newer than ours; returns the stored entry if anything changed."""
+        member_id = update.get("id")
+        if member_id == self.member_id:
+            if update.get("status") != ALIVE and update.get("incarnation", 0) >= self.incarnation:
+                self.incarnation = update["incarnation"] + 1  # Refute: our newer alive entry overrides the suspicion
+                self._refresh_self()
+            return None
+        current = self.members.get(member_id)
+        if current and not _overrides(update, current):
+            return None
+        return self._store(update)
+
+    def _store(self, update):
+        entry = _public(update)
+        entry["address"] = tuple(entry["address"])
+        entry["changed_at"] = time.monotonic()
+        self.members[entry["id"]] = entry
+        self.updates[entry["id"]] = RETRANSMIT_MULT * max(1, math.ceil(math.log2(len(self.members) + 1)))
+        return entry
+
+    def _refresh_self(self):
+        self._store({"id": self.member_id, "address": self.address, "status": ALIVE,
+                     "incarnation": self.incarnation, "data": dict(self.data)})
+
+    def _notify(self, changes):
+        if self.on_change:
+            for entry in changes:
+                self.on_change(entry["id"], entry)
+
+
+def _overrides(new, old):
+    """SWIM precedence: dead beats everything at its incarnation; suspect beats alive at the same one."""
+    new_status, new_incarnation = new.get("status"), new.get("incarnation", 0)
+    if old["status"] == DEAD:
+        return new_status == ALIVE and new_incarnation > old["incarnation"]  # Came back
+    if new_status == DEAD:
+        return new_incarnation >= old["incarnation"]
+    if new_status == SUSPECT:
+        return new_incarnation > old["incarnation"] or (new_incarnation == old["incarnation"] and old["status"] == ALIVE)
+    return new_incarnation > old["incarnation"]
+
+
+def _public(entry):
+    return {"id": entry["id"], "address": list(entry["address"]), "status": entry["status"],
+            "incarnation": entry["incarnation"], "data": entry.get("data", {})}
+
+
+def _local_ip(ip, seeds):
+    """The address others can reach us at: the bound IP, else the interface that routes to the first seed."""
+    if ip not in ('0.0.0.0', ''):
+        return ip
+    if not seeds:
+        return '127.0.0.1'
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        probe.connect(seeds[0])  # No packet is sent; this only picks the route
+        return probe.getsockname()[0]
+    except OSError:
+        return '127.0.0.1'
+    finally:
+        probe.close()
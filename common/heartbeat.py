@@ -0,0 +1,146 @@
+import json
+import os
+import select
+import socket
+import threading
+import time
+
+from communication_utils import *
+import metrics
+
+HEARTBEAT_TRANSPORT = os.environ.get("HEARTBEAT_TRANSPORT", "tcp")  # "udp": heartbeats on their own datagram channel
+HEARTBEAT_MISSES = int(os.environ.get("HEARTBEAT_MISSES", 3))      # Silent heartbeat periods before a peer is declared dead
+# Longest gap between lease renewals reaching the primary: the GFD's heartbeat period plus the LFD's (by default 5 + 4)
+LEASE_RENEWAL_INTERVAL = float(os.environ.get("LEASE_RENEWAL_INTERVAL", 9))
+
+HEARTBEATS_LOST = metrics.counter("heartbeats_lost", "UDP heartbeats never acknowledged")
+HEARTBEATS_LATE = metrics.counter("heartbeats_late", "UDP acknowledgments for a heartbeat already written off")
+
+
+def udp_heartbeats():
+    return HEARTBEAT_TRANSPORT == "udp"
+
+
+def check_lease(lease, margin=0):
+    """Warns when a primary lease, less the margin the server keeps, would run out between two renewals."""
+    if lease and lease - margin <= LEASE_RENEWAL_INTERVAL:
+        less_margin = f" less the {margin}s LEASE_MARGIN" if margin else ""
+        printY(f"PRIMARY_LEASE of {lease}s{less_margin} is not longer than the {LEASE_RENEWAL_INTERVAL}s "
+               f"LEASE_RENEWAL_INTERVAL: the primary will lose its lease between renewals and refuse requests.")
+
+
+class HeartbeatResponder:
+    """
+    Answers UDP heartbeats on a port of its own, which the owner advertises as
+    `heartbeat_port` when it registers over TCP. on_heartbeat(message) sees each
+    heartbeat before it is acknowledged (e.g. to pick up a lease it carries).
+    """
+
+    def __init__(self, component_id, on_heartbeat=None, ip='0.0.0.0'):
+        self.component_id = component_id
+        self.on_heartbeat = on_heartbeat
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((ip, 0))
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                data, peer = self.sock.recvfrom(65536)
+                message = json.loads(data)
+            except (OSError, ValueError):
+                continue
+            if message.get("message") != "heartbeat":
+                continue
+            if self.on_heartbeat:
+                self.on_heartbeat(message)
+            ack = create_message(self.component_id, "heartbeat acknowledgment", seq=message.get("seq"))
+            try:
+                self.sock.sendto(json.dumps(ack).encode(), peer)
+            except OSError:
+                pass
+
+
+class HeartbeatMonitor:
+    """
+    Sends a heartbeat datagram (with a sequence number) to a HeartbeatResponder every
+    interval and matches the acknowledgments by sequence number, so a lost or late
+    datagram costs nothing but its RTT sample. run() returns once `misses` intervals
+    pass without any acknowledgment, i.e. when the peer is declared dead.
+
+    A hung peer keeps its TCP connections open, which only missed heartbeats reveal;
+    a crashed one closes them at once. If `connection` (a TCP connection to the peer
+    that it never writes to) is given, its closing also ends run() right away.
+    """
+
+    def __init__(self, component_id, peer, address, interval, misses=None, fields=None, on_rtt=None, connection=None):
+        self.component_id = component_id
+        self.peer = peer
+        self.address = address
+        self.interval = interval
+        self.misses = misses or HEARTBEAT_MISSES
+        self.fields = fields    # Callable returning extra fields for each heartbeat (e.g. lease_seconds)
+        self.on_rtt = on_rtt    # Called with each round trip in seconds
+        self.connection = connection
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect(address)  # Only the peer's datagrams are received
+        self.sent = {}              # seq -> perf_counter() at send, for heartbeats not yet acknowledged
+        self.stopped = False
+
+    def run(self):
+        seq = 0
+        last_ack = time.perf_counter()
+        try:
+            while not self.stopped:
+                seq += 1
+                message = create_message(self.component_id, "heartbeat", seq=seq, **(self.fields() if self.fields else {}))
+                self.sent[seq] = time.perf_counter()
+                try:
+                    self.sock.send(json.dumps(message).encode())
+                except OSError:
+                    pass  # e.g. ECONNREFUSED from an earlier datagram; counts as a miss
+                deadline = self.sent[seq] + self.interval
+                while True:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    if self.connection and self._closed(remaining):
+                        return
+                    if self._receive_ack(remaining):
+                        last_ack = time.perf_counter()
+                for old in [s for s in self.sent if s <= seq - self.misses]:
+                    del self.sent[old]
+                    HEARTBEATS_LOST.inc()
+                if time.perf_counter() - last_ack >= self.misses * self.interval:
+                    return
+        finally:
+            self.sock.close()
+
+    def stop(self):
+        self.stopped = True
+
+    def _closed(self, timeout):
+        """Waits until an acknowledgment is ready or timeout passes; True if the connection closed meanwhile."""
+        try:
+            readable, _, _ = select.select([self.sock, self.connection], [], [], timeout)
+            return self.connection in readable and not self.connection.recv(1, socket.MSG_PEEK)
+        except (OSError, ValueError):
+            return True
+
+    def _receive_ack(self, timeout):
+        """Waits up to timeout for one acknowledgment; True if one arrived (late ones prove the peer alive too)."""
+        self.sock.settimeout(timeout)
+        try:
+            ack = json.loads(self.sock.recv(65536))
+        except socket.timeout:
+            return False
+        except (OSError, ValueError):
+            time.sleep(min(timeout, 0.01))  # ICMP port unreachable is reported on the next recv
+            return False
+        sent_at = self.sent.pop(ack.get("seq"), None)
+        if sent_at is None:
+            HEARTBEATS_LATE.inc()
+        elif self.on_rtt:
+            self.on_rtt(time.perf_counter() - sent_at)
+        return True
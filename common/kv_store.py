@@ -0,0 +1,406 @@
+import threading
+import uuid
+from array import array
+from collections import deque
+
+DEFAULT_KEY = "state"  # Key used by the original increase/decrease requests that carry no key
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+REQUEST_TYPES = ("increase", "decrease", "get", "put", "incr", "delete")
+CHANGELOG_SIZE = 100000  # Recent mutations kept for delta state transfer
+
+
+class ReadOnly(ValueError):
+    """Raised when a replica that only serves reads (a passive backup) receives a write."""
+
+
+class StaleRead(ValueError):
+    """Raised when a replica's state is older than the min_version a read asked for."""
+
+
+class NoLease(ValueError):
+    """Raised when a primary that must hold a lease to serve requests does not (yet) have one."""
+
+
+def new_lineage():
+    return uuid.uuid4().hex[:16]
+
+
+class KVStore:
+    """
+    Replicated key -> int64 store. Keys map to slots of one array('q'), so thousands
+    of counters cost 8 bytes of value storage each plus the key dict; deleted slots
+    are reused. Every mutation bumps `version`, which checkpoints carry along, and is
+    passed to `journal(version, key, value)` (value None for a delete) if one is set.
+
+    A store restarted from a snapshot file reads through to the mapped file (`base`)
+    and only keeps keys changed since in memory, so loading it does not depend on its
+    size. `lineage` names the history the versions belong to: replicas that share it
+    agree on what every version means, so a peer can catch up with just the changes
+    since its version (changes_since / apply_delta) instead of the whole store.
+    """
+
+    def __init__(self, changelog_size=CHANGELOG_SIZE):
+        self.slots = {}             # key -> index into values
+        self.values = array('q')    # int64 values
+        self.slot_keys = []         # index into values -> key (None for a free slot)
+        self.free = []              # indexes of deleted slots
+        self.base = None            # snapshot_file.MappedSnapshot the store was loaded from
+        self.hidden = set()         # base keys deleted or overwritten since
+        self.version = 0
+        self.lineage = new_lineage()
+        self.log = deque(maxlen=changelog_size)  # (version, key, value) of recent mutations
+        self.log_start = 0          # The log holds every mutation after this version (until it wraps)
+        self.journal = None         # e.g. durability.Storage.record
+        self.views = []             # Open StoreViews, told about every slot and base key before it changes
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        if self.base is None:
+            return len(self.slots)
+        return len(self.slots) + len(self.base) - len(self.hidden)
+
+    def __contains__(self, key):
+        return key in self.slots or (self.base is not None and key not in self.hidden and key in self.base)
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self._get(key, default)
+
+    def put(self, key, value):
+        with self.lock:
+            return self._put(key, value)
+
+    def incr(self, key, amount=1):
+        """Adds amount to key (missing keys start at 0) and returns the new value."""
+        with self.lock:
+            return self._incr(key, amount)
+
+    def delete(self, key):
+        """Removes key; returns whether it existed."""
+        with self.lock:
+            return self._delete(key)
+
+    def to_dict(self):
+        with self.lock:
+            return self._contents()
+
+    def snapshot(self):
+        """Returns (contents, version, lineage) read atomically. Holds the lock for O(size); see view()."""
+        with self.lock:
+            return self._contents(), self.version, self.lineage
+
+    def view(self):
+        """Returns a StoreView of the store as of now, in O(1)."""
+        with self.lock:
+            view = StoreView(self)
+            self.views.append(view)
+            return view
+
+    def load(self, data, version=0, lineage=None):
+        """Replaces the whole store, e.g. from a checkpoint or state_response."""
+        values = array('q', data.values())
+        with self.lock:
+            self.slots = {key: index for index, key in enumerate(data)}
+            self.values = values
+            self.slot_keys = list(data)
+            self.free = []
+            self.base, self.hidden = None, set()
+            self.views = []  # Open views keep reading the structures they captured, which no longer change
+            self._reset_history(version, lineage or new_lineage())
+
+    def load_mapped(self, snapshot):
+        """Replaces the whole store with a mapped snapshot file, without reading it."""
+        with self.lock:
+            self.slots, self.values, self.slot_keys, self.free = {}, array('q'), [], []
+            self.base, self.hidden = snapshot, set()
+            self.views = []
+            self._reset_history(snapshot.version, snapshot.lineage or new_lineage())
+
+    def fork(self):
+        """
+        Starts a new lineage, e.g. when a backup is promoted: its writes from here on
+        may reuse versions an old primary already handed out.
+        """
+        with self.lock:
+            self._reset_history(self.version, new_lineage())
+            if self.journal:
+                self.journal(self.version, None, self.lineage)
+
+    def replay(self, version, key, value):
+        """Re-applies one journal record (key None: a lineage change), e.g. from the WAL at startup."""
+        with self.lock:
+            if key is None:
+                self._reset_history(version, value)
+                return
+            self._change(key, value)
+            self.version = version
+            self.log.append((version, key, value))
+
+    def changes_since(self, lineage, since):
+        """
+        Returns ({key: value, or None if deleted}, version) bringing a replica of the
+        same lineage at version `since` up to date, or None if the log cannot.
+        """
+        with self.lock:
+            covered_from = self.log[0][0] if len(self.log) == self.log.maxlen else self.log_start
+            if lineage != self.lineage or not covered_from <= since <= self.version:
+                return None
+            changes = {}
+            for version, key, value in reversed(self.log):
+                if version <= since:
+                    break
+                changes.setdefault(key, value)
+            return changes, self.version
+
+    def apply_delta(self, changes, since, version, lineage):
+        """Applies changes_since() output from a peer; raises ValueError if this store is not at `since`."""
+        with self.lock:
+            if lineage != self.lineage or since != self.version or version < since:
+                raise ValueError(f"Delta {since}..{version} of lineage {lineage} does not apply at version {self.version} of {self.lineage}")
+            if any(value is not None and not INT64_MIN <= value <= INT64_MAX for value in changes.values()):
+                raise ValueError("Delta value overflows int64")
+            self.version = version  # The delta is a compacted range, so all of it is logged at its end version
+            for key, value in changes.items():
+                self._change(key, value)
+                self._logged(key, value)
+
+    # The unlocked operations below are for callers already holding the lock, e.g.
+    # apply_request, which reads the version its reply carries under the same lock.
+
+    def _get(self, key, default=None):
+        index = self.slots.get(key)
+        if index is not None:
+            return self.values[index]
+        if self.base is not None and key not in self.hidden:
+            return self.base.get(key, default)
+        return default
+
+    def _put(self, key, value):
+        self._set(key, value)
+        self._applied(key, value)
+        return value
+
+    def _incr(self, key, amount):
+        value = self._get(key, 0) + amount
+        self._set(key, value)
+        self._applied(key, value)
+        return value
+
+    def _delete(self, key):
+        if not self._remove(key):
+            return False
+        self._applied(key, None)
+        return True
+
+    def _contents(self):
+        data = {}
+        if self.base is not None:
+            data = {key: value for key, value in self.base.items() if key not in self.hidden}
+        data.update((key, self.values[index]) for key, index in self.slots.items())
+        return data
+
+    def _reset_history(self, version, lineage):
+        self.version = version
+        self.lineage = lineage
+        self.log.clear()
+        self.log_start = version
+
+    def _applied(self, key, value):
+        self.version += 1
+        self._logged(key, value)
+
+    def _logged(self, key, value):
+        self.log.append((self.version, key, value))
+        if self.journal:
+            self.journal(self.version, key, value)
+
+    def _change(self, key, value):
+        if value is None:
+            self._remove(key)
+        else:
+            self._set(key, value)
+
+    def _set(self, key, value):
+        if not INT64_MIN <= value <= INT64_MAX:
+            raise OverflowError(f"{value} does not fit in int64")
+        index = self.slots.get(key)
+        if index is not None:
+            for view in self.views:
+                view.preserve_slot(index)
+            self.values[index] = value
+            return
+        if self.base is not None and key not in self.hidden and key in self.base:
+            for view in self.views:
+                view.preserve_base(key)
+            self.hidden.add(key)  # Shadowed by the in-memory copy from now on
+        if self.free:
+            index = self.slots[key] = self.free.pop()
+            for view in self.views:
+                view.preserve_slot(index)
+            self.values[index] = value
+            self.slot_keys[index] = key
+        else:
+            self.slots[key] = len(self.values)
+            self.values.append(value)
+            self.slot_keys.append(key)
+
+    def _remove(self, key):
+        index = self.slots.pop(key, None)
+        if index is not None:
+            for view in self.views:
+                view.preserve_slot(index)
+            self.values[index] = 0
+            self.slot_keys[index] = None
+            self.free.append(index)
+            return True  # A base copy of the key, if any, is already hidden
+        if self.base is not None and key not in self.hidden and key in self.base:
+            for view in self.views:
+                view.preserve_base(key)
+            self.hidden.add(key)
+            return True
+        return False
+
+
+class StoreView:
+    """
+    Point-in-time copy of a KVStore that costs O(1) to take and is read in pieces
+    while the store keeps changing (copy-on-write per slot). Every entry the store
+    held when the view was taken sits at a fixed position: the mapped base's entries,
+    then the slots. Before the store changes a slot, or hides a base key behind an
+    in-memory copy, it tells every open view, which keeps the slot's old key and value
+    (or notes the base key as still visible), so entries(position, limit) returns
+    what the store held then, from any position and as often as asked. The view costs
+    memory for the slots changed while it is open, not for the store. read() walks
+    the positions once and closes the view at the end, so writes stop paying for it.
+    """
+
+    def __init__(self, store):
+        # Called under the store lock. The structures are captured so that a load()
+        # replacing them leaves this view reading the old, now unchanging, ones.
+        self.store = store
+        self.version, self.lineage, self.count = store.version, store.lineage, len(store)
+        self.base, self.hidden = store.base, store.hidden
+        self.values, self.slot_keys = store.values, store.slot_keys
+        self.base_count = len(store.base) if store.base is not None else 0
+        self.size = self.base_count + len(store.values)  # Positions: base entries, then slots
+        self.saved_slots = {}  # slot changed since the view was taken -> (key or None if free, value) then
+        self.unhidden = set()  # base keys hidden since the view was taken, which the view still shows
+        self.position = 0      # read()'s cursor
+        self.open = True
+
+    def preserve_slot(self, index):
+        """Called by the store, under its lock, before slot index changes."""
+        if index < self.size - self.base_count and index not in self.saved_slots:
+            self.saved_slots[index] = (self.slot_keys[index], self.values[index])
+
+    def preserve_base(self, key):
+        """Called by the store, under its lock, before base key is hidden."""
+        self.unhidden.add(key)
+
+    def entries(self, position, limit):
+        """
+        Returns (up to limit (key, value) pairs from position on, the position after
+        them), holding the store lock for this piece only; no pairs once the end is reached.
+        """
+        entries = []
+        with self.store.lock:
+            while position < self.size and len(entries) < limit:
+                if position < self.base_count:
+                    key, value = self.base.item(position)
+                    if key not in self.hidden or key in self.unhidden:
+                        entries.append((key, value))
+                else:
+                    index = position - self.base_count
+                    key, value = self.saved_slots.get(index) or (self.slot_keys[index], self.values[index])
+                    if key is not None:
+                        entries.append((key, value))
+                position += 1
+        return entries, position
+
+    def read(self, limit):
+        """Returns up to limit more (key, value) pairs; an empty list once every key has been returned."""
+        entries, self.position = self.entries(self.position, limit)
+        if self.position >= self.size and self.open:
+            self.close()
+        return entries
+
+    def close(self):
+        """Stops tracking writes; entries() must not be called afterwards."""
+        with self.store.lock:
+            self.open = False
+            if self in self.store.views:
+                self.store.views.remove(self)
+            self.saved_slots, self.unhidden = {}, set()
+
+
+def request_key(message):
+    """Returns the key a client request operates on, or raises ValueError if it has none."""
+    message_type = message.get("message")
+    if message_type not in REQUEST_TYPES:
+        raise ValueError(f"Unknown message type: {message_type}")
+    key = message.get("key", DEFAULT_KEY if message_type in ("increase", "decrease") else None)
+    if not isinstance(key, str):
+        raise ValueError(f"'{message_type}' needs a string key")
+    return key
+
+
+def apply_request(store, message):
+    """
+    Applies one client request to the store. Returns (response type, response fields),
+    or raises ValueError for requests the store cannot apply. Every reply carries the
+    store version right after the request (read under the same lock, so no concurrent
+    request can slip in between), which clients can pass back as a read's min_version.
+
+        increase / decrease   [key]          -> "state increased" / "state decreased", state
+        get                   key            -> "get_response", key, value (None if missing)
+        put                   key, value     -> "put_response", key, value
+        incr                  key, [amount]  -> "incr_response", key, value
+        delete                key            -> "delete_response", key, deleted
+    """
+    message_type = message.get("message")
+    key = request_key(message)
+    if message_type == "put":
+        value = _integer(message.get("value"))
+    elif message_type == "incr":
+        amount = _integer(message.get("amount", 1))
+    try:
+        with store.lock:
+            if message_type == "increase":
+                response_type, fields = "state increased", {"key": key, "state": store._incr(key, 1)}
+            elif message_type == "decrease":
+                response_type, fields = "state decreased", {"key": key, "state": store._incr(key, -1)}
+            elif message_type == "get":
+                response_type, fields = "get_response", {"key": key, "value": store._get(key)}
+            elif message_type == "put":
+                response_type, fields = "put_response", {"key": key, "value": store._put(key, value)}
+            elif message_type == "incr":
+                response_type, fields = "incr_response", {"key": key, "value": store._incr(key, amount)}
+            else:
+                response_type, fields = "delete_response", {"key": key, "deleted": store._delete(key)}
+            fields["version"] = store.version
+    except OverflowError:
+        raise ValueError(f"'{message_type}' on '{key}' overflows int64")
+    return response_type, fields
+
+
+def apply_read(store, message):
+    """
+    Serves a get from a replica that only holds checkpointed state. The reply carries
+    the checkpoint's version; a request with min_version newer than that raises
+    StaleRead so the client can retry at the primary.
+    """
+    if message.get("message") != "get":
+        raise ReadOnly(f"'{message.get('message')}' must go to the primary")
+    key = request_key(message)
+    min_version = _integer(message.get("min_version", 0))
+    with store.lock:  # A checkpoint may be loading; the value must belong to the version reported
+        version, value = store.version, store._get(key)
+    if version < min_version:
+        raise StaleRead(f"Replica is at version {version}, read needs {min_version}")
+    return "get_response", {"key": key, "value": value, "version": version}
+
+
+def _integer(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f"Expected an integer value, got {value!r}")
+    return value
@@ -3,75 +3,143 @@ import time
 import argparse
 import threading
 import os
-import subprocess
 from communication_utils import *
-from dotenv import load_dotenv
+from heartbeat import HeartbeatMonitor, HeartbeatResponder, udp_heartbeats
+from gossip import GossipMember, gossip_membership, GOSSIP_INDIRECT, ALIVE
+from supervisor import Supervisor, SERVER_COMMAND
+import metrics
 
-load_dotenv()
+load_env_file(__file__)
 
 # Global Configurations
 COMPONENT_ID = os.environ.get("MY_LFD_ID")
 LFD_IP = '127.0.0.1'
-LFD_PORT = 54321
+LFD_PORT = env_port("LFD_PORT", 54321)
+# LFD_TRANSPORT=unix: the local server connects over a Unix domain socket instead of loopback TCP
+LFD_SOCKET = local_socket_path("LFD", LFD_PORT) if os.environ.get("LFD_TRANSPORT") == "unix" else None
 GFD_IP = os.environ.get("GFD_IP")
-GFD_PORT = 12345
+GFD_PORT = env_port("GFD_PORT", 12345)
 heartbeat_interval = 4
 timeout_threshold = 10  # Time in seconds to wait for a response before marking server as "dead"
 
 SERVER_ID = None
+server_up = False  # Registered and not declared dead since
+SERVER_HEARTBEAT_PORT = None  # UDP port the server answers heartbeats on (HEARTBEAT_TRANSPORT=udp or MEMBERSHIP=gossip)
 gfd_socket = None
 server_socket = None
+gfd_heartbeats = None  # HeartbeatResponder answering the GFD's UDP heartbeats
+gossip = None          # GossipMember when MEMBERSHIP=gossip; its data reports the server this LFD watches
+gfd_commands_seen = None  # With gossip: command -> seq of the last one in the GFD's entry this LFD acted on
+registrations = 0         # Server registrations so far; gossiped so the GFD sees a restart even if it misses the death
+supervisor = None      # Supervisor running the server as a child process when SERVER_COMMAND is set
 CHECKPOINT_INTERVAL = 10
+INDIRECT_PROBES = int(os.environ.get("INDIRECT_PROBES", GOSSIP_INDIRECT))  # Peer LFDs asked to probe a suspected server (0: none)
+PROBE_TIMEOUT = float(os.environ.get("PROBE_TIMEOUT", 1))                  # Seconds to wait for one of them to get an answer
 
 reliable_server = None
+lease_until = None  # time.monotonic() at which the primary lease last granted by the GFD ends, passed on to the server
+
+HEARTBEAT_RTT = metrics.histogram("lfd_heartbeat_rtt_seconds", "LFD to server heartbeat round trip")
+SERVER_FAILURES = metrics.counter("lfd_server_failures", "Times the local server was declared dead")
+SUSPICIONS_REFUTED = metrics.counter("lfd_suspicions_refuted", "Missed server heartbeats that peer LFDs' probes showed to be false alarms")
 
 def handle_server_registration():
-    global SERVER_ID, CHECKPOINT_INTERVAL
+    global SERVER_ID, SERVER_HEARTBEAT_PORT, CHECKPOINT_INTERVAL, server_up, registrations
     message = receive(server_socket, COMPONENT_ID)
     if message and message.get('message') == 'register':
         checkpoint_interval = message.get('checkpoint', CHECKPOINT_INTERVAL)
         CHECKPOINT_INTERVAL = checkpoint_interval
         SERVER_ID = message.get('component_id', 'Unknown Server')
+        SERVER_HEARTBEAT_PORT = message.get('heartbeat_port')
         printG(f"Server {SERVER_ID} registered with LFD.")
+        server_up = True
+        if supervisor:
+            supervisor.ready()
+        registrations += 1
+        if gossip:
+            gossip.update_data(replica=SERVER_ID, registration=registrations)
 
-        response = create_message(COMPONENT_ID, "add replica", message_data=SERVER_ID)
-        send(gfd_socket, response, "GFD")
+        notify_gfd(create_message(COMPONENT_ID, "add replica", message_data=SERVER_ID))
 
 def handle_server_communication():
     global server_socket
-    heartbeat_message = create_message(COMPONENT_ID, "heartbeat")
+    if SERVER_HEARTBEAT_PORT and udp_heartbeats():
+        # Heartbeats go over UDP; the TCP connection only carries commands (new_primary)
+        while True:
+            HeartbeatMonitor(COMPONENT_ID, SERVER_ID, ('127.0.0.1', SERVER_HEARTBEAT_PORT), heartbeat_interval,
+                             fields=lambda: {"lease_seconds": lease_remaining()}, on_rtt=HEARTBEAT_RTT.observe,
+                             connection=server_socket).run()
+            if connection_closed(server_socket) or not refuted_by_peers():
+                break
+        declare_server_dead()
+        return
     while True:
+        heartbeat_message = create_message(COMPONENT_ID, "heartbeat", lease_seconds=lease_remaining())
+        sent_at = time.perf_counter()
         send(server_socket, heartbeat_message, SERVER_ID)
         response = receive(server_socket, COMPONENT_ID)
-        if not response:
-            printR(f"Server {SERVER_ID} is unresponsive. Marking as dead and notifying GFD.")
-            message = create_message(COMPONENT_ID, "remove replica", message_data=SERVER_ID)
-            send(gfd_socket, message, "GFD")
-            server_socket.close()
+        if response:
+            HEARTBEAT_RTT.observe(time.perf_counter() - sent_at)
+        if not response and (connection_closed(server_socket) or not refuted_by_peers()):
+            declare_server_dead()
             break
         time.sleep(heartbeat_interval)
 
-# NOTE: Get rid of --checkpoint_frequency for active replication
-def begin_automated_recovery():
-    global server_socket, SERVER_ID, CHECKPOINT_INTERVAL
-    time.sleep(10)
-    server_script_path = f"/Users/hartman/Documents/College/Senior_Fall/18-749/18749-Team16/.venv/bin/python /Users/hartman/Documents/College/Senior_Fall/18-749/18749-Team16/active_replication/server.py"
+def connection_closed(sock):
+    """True if the server closed its end: it crashed, so there is nothing for peers to check."""
     try:
-        # Use osascript to open a new Terminal window and run the command
-        subprocess.Popen([
-            "osascript", "-e",
-            f'tell application "Terminal" to do script "{server_script_path}"'
-        ])
-    except Exception as e:
-        printR(f"Failed to relaunch server {SERVER_ID}: {e}")
+        return not sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+
+def refuted_by_peers():
+    """
+    Before the server is declared dead, asks INDIRECT_PROBES peer LFDs (gossip members)
+    to send it a UDP heartbeat. True if any of them got an answer: the server is up and
+    only this LFD's check failed (a lost or garbled heartbeat), so there is no failover.
+    """
+    if not (gossip and SERVER_HEARTBEAT_PORT and INDIRECT_PROBES):
+        return False
+    printY(f"Server {SERVER_ID} missed a heartbeat. Asking peer LFDs to probe it.")
+    alive = gossip.probe((gossip.address[0], SERVER_HEARTBEAT_PORT), helpers=INDIRECT_PROBES, timeout=PROBE_TIMEOUT)
+    if alive:
+        SUSPICIONS_REFUTED.inc()
+        get_logger().info("server suspicion refuted", server_id=SERVER_ID)
+        printG(f"Peer LFDs reached server {SERVER_ID}; not declaring it dead.")
+    return bool(alive)
+
+def declare_server_dead():
+    global lease_until, server_up
+    server_up = False
+    SERVER_FAILURES.inc()
+    get_logger().info("server declared dead", server_id=SERVER_ID)
+    printR(f"Server {SERVER_ID} is unresponsive. Marking as dead and notifying GFD.")
+    notify_gfd(create_message(COMPONENT_ID, "remove replica", message_data=SERVER_ID))
+    if gossip:
+        gossip.update_data(replica=None)
+    server_socket.close()
+    lease_until = None
+    if supervisor:
+        supervisor.kill()  # Still running but hung: replace it rather than let it come back unannounced
+
+def begin_automated_recovery():
+    """Answers recover_server: the supervisor restarts the server at once (skipping any backoff)."""
+    if supervisor:
+        supervisor.restart_now()
+    else:
+        printR(f"Cannot relaunch server {SERVER_ID}: SERVER_COMMAND is not set, so it must be restarted by hand.")
 
 def wait_for_server():
     global server_socket
-    server_listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_listener.bind((LFD_IP, LFD_PORT))
-    server_listener.listen(1)
-    printY(f"LFD listening for server connections on {LFD_IP}:{LFD_PORT}...")
+    if LFD_SOCKET:
+        server_listener = retry_bind(lambda: create_unix_listener(LFD_SOCKET, 1), LFD_SOCKET)  # As create_listener does
+    else:
+        server_listener = create_listener(LFD_IP, LFD_PORT, 1)
+    printY(f"LFD listening for server connections on {LFD_SOCKET or f'{LFD_IP}:{LFD_PORT}'}...")
+    if supervisor:
+        supervisor.start()
 
     while True:
         try:
@@ -86,13 +154,33 @@ def wait_for_server():
             printR(f"Error handling server connection: {e}")
             break
 
+def note_lease(message):
+    """Starts the lease a GFD message grants (lease_seconds) on this host's monotonic clock; none clears it."""
+    global lease_until
+    seconds = message.get("lease_seconds")
+    lease_until = None if seconds is None else time.monotonic() + seconds
+
+def lease_remaining():
+    """Seconds left of the lease, as passed on to the server, which counts them from when it gets them."""
+    return None if lease_until is None else max(0.0, lease_until - time.monotonic())
+
+def notify_gfd(message):
+    """Sends a membership change over the GFD connection; with gossip there is none, the gossip entry carries it."""
+    if gfd_socket:
+        send(gfd_socket, message, "GFD")
+
 def connect_to_gfd():
-    global gfd_socket
+    global gfd_socket, gfd_heartbeats
     try:
-        gfd_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        gfd_socket.connect((GFD_IP, GFD_PORT))
-        printG(f"Connected to GFD at {GFD_IP}:{GFD_PORT}")
-        registration_message = create_message(COMPONENT_ID, "register")
+        gfd_socket = connect_to_socket(GFD_IP, GFD_PORT)
+        if not gfd_socket:
+            return
+        printG(f"Connected to GFD at {format_address(GFD_IP, GFD_PORT)}")
+        heartbeat_fields = {}
+        if udp_heartbeats() and not is_unix_address(GFD_IP):
+            gfd_heartbeats = gfd_heartbeats or HeartbeatResponder(COMPONENT_ID, note_lease)
+            heartbeat_fields["heartbeat_port"] = gfd_heartbeats.port
+        registration_message = create_message(COMPONENT_ID, "register", **heartbeat_fields)
         send(gfd_socket, registration_message, "GFD")
     except Exception as e:
         printR(f"Failed to connect to GFD: {e}")
@@ -106,40 +194,102 @@ def receive_message_from_gfd():
                 if message:
                     action = message.get("message")
                     if action == "heartbeat":
+                        note_lease(message)
                         # Acknowledge GFD heartbeat
                         heartbeat_acknowledgement = create_message(COMPONENT_ID, "heartbeat acknowledgment")
                         send(gfd_socket, heartbeat_acknowledgement, "GFD")
-                    elif action == "recover_server":
-                        # Handle recovery message from GFD
-                        server_id = message.get("server_id", None)
-                        if server_id:
-                            printY(f"Received recovery request from GFD for server {server_id}")
-                            begin_automated_recovery()  # Call the recovery function
-                        else:
-                            printR("Received recover_server message without server_id.")
-                    elif action == "new_primary":
-                        election_message = create_message(COMPONENT_ID, "new_primary")
-                        send(server_socket, election_message, SERVER_ID)
-                    elif action == "new_reliable":
-                        global reliable_server
-                        reliable_server = message.get("server_id", None)
-                        print(f"received new reliable server: {reliable_server}")
                     else:
-                        printY(f"Unknown message received from GFD: {message}")
+                        handle_gfd_command(message)
     except Exception as e:
         printR(f"Error handling messages from GFD: {e}")
 
+def handle_gfd_command(message):
+    """Carries out a command from the GFD, received on its connection or in its gossip entry."""
+    global reliable_server
+    action = message.get("message")
+    if action == "recover_server":
+        # Handle recovery message from GFD
+        server_id = message.get("server_id", None)
+        if server_id:
+            printY(f"Received recovery request from GFD for server {server_id}")
+            begin_automated_recovery()  # Call the recovery function
+        else:
+            printR("Received recover_server message without server_id.")
+    elif action == "new_primary":
+        get_logger().info("new primary received", server_id=SERVER_ID)
+        if "lease_seconds" in message:  # Gossiped commands carry none; the lease comes with the GFD's UDP heartbeats
+            note_lease(message)
+        election_message = create_message(COMPONENT_ID, "new_primary", lease_seconds=lease_remaining())
+        send(server_socket, election_message, SERVER_ID)
+    elif action == "new_reliable":
+        reliable_server = message.get("server_id", None)
+        print(f"received new reliable server: {reliable_server}")
+    else:
+        printY(f"Unknown message received from GFD: {message}")
+
+def handle_gossip_change(member_id, entry):
+    """
+    With gossip membership, takes the GFD's commands from its gossip entry: each command
+    for this LFD whose seq is newer than the last one acted on. The commands already in
+    the entry when this LFD first sees it are not replayed.
+    """
+    global gfd_commands_seen
+    if member_id != "GFD":
+        return
+    commands = entry["data"].get("commands", {}).get(COMPONENT_ID, {})
+    if gfd_commands_seen is None:
+        gfd_commands_seen = {action: command["seq"] for action, command in commands.items()}
+        return
+    for action, command in sorted(commands.items(), key=lambda item: item[1]["seq"]):
+        if command["seq"] > gfd_commands_seen.get(action, 0):
+            gfd_commands_seen[action] = command["seq"]
+            try:
+                handle_gfd_command(create_message("GFD", action, server_id=command["server_id"]))
+            except Exception as e:
+                printR(f"Error handling gossiped command {action} from GFD: {e}")
+
+def gfd_reachable():
+    """Connected to the GFD, or with gossip membership, the GFD is alive in this LFD's view."""
+    if gossip:
+        return gossip.view().get("GFD", {}).get("status") == ALIVE
+    return gfd_socket is not None
+
+def health():
+    """Status for /health and /ready: ready while connected to the GFD with a live server registered."""
+    return {
+        "component": COMPONENT_ID,
+        "role": "lfd",
+        "ready": gfd_reachable() and server_up,
+        "server": SERVER_ID,
+        "server_up": server_up,
+        "gfd_connected": gfd_reachable(),
+        "reliable": reliable_server,
+        "lease_remaining": lease_remaining(),
+        "server_pid": supervisor.process.pid if supervisor and supervisor.process else None,
+        "standby_pid": supervisor.standby.pid if supervisor and supervisor.standby else None,
+        "gossip_members": len(gossip.members) if gossip else None,
+    }
+
 def main():
-    global heartbeat_interval
+    global heartbeat_interval, gossip, supervisor, gfd_heartbeats
     parser = argparse.ArgumentParser(description="Local Fault Detector (LFD) for monitoring server health.")
-    parser.add_argument('--heartbeat_freq', type=int, default=4, help="Heartbeat frequency in seconds.")
+    parser.add_argument('--heartbeat_freq', type=float, default=4, help="Heartbeat frequency in seconds.")
     args = parser.parse_args()
     heartbeat_interval = args.heartbeat_freq
 
-    connect_to_gfd()
-
-    server_thread = threading.Thread(target=receive_message_from_gfd, daemon=True)
-    server_thread.start()
+    metrics.set_health(health)
+    metrics.start_metrics()
+    if SERVER_COMMAND:
+        supervisor = Supervisor(SERVER_COMMAND, name=os.environ.get("MY_SERVER_ID") or "server")
+    if gossip_membership():
+        # No connection to the GFD: membership, commands and lease renewals (UDP heartbeats) all go through gossip
+        gfd_heartbeats = HeartbeatResponder(COMPONENT_ID, note_lease)
+        gfd_host = '127.0.0.1' if is_unix_address(GFD_IP) else GFD_IP
+        gossip = GossipMember(COMPONENT_ID, seeds=[(gfd_host, env_port("GOSSIP_PORT", GFD_PORT))], on_change=handle_gossip_change,
+                              data={"replica": None, "heartbeat_port": gfd_heartbeats.port}).start()
+    else:
+        connect_to_gfd()
+        threading.Thread(target=receive_message_from_gfd, daemon=True).start()
 
     try:
         while True:
@@ -149,11 +299,12 @@ def main():
         printY("LFD interrupted by user.")
     finally:
         if server_socket:
-            message = create_message(COMPONENT_ID, "remove replica", message_data=SERVER_ID)
-            send(gfd_socket, message, "GFD")
+            notify_gfd(create_message(COMPONENT_ID, "remove replica", message_data=SERVER_ID))
             server_socket.close()
         if gfd_socket:
             gfd_socket.close()
+        if supervisor:
+            supervisor.stop()
         printR("LFD shutdown.")
 
 if __name__ == '__main__':
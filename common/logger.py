@@ -0,0 +1,185 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+SENT_COLOR = "\033[96m"      # Cyan for sent
+RECEIVED_COLOR = "\033[95m"  # Purple for received
+LEVEL_COLORS = {"DEBUG": "\033[94m", "INFO": "\033[92m", "WARNING": "\033[93m", "ERROR": "\033[91m"}
+RESET = "\033[00m"
+
+
+def format_message_log(message, receiver, sent=True):
+    """Formats a sent/received message the way print_log always has (header line plus one line per detail)."""
+    message_type = message.get("message", "Unknown")
+    timestamp = message.get("timestamp", "Unknown")
+    sender = message.get("component_id", "Unknown")
+    details = {k: v for k, v in message.items() if k not in ["component_id", "timestamp", "message"]}
+    color = SENT_COLOR if sent else RECEIVED_COLOR
+
+    lines = [f"{color}{timestamp}: {sender} → {receiver} ({message_type}){RESET}"]
+    for key, value in details.items():
+        lines.append(f"{color}  {key}: {value}{RESET}")
+    return "\n".join(lines)
+
+
+class ConsoleSink:
+    """Colored, human-readable output on stdout (what print_log used to print)."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.pending = []
+
+    def write(self, record):
+        timestamp, level, event, fields = record
+        if event in ("message sent", "message received"):
+            text = format_message_log(fields["message"], fields["receiver"], sent=event == "message sent")
+        else:
+            details = " ".join(f"{k}={v}" for k, v in fields.items())
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+            text = f"{LEVEL_COLORS.get(level, '')}{when}: {event} {details}{RESET}"
+        self.pending.append(text)
+
+    def flush(self):
+        # One write per drained batch instead of one print() per line
+        if self.pending:
+            self.stream.write("\n".join(self.pending) + "\n")
+            self.pending = []
+        self.stream.flush()
+
+
+class JsonLinesSink:
+    """One JSON object per record, for machine consumption (benchmarks, timelines)."""
+
+    def __init__(self, path):
+        self.file = open(path, "a", buffering=1 << 16)
+
+    def write(self, record):
+        timestamp, level, event, fields = record
+        self.file.write(json.dumps({"ts": timestamp, "level": level, "event": event, **fields}, default=str) + "\n")
+
+    def flush(self):
+        self.file.flush()
+
+
+class Logger:
+    """
+    Structured logger that never does I/O on the caller's thread.
+
+    log() only appends a tuple to a bounded ring buffer; a background writer thread
+    drains it into the sinks. When the buffer is full the oldest records are
+    overwritten (and counted in `dropped`) rather than blocking the caller.
+    """
+
+    def __init__(self, level="INFO", sinks=None, capacity=10000, flush_interval=0.05, sample_rates=None):
+        self.level = LEVELS[level.upper()]
+        self.sinks = sinks if sinks is not None else [ConsoleSink()]
+        self.buffer = deque(maxlen=capacity)
+        self.flush_interval = flush_interval
+        self.sample_rates = sample_rates or {}  # sample key -> keep 1 in N
+        self.sample_counts = {}
+        self.dropped = 0
+        self.wakeup = threading.Event()
+        self.write_lock = threading.Lock()
+        self.writer = threading.Thread(target=self._run, daemon=True)
+        self.writer.start()
+        atexit.register(self.flush)
+
+    def enabled(self, level):
+        return LEVELS[level] >= self.level
+
+    def log(self, level, event, sample_key=None, **fields):
+        """Queues a record. sample_key (defaults to the event) selects the sampling rate to apply."""
+        if LEVELS[level] < self.level:
+            return
+        rate = self.sample_rates.get(sample_key or event)
+        if rate and rate > 1:
+            count = self.sample_counts.get(sample_key or event, 0)
+            self.sample_counts[sample_key or event] = count + 1
+            if count % rate:
+                return
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append((time.time(), level, event, fields))
+        if len(self.buffer) > self.buffer.maxlen // 2:
+            self.wakeup.set()
+
+    def debug(self, event, **fields):
+        self.log("DEBUG", event, **fields)
+
+    def info(self, event, **fields):
+        self.log("INFO", event, **fields)
+
+    def warning(self, event, **fields):
+        self.log("WARNING", event, **fields)
+
+    def error(self, event, **fields):
+        self.log("ERROR", event, **fields)
+
+    def flush(self):
+        """Synchronously drains everything queued so far (used at exit and by tests/benchmarks)."""
+        with self.write_lock:
+            for _ in range(len(self.buffer)):
+                record = self.buffer.popleft()
+                for sink in self.sinks:
+                    try:
+                        sink.write(record)
+                    except Exception:
+                        pass
+            for sink in self.sinks:
+                try:
+                    sink.flush()
+                except Exception:
+                    pass
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            if self.buffer:
+                self.flush()
+
+
+def parse_sample_rates(spec):
+    """Parses LOG_SAMPLE, e.g. "heartbeat=10,heartbeat acknowledgment=10"."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, rate = item.rpartition("=")
+        rates[key.strip()] = int(rate)
+    return rates
+
+
+_logger = None
+_logger_lock = threading.Lock()
+
+
+def get_logger():
+    """
+    Returns the process-wide logger, configured from the environment on first use:
+        LOG_LEVEL   DEBUG / INFO / WARNING / ERROR (default INFO)
+        LOG_CONSOLE 0 to disable the colored console sink (default 1)
+        LOG_FILE    path of a JSON-lines file sink (default none)
+        LOG_SAMPLE  per message type sampling, e.g. "heartbeat=10" keeps 1 in 10 heartbeats
+        LOG_BUFFER  ring buffer capacity in records (default 10000)
+    """
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                sinks = []
+                if os.environ.get("LOG_CONSOLE", "1") != "0":
+                    sinks.append(ConsoleSink())
+                if os.environ.get("LOG_FILE"):
+                    sinks.append(JsonLinesSink(os.environ["LOG_FILE"]))
+                _logger = Logger(
+                    level=os.environ.get("LOG_LEVEL", "INFO"),
+                    sinks=sinks,
+                    capacity=int(os.environ.get("LOG_BUFFER", 10000)),
+                    sample_rates=parse_sample_rates(os.environ.get("LOG_SAMPLE", "")),
+                )
+    return _logger
@@ -0,0 +1,298 @@
+import json
+import math
+import os
+import signal
+import sys
+import threading
+import time
+
+
+class Counter:
+    """Monotonically increasing count (requests, messages, bytes)."""
+
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        return [(name + "_total", labels, self.value)]
+
+
+class Gauge:
+    """A value that can go up and down (connected clients, membership size)."""
+
+    kind = "gauge"
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+
+class Histogram:
+    """
+    Latency histogram with HDR-style log-linear buckets. Values are recorded in
+    seconds and stored as integer microseconds; every power of two is split into
+    SUB_BUCKETS linear buckets, so percentiles are accurate to ~6% from 1 us to hours
+    while memory stays proportional to the number of distinct buckets hit.
+    """
+
+    kind = "histogram"
+    SUB_BUCKETS = 16
+    EXPORT_BOUNDS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                     0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]  # Prometheus "le" buckets
+
+    def __init__(self):
+        self.buckets = {}  # bucket index -> count
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = self._index(max(0, int(seconds * 1e6)))
+        with self.lock:
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+            self.count += 1
+            self.sum += seconds
+
+    def time(self):
+        """Context manager that observes the duration of the with-block."""
+        return _Timer(self)
+
+    def percentile(self, p):
+        """Upper bound (seconds) of the bucket containing the p-th percentile, or None if empty."""
+        with self.lock:
+            if not self.count:
+                return None
+            rank = p / 100 * self.count
+            seen = 0
+            for index in sorted(self.buckets):
+                seen += self.buckets[index]
+                if seen >= rank:
+                    return self._upper(index) / 1e6
+            return self._upper(max(self.buckets)) / 1e6
+
+    def samples(self, name, labels):
+        with self.lock:
+            ordered = sorted((self._upper(i) / 1e6, c) for i, c in self.buckets.items())
+            count, total = self.count, self.sum
+        result, cumulative, position = [], 0, 0
+        for bound in self.EXPORT_BOUNDS:
+            while position < len(ordered) and ordered[position][0] <= bound:
+                cumulative += ordered[position][1]
+                position += 1
+            result.append((name + "_bucket", {**labels, "le": str(bound)}, cumulative))
+        result.append((name + "_bucket", {**labels, "le": "+Inf"}, count))
+        result.append((name + "_sum", labels, total))
+        result.append((name + "_count", labels, count))
+        return result
+
+    def _index(self, micros):
+        if micros < self.SUB_BUCKETS:
+            return micros
+        shift = micros.bit_length() - 5  # keep the top 5 bits: 16..31
+        return self.SUB_BUCKETS * (shift + 1) + ((micros >> shift) - self.SUB_BUCKETS)
+
+    def _upper(self, index):
+        if index < self.SUB_BUCKETS:
+            return index + 1
+        shift = index // self.SUB_BUCKETS - 1
+        top = index % self.SUB_BUCKETS + self.SUB_BUCKETS
+        return (top + 1) << shift
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry:
+    """Holds every metric of the process, keyed by name and labels."""
+
+    def __init__(self):
+        self.metrics = {}  # (name, sorted label items) -> metric
+        self.help = {}
+        self.lock = threading.Lock()
+
+    def get(self, cls, name, help_text, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = self.metrics[key] = cls()
+                    self.help.setdefault(name, (cls.kind, help_text))
+        return metric
+
+    def snapshot(self):
+        with self.lock:
+            return sorted(self.metrics.items(), key=lambda item: item[0])
+
+    def render(self):
+        """Renders every metric in the Prometheus text exposition format."""
+        lines, described = [], set()
+        for (name, label_items), metric in self.snapshot():
+            if name not in described:
+                kind, help_text = self.help[name]
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+            for sample_name, labels, value in metric.samples(name, dict(label_items)):
+                lines.append(f"{sample_name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Human-readable dump with latency percentiles, used by the dump signal."""
+        lines = []
+        for (name, label_items), metric in self.snapshot():
+            label_text = _format_labels(dict(label_items))
+            if isinstance(metric, Histogram):
+                if metric.count:
+                    p50, p99, p999 = (metric.percentile(p) * 1e3 for p in (50, 99, 99.9))
+                    lines.append(f"{name}{label_text} count={metric.count} "
+                                 f"p50={p50:.3f}ms p99={p99:.3f}ms p999={p999:.3f}ms")
+            else:
+                lines.append(f"{name}{label_text} {metric.value}")
+        return "\n".join(lines)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text="", **labels):
+    return REGISTRY.get(Counter, name, help_text, labels)
+
+
+def gauge(name, help_text="", **labels):
+    return REGISTRY.get(Gauge, name, help_text, labels)
+
+
+def histogram(name, help_text="", **labels):
+    return REGISTRY.get(Histogram, name, help_text, labels)
+
+
+def percentile(samples, p):
+    """Nearest-rank p-th percentile of raw samples (the smallest one with p% of samples at or below it), nan if empty."""
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    rank = math.ceil(round(p / 100 * len(ordered), 9))  # Rounded so 7% of 100 is rank 7, not 8
+    return ordered[max(0, rank - 1)]
+
+
+_health = None  # Callable returning this component's status (see set_health)
+_started_at = time.time()
+
+
+def set_health(provider):
+    """
+    Registers the callable behind /health and /ready. It returns a JSON-serializable
+    dict describing the component (role, membership, state version, queue depths,
+    peers), with "ready" saying whether it should be given work. It runs on the HTTP
+    server's thread, so it should only read the component's globals.
+    """
+    global _health
+    _health = provider
+
+
+def health():
+    """The registered status plus uptime; ready unless the provider says otherwise."""
+    status = dict(_health()) if _health else {}
+    status.setdefault("ready", True)
+    status["uptime"] = time.time() - _started_at
+    return status
+
+
+def _metrics_handler():
+    """The HTTP handler class; built on first use, so components without a metrics port never import http.server."""
+    from http.server import BaseHTTPRequestHandler
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/metrics":
+                self._reply(200, "text/plain; version=0.0.4", REGISTRY.render())
+            elif path in ("/health", "/ready"):
+                try:
+                    status = health()
+                except Exception as e:
+                    self._reply(500, "application/json", json.dumps({"error": str(e)}))
+                    return
+                # /health: the process answers at all; /ready: it also wants work
+                code = 200 if path == "/health" or status["ready"] else 503
+                self._reply(code, "application/json", json.dumps(status, default=str))
+            else:
+                self.send_error(404)
+
+        def _reply(self, code, content_type, text):
+            body = text.encode()
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes are not worth a console line each
+
+    return _MetricsHandler
+
+
+def dump_metrics(signum=None, frame=None):
+    """Writes the current metrics summary to stderr."""
+    sys.stderr.write("==================== metrics ====================\n")
+    sys.stderr.write(REGISTRY.summary() + "\n")
+    sys.stderr.flush()
+
+
+def start_metrics(port=None, ip="127.0.0.1"):
+    """
+    Serves /metrics (Prometheus text format) plus /health and /ready (JSON, see
+    set_health) on a background thread and installs SIGUSR1 as a dump-to-stderr
+    signal. The port defaults to $METRICS_PORT; with no port, only the signal is
+    installed. Returns the HTTP server, if one was started.
+    """
+    if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, dump_metrics)
+
+    if port is None:
+        port = os.environ.get("METRICS_PORT")
+    if port is None or port == "":
+        return None
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer((ip, int(port)), _metrics_handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
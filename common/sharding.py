@@ -0,0 +1,90 @@
+import bisect
+import hashlib
+import json
+import os
+
+
+class WrongShard(ValueError):
+    """Raised when a server receives a key owned by another replica group."""
+
+
+class HashRing:
+    """
+    Consistent hash ring over replica group names. Every group is placed at `vnodes`
+    points, so adding or removing a group only moves ~1/N of the keys and the load
+    stays even across groups.
+    """
+
+    def __init__(self, groups, vnodes=100):
+        if not groups:
+            raise ValueError("A hash ring needs at least one replica group")
+        self.groups = list(groups)
+        self.vnodes = vnodes
+        points = sorted((_hash(f"{group}#{i}"), group) for group in self.groups for i in range(vnodes))
+        self.points = [point for point, _ in points]
+        self.owners = [group for _, group in points]
+
+    def group_for(self, key):
+        index = bisect.bisect(self.points, _hash(key)) % len(self.points)
+        return self.owners[index]
+
+
+def _hash(text):
+    return int.from_bytes(hashlib.md5(text.encode()).digest()[:8], "big")
+
+
+class ShardMap:
+    """
+    Key -> replica group routing plus each group's endpoints, loaded from a JSON file:
+
+        {"vnodes": 100,
+         "groups": {"G1": {"rm": "10.0.0.1:13579",
+                           "servers": {"S1": "10.0.0.2:12346", "S2": "...", "S3": "..."}},
+                    "G2": {...}}}
+
+    Every group is an independent deployment (its own RM, GFD, LFDs and servers);
+    "rm" is the RM's client port and is only needed in passive mode.
+    """
+
+    def __init__(self, groups, vnodes=100):
+        self.groups = groups
+        self.ring = HashRing(sorted(groups), vnodes)
+
+    def group_for(self, key):
+        return self.ring.group_for(key)
+
+    def check(self, group, key):
+        """Raises WrongShard unless `group` owns `key`."""
+        owner = self.group_for(key)
+        if owner != group:
+            raise WrongShard(f"Key '{key}' belongs to replica group {owner}, not {group}")
+
+    def rm_address(self, group):
+        return parse_address(self.groups[group]["rm"])
+
+    def server_addresses(self, group):
+        return {server_id: parse_address(address) for server_id, address in self.groups[group]["servers"].items()}
+
+    def to_json(self):
+        return {"vnodes": self.ring.vnodes, "groups": self.groups}
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+def request_keys(default="state"):
+    """Keys a client's requests cycle through: $CLIENT_KEYS (comma-separated), else just default."""
+    keys = [key for key in os.environ.get("CLIENT_KEYS", "").split(",") if key]
+    return keys or [default]
+
+
+def load_shard_map(path=None):
+    """Reads the shard map named by $SHARD_CONFIG; returns None when the deployment is not sharded."""
+    path = path or os.environ.get("SHARD_CONFIG")
+    if not path:
+        return None
+    with open(path) as f:
+        config = json.load(f)
+    return ShardMap(config["groups"], config.get("vnodes", 100))
@@ -0,0 +1,121 @@
+import hashlib
+import mmap
+import struct
+import sys
+from array import array
+
+MAGIC = b"KVSNAP01"
+FORMAT_VERSION = 1
+
+# magic, format version, flags, store version, key count, hash table size, lineage
+HEADER = struct.Struct("<8sIIQQQ16s")
+HEADER_SIZE = 64
+
+
+class MappedSnapshot:
+    """
+    Read-only view of a snapshot file, mapped with mmap so opening it costs the same
+    for any store size. The file (little-endian, every section 8-byte aligned) is:
+
+        header    64 bytes: MAGIC, format, flags, store version, count, table size, lineage
+        values    int64[count]
+        offsets   uint64[count + 1]       key i is blob[offsets[i]:offsets[i + 1]]
+        table     uint64[2 * table size]  open addressing: (key hash, key index + 1), 0 = empty
+        blob      UTF-8 keys
+
+    Lookups hash the key and probe the table in place; only the pages a lookup
+    touches are read from disk.
+    """
+
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise ValueError("Snapshot files can only be mapped on little-endian hosts")
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER_SIZE:
+            raise ValueError(f"{path} is not a snapshot file")
+        magic, format_version, _, self.version, self.count, self.table_size, lineage = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} snapshot file")
+        self.lineage = lineage.rstrip(b"\0").decode() or None
+
+        values_at = HEADER_SIZE
+        offsets_at = values_at + 8 * self.count
+        table_at = offsets_at + 8 * (self.count + 1)
+        blob_at = table_at + 16 * self.table_size
+        view = memoryview(self.map)
+        self.values = view[values_at:offsets_at].cast('q')
+        self.offsets = view[offsets_at:table_at].cast('Q')
+        self.table = view[table_at:blob_at].cast('Q')
+        self.blob = view[blob_at:]
+        if len(self.blob) < self.offsets[self.count]:
+            raise ValueError(f"{path} is truncated")
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self.find(key) is not None
+
+    def get(self, key, default=None):
+        index = self.find(key)
+        return default if index is None else self.values[index]
+
+    def items(self):
+        for index in range(self.count):
+            yield self.item(index)
+
+    def item(self, index):
+        """(key, value) stored at position index."""
+        return bytes(self.blob[self.offsets[index]:self.offsets[index + 1]]).decode(), self.values[index]
+
+    def find(self, key):
+        """Position of key in the file, or None."""
+        encoded = key.encode()
+        key_hash = _hash(encoded)
+        mask = self.table_size - 1
+        slot = key_hash & mask
+        while True:
+            entry = self.table[2 * slot + 1]
+            if entry == 0:
+                return None
+            if self.table[2 * slot] == key_hash:
+                index = entry - 1
+                if self.blob[self.offsets[index]:self.offsets[index + 1]] == encoded:
+                    return index
+            slot = (slot + 1) & mask
+
+
+def write_snapshot(f, data, version, lineage=None):
+    """Writes data (key -> int64) at store version to the binary file f in MappedSnapshot's format."""
+    keys = [key.encode() for key in data]
+    table_size = 1
+    while table_size < 2 * len(keys):
+        table_size *= 2  # Load factor <= 0.5 keeps probe sequences short
+    mask = table_size - 1
+
+    offsets = array('Q', [0])
+    table = array('Q', bytes(16 * table_size))
+    for index, encoded in enumerate(keys):
+        offsets.append(offsets[-1] + len(encoded))
+        key_hash = _hash(encoded)
+        slot = key_hash & mask
+        while table[2 * slot + 1]:
+            slot = (slot + 1) & mask
+        table[2 * slot], table[2 * slot + 1] = key_hash, index + 1
+
+    values = array('q', data.values())
+    if sys.byteorder != "little":
+        for section in (values, offsets, table):
+            section.byteswap()
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, version, len(keys), table_size, (lineage or "").encode())
+    f.write(header.ljust(HEADER_SIZE, b"\0"))
+    f.write(values.tobytes())
+    f.write(offsets.tobytes())
+    f.write(table.tobytes())
+    f.write(b"".join(keys))
+
+
+def _hash(encoded):
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), "little")
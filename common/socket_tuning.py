@@ -0,0 +1,110 @@
+import os
+import socket
+
+# Socket tuning presets shared by every listener and outgoing connection.
+#   latency:    small request/reply messages (heartbeats, client requests, checkpoints of a counter).
+#               Nagle is disabled so a reply never waits on the peer's delayed ACK.
+#   throughput: bulk transfers (large state transfers). Nagle stays on and buffers are enlarged.
+#   system:     leave everything at the OS defaults.
+SOCKET_PROFILES = {
+    "latency": {
+        "nodelay": True,
+        "sndbuf": None,
+        "rcvbuf": None,
+        "keepalive": True,
+        "keepidle": 10,    # Seconds idle before the first keepalive probe
+        "keepintvl": 3,    # Seconds between probes
+        "keepcnt": 3,      # Unanswered probes before the connection is dropped
+    },
+    "throughput": {
+        "nodelay": False,
+        "sndbuf": 1 << 20,
+        "rcvbuf": 1 << 20,
+        "keepalive": True,
+        "keepidle": 60,
+        "keepintvl": 10,
+        "keepcnt": 5,
+    },
+    "system": {
+        "nodelay": False,
+        "sndbuf": None,
+        "rcvbuf": None,
+        "keepalive": False,
+        "keepidle": None,
+        "keepintvl": None,
+        "keepcnt": None,
+    },
+}
+
+# Environment overrides, e.g. SOCKET_PROFILE=throughput SOCKET_SNDBUF=4194304
+DEFAULT_PROFILE = os.environ.get("SOCKET_PROFILE", "latency")
+ENV_OVERRIDES = {
+    "sndbuf": "SOCKET_SNDBUF",
+    "rcvbuf": "SOCKET_RCVBUF",
+    "keepidle": "SOCKET_KEEPIDLE",
+    "keepintvl": "SOCKET_KEEPINTVL",
+    "keepcnt": "SOCKET_KEEPCNT",
+}
+
+
+def get_profile(profile=None):
+    """
+    Resolves a profile name (or an already-built dict) into a full set of options,
+    applying any SOCKET_* environment overrides on top of the preset.
+    """
+    if isinstance(profile, dict):
+        return {**SOCKET_PROFILES["system"], **profile}
+    name = profile or DEFAULT_PROFILE
+    if name not in SOCKET_PROFILES:
+        raise ValueError(f"Unknown socket profile '{name}'. Choose from {list(SOCKET_PROFILES)}")
+    options = dict(SOCKET_PROFILES[name])
+    for option, env_var in ENV_OVERRIDES.items():
+        if os.environ.get(env_var):
+            options[option] = int(os.environ[env_var])
+    return options
+
+
+def tune_socket(sock, profile=None):
+    """
+    Applies a tuning profile to a socket. Buffer sizes apply to any stream socket,
+    including Unix domain ones; the TCP options only to TCP sockets. Options the
+    platform doesn't support are skipped.
+    """
+    options = get_profile(profile)
+    if options["sndbuf"]:
+        _set(sock, socket.SOL_SOCKET, socket.SO_SNDBUF, options["sndbuf"])
+    if options["rcvbuf"]:
+        _set(sock, socket.SOL_SOCKET, socket.SO_RCVBUF, options["rcvbuf"])
+    if sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return sock
+
+    _set(sock, socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if options["nodelay"] else 0)
+    if options["keepalive"]:
+        _set(sock, socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        # Linux names the idle option TCP_KEEPIDLE, macOS names it TCP_KEEPALIVE
+        keepidle = getattr(socket, "TCP_KEEPIDLE", getattr(socket, "TCP_KEEPALIVE", None))
+        if keepidle is not None and options["keepidle"]:
+            _set(sock, socket.IPPROTO_TCP, keepidle, options["keepidle"])
+        if hasattr(socket, "TCP_KEEPINTVL") and options["keepintvl"]:
+            _set(sock, socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, options["keepintvl"])
+        if hasattr(socket, "TCP_KEEPCNT") and options["keepcnt"]:
+            _set(sock, socket.IPPROTO_TCP, socket.TCP_KEEPCNT, options["keepcnt"])
+    return sock
+
+
+def tune_listener(sock, profile=None, reuse_port=False):
+    """
+    Prepares a listening socket before bind(). Accepted connections inherit the
+    listener's buffer sizes and TCP_NODELAY, so servers don't need to re-tune them.
+    """
+    _set(sock, socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port and hasattr(socket, "SO_REUSEPORT"):
+        _set(sock, socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    return tune_socket(sock, profile)
+
+
+def _set(sock, level, option, value):
+    try:
+        sock.setsockopt(level, option, value)
+    except (OSError, socket.error):
+        pass
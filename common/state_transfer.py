@@ -0,0 +1,233 @@
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+
+from communication_utils import *
+import metrics
+
+CHUNK_KEYS = int(os.environ.get("STATE_CHUNK_KEYS", 4096))  # Keys per state_chunk message
+WINDOW = int(os.environ.get("STATE_WINDOW", 8))              # Chunks the donor sends ahead of the receiver's acks
+TRANSFER_TTL = 60   # Seconds a donor keeps a snapshot around for a receiver to resume
+MAX_TRANSFERS = 2   # Snapshots a donor keeps at once
+
+CHUNKS_SENT = metrics.counter("state_chunks_sent", "State transfer chunks sent")
+CHUNKS_RECEIVED = metrics.counter("state_chunks_received", "State transfer chunks received and verified")
+TRANSFERS_RESUMED = metrics.counter("state_transfers_resumed", "State transfers resumed from an offset")
+
+
+class TransferInterrupted(Exception):
+    """Raised by receive_state when the stream breaks; `state` holds what arrived, for resume_fields()."""
+
+    def __init__(self, reason, state):
+        super().__init__(reason)
+        self.state = state
+
+
+class Transfer:
+    """
+    One snapshot being streamed; kept by the donor so an interrupted receiver can
+    resume it. The snapshot is a copy-on-write StoreView read a chunk at a time as
+    the stream needs it, so taking it does not stop the store from serving writes.
+    Nothing read is kept: the view can re-read from any position, so the transfer
+    only remembers the view position where each chunk it handed out ended.
+    """
+
+    def __init__(self, view):
+        self.transfer_id = uuid.uuid4().hex[:16]
+        self.view = view
+        self.cursors = {0: 0}  # offset (entries handed out) -> view position to read on from
+        self.count = view.count
+        self.version = view.version
+        self.lineage = view.lineage
+        self.used_at = time.time()
+        self.lock = threading.Lock()
+
+    def entries(self, start, stop):
+        """Entries start..stop of the snapshot; start must be 0 or where an earlier call stopped."""
+        with self.lock:
+            position = self.cursors.get(start)
+            if position is None or not self.view.open:
+                raise TransferInterrupted(f"Snapshot {self.transfer_id} has no cursor at key {start}", None)
+            entries, position = self.view.entries(position, stop - start)
+            self.cursors[start + len(entries)] = position
+            return entries
+
+    def resumable(self, offset):
+        with self.lock:
+            return offset in self.cursors and self.view.open
+
+    def close(self):
+        self.view.close()
+
+
+class StateDonor:
+    """
+    Streams whole-store snapshots as
+
+        state_begin  transfer_id, version, lineage, keys, offset
+        state_chunk  transfer_id, offset, keys, crc32 of the payload                   (repeated)
+                     followed by the payload line: the entries as a JSON object {key: value}
+        state_end    transfer_id, keys
+
+    The receiver answers every chunk with state_ack (the offset it now needs), and
+    the donor stays at most WINDOW chunks ahead of the acks, so a slow receiver
+    throttles the sender instead of piling up data in socket buffers. A request
+    carrying the transfer_id and offset of an interrupted stream resumes the same
+    snapshot from that offset while the donor still has it. The request's `retries`
+    says how many more attempts the receiver will make: a stream that fails with
+    none left releases its snapshot at once, as does a completed stream (unless the
+    caller passed the snapshot in and releases it itself). Snapshots kept for a
+    resume are dropped TRANSFER_TTL seconds after their last use.
+    """
+
+    def __init__(self, component_id, store):
+        self.component_id = component_id
+        self.store = store
+        self.transfers = {}  # transfer ID -> Transfer
+        self.lock = threading.Lock()
+        self.sweeper = None  # Timer that expires idle transfers, while there are any
+
+    def prepare(self):
+        """Takes a snapshot of the store to stream, to one receiver or several."""
+        with self.lock:
+            self._expire()
+            transfer = Transfer(self.store.view())
+            self.transfers[transfer.transfer_id] = transfer
+            while len(self.transfers) > MAX_TRANSFERS:
+                oldest = min(self.transfers.values(), key=lambda t: t.used_at)
+                self.transfers.pop(oldest.transfer_id).close()
+            self._schedule_expiry()
+            return transfer
+
+    def stream(self, sock, receiver, request=None, transfer=None):
+        """
+        Streams a snapshot to sock: the one the request resumes, else `transfer`
+        (from prepare()), else a new one. Raises TransferInterrupted if the receiver
+        goes away.
+        """
+        owned, request = transfer is None, request or {}
+        transfer, offset = self._resumed(request) or (transfer or self.prepare(), 0)
+        try:
+            self._send_snapshot(sock, receiver, transfer, offset)
+        except (TransferInterrupted, OSError):
+            if owned and not request.get("retries"):
+                self.release(transfer)  # Nobody will come back to resume it
+            raise
+        if owned:
+            self.release(transfer)
+
+    def _send_snapshot(self, sock, receiver, transfer, offset):
+        total = transfer.count
+        send(sock, create_message(self.component_id, "state_begin", transfer_id=transfer.transfer_id,
+                                  version=transfer.version, lineage=transfer.lineage, keys=total, offset=offset), receiver)
+        acked = offset
+        for start in range(offset, total, CHUNK_KEYS):
+            while start - acked >= WINDOW * CHUNK_KEYS:
+                acked = self._wait_ack(sock, receiver, transfer)
+            entries = transfer.entries(start, start + CHUNK_KEYS)
+            payload = json.dumps(dict(entries)).encode()
+            chunk = create_message(self.component_id, "state_chunk", transfer_id=transfer.transfer_id,
+                                   offset=start, keys=len(entries), crc=zlib.crc32(payload))
+            send_framed(sock, chunk, payload, receiver, False)
+            CHUNKS_SENT.inc()
+            transfer.used_at = time.time()
+        while acked < total:
+            acked = self._wait_ack(sock, receiver, transfer)
+        send(sock, create_message(self.component_id, "state_end", transfer_id=transfer.transfer_id, keys=total), receiver)
+
+    def release(self, transfer):
+        """Drops a snapshot nobody will resume, so writes stop preserving values for it."""
+        with self.lock:
+            self.transfers.pop(transfer.transfer_id, None)
+        transfer.close()
+
+    def _wait_ack(self, sock, receiver, transfer):
+        ack = receive(sock, receiver, False)
+        if not ack or ack.get("message") != "state_ack" or ack.get("transfer_id") != transfer.transfer_id:
+            raise TransferInterrupted(f"{receiver} stopped acknowledging state chunks", None)
+        return ack.get("offset", 0)
+
+    def _resumed(self, request):
+        """(transfer, offset) if the request continues a transfer this donor still has."""
+        with self.lock:
+            self._expire()
+            transfer = self.transfers.get(request.get("transfer_id"))
+            offset = request.get("offset")
+            if transfer and isinstance(offset, int) and transfer.resumable(offset):
+                TRANSFERS_RESUMED.inc()
+                transfer.used_at = time.time()
+                return transfer, offset
+            return None
+
+    def _expire(self):
+        now = time.time()
+        for transfer_id, transfer in list(self.transfers.items()):
+            if now - transfer.used_at > TRANSFER_TTL:
+                self.transfers.pop(transfer_id).close()
+
+    def _schedule_expiry(self):
+        """Arms the sweeper for when the least recently used transfer expires. Caller holds lock."""
+        if self.transfers and not self.sweeper:
+            due = min(transfer.used_at for transfer in self.transfers.values()) + TRANSFER_TTL
+            self.sweeper = threading.Timer(max(due - time.time(), 0) + 0.01, self._sweep)
+            self.sweeper.daemon = True
+            self.sweeper.start()
+
+    def _sweep(self):
+        with self.lock:
+            self.sweeper = None
+            self._expire()
+            self._schedule_expiry()
+
+
+class IncomingState:
+    """A snapshot being received; complete once `offset` reaches `keys`."""
+
+    def __init__(self, begin):
+        self.transfer_id = begin.get("transfer_id")
+        self.version = begin.get("version", 0)
+        self.lineage = begin.get("lineage")
+        self.keys = begin.get("keys", 0)
+        self.data = {}
+        self.offset = 0
+
+    def resume_fields(self):
+        """Fields for a request_state that continues this transfer where it stopped."""
+        return {"transfer_id": self.transfer_id, "offset": self.offset}
+
+
+def receive_state(sock, begin, component_id, previous=None):
+    """
+    Receives the stream that `begin` (a state_begin message) starts, continuing
+    `previous` if the donor resumed it. Returns the complete IncomingState, or raises
+    TransferInterrupted (carrying the verified part) if the stream breaks or a chunk
+    fails its checksum.
+    """
+    state = previous if previous and previous.transfer_id == begin.get("transfer_id") else IncomingState(begin)
+    if state.offset != begin.get("offset", 0):
+        raise TransferInterrupted(f"Donor resumed at {begin.get('offset')}, expected {state.offset}", None)
+    while True:
+        message = receive(sock, component_id, False)
+        message_type = message.get("message") if message else None
+        if message_type == "state_end" and state.offset == state.keys:
+            return state
+        if message_type != "state_chunk" or message.get("transfer_id") != state.transfer_id:
+            raise TransferInterrupted(f"State stream broke at key {state.offset} of {state.keys}", state)
+        payload = receive_frame(sock)
+        if payload is None:
+            raise TransferInterrupted(f"State stream broke at key {state.offset} of {state.keys}", state)
+        if message.get("offset") != state.offset or zlib.crc32(payload) != message.get("crc"):
+            raise TransferInterrupted(f"Bad state chunk at key {message.get('offset')}", state)
+        entries = json.loads(payload)
+        if len(entries) != message.get("keys"):
+            raise TransferInterrupted(f"Bad state chunk at key {message.get('offset')}", state)
+        state.data.update(entries)
+        state.offset += len(entries)
+        CHUNKS_RECEIVED.inc()
+        try:
+            send(sock, create_message(component_id, "state_ack", transfer_id=state.transfer_id, offset=state.offset), "Donor", False)
+        except OSError:
+            raise TransferInterrupted(f"State stream broke at key {state.offset} of {state.keys}", state)
@@ -0,0 +1,139 @@
+import os
+import shlex
+import subprocess
+import threading
+import time
+
+from communication_utils import *
+import metrics
+
+SERVER_COMMAND = os.environ.get("SERVER_COMMAND")                       # Command line the LFD runs its server with (unset: started by hand)
+RESTART_BACKOFF = float(os.environ.get("RESTART_BACKOFF", 0.5))         # Delay before the second restart in a row; doubles after each
+RESTART_BACKOFF_MAX = float(os.environ.get("RESTART_BACKOFF_MAX", 10))
+RESTART_STABLE = float(os.environ.get("RESTART_STABLE", 30))            # Uptime after which an exit counts as the first in a row again
+WARM_STANDBY = os.environ.get("WARM_STANDBY") == "1"                    # Keep a started, imported server waiting to take over
+
+RESTARTS = metrics.counter("lfd_server_restarts", "Times the supervisor restarted the server")
+RESTART_SECONDS = metrics.histogram("lfd_server_restart_seconds", "Server exit to its replacement process started (backoff included)")
+RECOVERY_SECONDS = metrics.histogram("lfd_server_recovery_seconds", "Server exit to its replacement registered with the LFD")
+STANDBY_ACTIVATIONS = metrics.counter("lfd_standby_activations", "Restarts served by activating the warm standby")
+
+
+class Supervisor:
+    """
+    Runs a command as a child process and restarts it as soon as it exits. A child
+    that keeps dying within RESTART_STABLE seconds of its start is restarted after
+    RESTART_BACKOFF, 2 * RESTART_BACKOFF, ... up to RESTART_BACKOFF_MAX, so a server
+    that cannot start does not spin. ready() marks the current child as recovered
+    (for the LFD: it registered), which closes its lfd_server_recovery_seconds sample.
+
+    With standby, a second copy of the command runs with SERVER_STANDBY=1 and waits in
+    wait_until_activated() (communication_utils). A restart activates it instead of
+    starting a new process, and the next standby is spawned once the activated one is
+    ready, so the two do not compete for the CPU during recovery.
+    """
+
+    def __init__(self, command, name="server", standby=None):
+        self.command = shlex.split(command) if isinstance(command, str) else list(command)
+        self.name = name
+        self.process = None
+        self.registered = None      # The child ready() was last called for
+        self.standby = None
+        self.use_standby = WARM_STANDBY if standby is None else standby
+        self.exited_at = None       # monotonic() of the last exit, until the replacement is ready
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+    def start(self):
+        if not self.thread:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        """Stops supervising and terminates the child."""
+        self.stopping = True
+        self.wake.set()
+        if self.standby:
+            self.standby.stdin.close()  # EOF: the standby exits by itself
+        process = self.process
+        if process and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def kill(self):
+        """
+        Kills the child that last became ready (e.g. one declared dead while it still runs);
+        it is restarted like after a crash. Its replacement may already be running, and is spared.
+        """
+        process = self.registered
+        if process and process.poll() is None:
+            process.kill()
+
+    def restart_now(self):
+        """Cuts a pending backoff short (an explicit recovery request)."""
+        self.wake.set()
+
+    def ready(self):
+        self.registered = self.process
+        if self.exited_at is not None:
+            RECOVERY_SECONDS.observe(time.monotonic() - self.exited_at)
+            self.exited_at = None
+        if self.use_standby and not self.stopping and not (self.standby and self.standby.poll() is None):
+            self.standby = self._spawn(standby=True)
+
+    def _run(self):
+        failures = 0
+        while not self.stopping:
+            started = time.monotonic()
+            code = self._spawn_and_wait()
+            if self.stopping:
+                return
+            exited_at = time.monotonic()
+            if self.exited_at is None:
+                self.exited_at = exited_at  # A crash loop counts towards one recovery, from the first exit
+            failures = failures + 1 if exited_at - started < RESTART_STABLE else 1
+            delay = 0 if failures == 1 else min(RESTART_BACKOFF_MAX, RESTART_BACKOFF * 2 ** (failures - 2))
+            get_logger().info("server exited", name=self.name, code=code, uptime=exited_at - started, restart_in=delay)
+            printR(f"{self.name} exited with code {code}. Restarting in {delay:.1f}s.")
+            self.wake.clear()
+            self.wake.wait(delay)
+            if not self.stopping:
+                RESTARTS.inc()
+                RESTART_SECONDS.observe(time.monotonic() - exited_at)
+
+    def _spawn_and_wait(self):
+        standby, self.standby = self.standby, None
+        activated = False
+        if standby and standby.poll() is None:
+            try:
+                self.process = standby  # Before it can register and call ready()
+                standby.stdin.write(b"activate\n")
+                standby.stdin.flush()
+                activated = True
+            except OSError:
+                standby.kill()  # Died just now; start afresh
+        process = standby if activated else self._spawn()
+        if not process:
+            return None
+        self.process = process
+        if activated:
+            STANDBY_ACTIVATIONS.inc()
+        get_logger().info("server started", name=self.name, pid=process.pid, standby=activated)
+        printG(f"Started {self.name} (pid {process.pid}{', warm standby' if activated else ''}).")
+        return process.wait()
+
+    def _spawn(self, standby=False):
+        env = dict(os.environ, SERVER_STANDBY="1") if standby else None
+        try:
+            process = subprocess.Popen(self.command, stdin=subprocess.PIPE if standby else None, env=env)
+        except OSError as e:
+            printR(f"Failed to start {self.name} ({shlex.join(self.command)}): {e}")
+            return None
+        if standby:
+            get_logger().info("standby spawned", name=self.name, pid=process.pid)
+        return process
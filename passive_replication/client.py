@@ -2,106 +2,128 @@ import socket
 import time
 import os, sys
 import threading
-from dotenv import load_dotenv
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
 from communication_utils import *
+from connection_pool import ConnectionPool
+from sharding import load_shard_map, request_keys
+import metrics
 
-load_dotenv()
+load_env_file(__file__)
 
 # List of server IPs in order of preference
-SERVER_MAP = {
-    '172.26.122.219': 'S1',
-    '172.26.99.196': 'S2'
-    #'172.26.20.148': 'S3'
-}
-SERVER_IPS = list(SERVER_MAP.keys())
+SERVER_IDS = ['S1', 'S2', 'S3']
+SERVER_IPS = [
+    os.environ.get('S1', '172.26.122.219'),
+    os.environ.get('S2', '172.26.99.196'),
+    os.environ.get('S3', '172.26.20.148'),
+]
 
-RM_IP = 'localhost'
-RM_PORT = 13579
+RM_IP = os.environ.get("RM_IP", 'localhost')
+RM_PORT = env_port("RM_CLIENT_PORT", 13579)
+REQUEST_INTERVAL = float(os.environ.get("REQUEST_INTERVAL", 2))  # Seconds between requests
 
 
 class Client:
-    def __init__(self, server_port, client_id):
+    def __init__(self, server_port, client_id, request_interval=REQUEST_INTERVAL):
         self.server_ips = SERVER_IPS
         self.server_port = server_port
         self.client_id = client_id
+        self.request_interval = request_interval
+        self.shard_map = load_shard_map()  # Routes each key to its replica group; None: a single group
+        self.keys = request_keys()
         self.socket = None
-        self.connected_server = None
+        self.connected_server = None  # (group, server ID) the last request went to
+        self.pool = ConnectionPool()
         self.request_number = 0
-        self.rmsocket = None
-        self.primary = -1
+        self.rm_sockets = {}  # group -> connection to the group's RM
+        self.primaries = {}   # group -> primary server ID, as announced by the group's RM
 
-    def listen_to_rm(self):
-        while self.rmsocket:
+    def groups(self):
+        return list(self.shard_map.groups) if self.shard_map else [None]
+
+    def servers(self, group):
+        """Server ID -> (ip, port) of a replica group (None: the one deployment described by the environment)."""
+        if self.shard_map:
+            return self.shard_map.server_addresses(group)
+        return {server_id: (ip, server_port(server_id, "SERVER_PORT", self.server_port))
+                for server_id, ip in zip(SERVER_IDS, self.server_ips)}
+
+    def listen_to_rm(self, group):
+        sock = self.rm_sockets[group]
+        while True:
             try:
-                message = receive(self.rmsocket, "RM")
-                print(message)
-                self.primary = int(message.get("primary_server")[-1])
+                message = receive(sock, "RM")
+                if not message:
+                    printR(f"Lost connection to RM{f' of group {group}' if group else ''}.")
+                    break
+                if message.get("primary_server"):
+                    self.primaries[group] = message["primary_server"]
             except Exception as e:
                 printR(f"Error during communication with RM: {e}")
 
 
-    def connect_to_rm(self):
-        try:
-             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-             sock.connect((RM_IP, RM_PORT))
-             self.rmsocket = sock
-             printG("Connected to RM")
-             threading.Thread(target=self.listen_to_rm, daemon=True).start()
-             return True
-        except Exception as e:
-             printR(f"Failed to connect to RM: {e} ")
-        return False
+    def connect_to_rm(self, group=None):
+        ip, port = self.shard_map.rm_address(group) if self.shard_map else (RM_IP, RM_PORT)
+        sock = connect_to_socket(ip, port)  # Held open for primary announcements, so not pooled
+        if not sock:
+            printR(f"Failed to connect to RM at {format_address(ip, port)}")
+            return False
+        self.rm_sockets[group] = sock
+        printG(f"Connected to RM at {format_address(ip, port)}")
+        threading.Thread(target=self.listen_to_rm, args=(group,), daemon=True).start()
+        return True
+
+    def connect_to_server(self, group=None):
+        """Lease a connection to the group's current primary; an idle pooled one is reused."""
+        server_id = self.primaries.get(group)
+        if server_id not in self.servers(group):
+            return False
+        ip, port = self.servers(group)[server_id]
+        sock = self.pool.lease(ip, port)
+        if not sock:
+            return False
+        self.socket = sock
+        if self.connected_server != (group, server_id):
+            printG(f"Connected to server {server_id}{f' of group {group}' if group else ''} ({format_address(ip, port)})")
+        self.connected_server = (group, server_id)
+        return True
 
-    def connect_to_server(self):
-        """Connect to a server from the list of IPs."""
-        ip = self.server_ips[self.primary - 1]
+    def send_and_receive(self, key):
+        """Send one request to the primary and return the connection to the pool once it is answered."""
+        server_id = self.connected_server[1]
         try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.connect((ip, self.server_port))
-                self.socket = sock
-                self.connected_server = ip
-                server_id = SERVER_MAP.get(ip, "Unknown")
-                printG(f"Connected to server {server_id} ({ip}:{self.server_port})")
-                return True
-        except Exception as e:
-                printR(f"Failed to connect to server {ip}:{self.server_port}: {e}")
-        return False
+            message = create_message(self.client_id, "increase", key=key, request_number=self.request_number)
+            send(self.socket, message, server_id)
+            self.request_number += 1
 
-    def send_and_receive(self):
-        """Send messages to the server and receive responses."""
-        server_id = SERVER_MAP.get(self.connected_server, "Unknown")
-        while self.socket:
-            try:
-                message = create_message(self.client_id, "increase", request_number=self.request_number)
-                send(self.socket, message, server_id)
-                self.request_number += 1
-
-                response = receive(self.socket, server_id)
-                if not response:
-                    printR("Server disconnected. Reconnecting...")
-                    self.socket.close()
-                    self.socket = None
-                    break
-                time.sleep(2)  # Simulate client request frequency
-            except Exception as e:
-                printR(f"Error during communication: {e}")
-                self.socket.close()
-                self.socket = None
-                break
+            response = receive(self.socket, server_id)
+            if response:
+                self.pool.release(self.socket)
+            else:
+                printR("Server disconnected. Reconnecting...")
+                self.pool.discard(self.socket)
+                self.connected_server = None
+        except Exception as e:
+            printR(f"Error during communication: {e}")
+            self.pool.discard(self.socket)
+            self.connected_server = None
+        self.socket = None
 
 
     def run(self):
-        self.connect_to_rm()
         """Run the client."""
-        while(self.primary == -1):
+        metrics.start_metrics()
+        for group in self.groups():
+            self.connect_to_rm(group)
+        while len(self.primaries) < len(self.groups()):
             time.sleep(1)
         while True:
-            if not self.socket:
-                printY("Attempting to connect to a server...")
-                if not self.connect_to_server():
-                    printR("All servers are unreachable. Retrying in 5 seconds...")
-                    time.sleep(5)
-                    continue
-
-            self.send_and_receive()
+            # Each request goes to the primary of the group owning its key
+            key = self.keys[self.request_number % len(self.keys)]
+            if not self.connect_to_server(self.shard_map.group_for(key) if self.shard_map else None):
+                printR("All servers are unreachable. Retrying in 5 seconds...")
+                time.sleep(5)
+                continue
+
+            self.send_and_receive(key)
+            time.sleep(self.request_interval)  # Simulate client request frequency
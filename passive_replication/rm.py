@@ -3,13 +3,18 @@ import json
 import sys, os, threading
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
 from communication_utils import *
+from heartbeat import check_lease
+import metrics
 
 # Global Variables
 available_servers = []  # List of active servers
 primary_server = "S1"   # Initial primary server
 client_sockets = []
+PRIMARY_LEASE = float(os.environ.get("PRIMARY_LEASE", 0))  # Seconds; 0 disables primary leases
 
 assign_intial_primary = False
+gfd_connected = False
+MEMBER_COUNT = 0
 
 def handle_GFD_message(sock, message):
     global MEMBER_COUNT, available_servers, primary_server
@@ -35,6 +40,7 @@ def handle_GFD_message(sock, message):
             # Server removed
             printR(f"RM Membership Decreased: {new_member_count} available servers")
             printY(f"Attempting to Automatically Recover {server_id}")
+            metrics.counter("rm_recoveries", "Recovery commands issued", server=server_id).inc()
             send(sock, create_message("RM", "recover_server", server_id=server_id), "GFD")
             remove_server(server_id, sock)
         else:
@@ -85,19 +91,30 @@ def promote_new_primary(gfd_sock):
         return
 
     primary_server = new_primary
+    get_logger().info("primary promoted", server_id=new_primary)
+    metrics.counter("rm_primary_promotions", "Primary promotions", server=new_primary).inc()
 
-    for sock in client_sockets:
-        send(sock, create_message("RM", "primary_server", primary_server=new_primary), "Client")
+    notify_clients(create_message("RM", "primary_server", primary_server=new_primary))
     printY(f"Promoting {primary_server} to primary server.")
 
     # Notify GFD about the new primary
     try:
-        message = create_message("RM", "new_primary", server_id=new_primary)
+        message = create_message("RM", "new_primary", server_id=new_primary, lease=PRIMARY_LEASE)
         send(gfd_sock, message, "GFD")
         printG(f"Notified GFD that {new_primary} is the new primary server.")
     except Exception as e:
         printR(f"Failed to notify GFD about new primary server: {e}")
 
+def notify_clients(message):
+    """Fans a message out to every connected client, dropping connections that have gone away."""
+    for sock in list(client_sockets):
+        try:
+            send(sock, message, "Client")
+        except Exception as e:
+            printR(f"Dropping unreachable client: {e}")
+            client_sockets.remove(sock)
+            sock.close()
+
 
 def accept_client_connections(server_socket):
     """Accepts client connections and sends the primary server IP to clients upon connection."""
@@ -121,17 +138,33 @@ def accept_client_connections(server_socket):
         except Exception as e:
             printR(f"Error accepting client connections: {e}")
 
+def health():
+    """Status for /health and /ready: ready while the GFD is connected."""
+    return {
+        "component": "RM",
+        "role": "rm",
+        "ready": gfd_connected,
+        "member_count": MEMBER_COUNT,
+        "servers": list(available_servers),
+        "primary": primary_server,
+        "lease": PRIMARY_LEASE or None,
+        "clients": len(client_sockets),
+    }
+
 def main():
     COMPONENT_NAME = "Replication Manager"
     COMPONENT_ID = "RM"
-    RM_IP = '127.0.0.1'
-    RM_PORT = 12346
-    CLIENT_PORT = 13579
+    RM_IP = listen_address(os.environ.get("RM_IP"), '127.0.0.1')
+    RM_PORT = env_port("RM_PORT", 12346)
+    CLIENT_PORT = env_port("RM_CLIENT_PORT", 13579)
 
-    global MEMBER_COUNT
+    global MEMBER_COUNT, gfd_connected
     MEMBER_COUNT = 0
+    check_lease(PRIMARY_LEASE)
 
     rm_socket = initialize_component(COMPONENT_ID, COMPONENT_NAME, RM_IP, RM_PORT, 1)
+    metrics.set_health(health)
+    metrics.start_metrics()
     client_socket = initialize_component(COMPONENT_ID, "Client Listener", RM_IP, CLIENT_PORT, 1)
 
     threading.Thread(target=accept_client_connections, args=(client_socket,), daemon=True).start()
@@ -143,12 +176,14 @@ def main():
             # Accept a connection from the GFD
             conn, addr = rm_socket.accept()
             printG(f"Connected to GFD at {addr}")
+            gfd_connected = True
             while True:
                 message = receive(conn, COMPONENT_ID)
                 if not message:
                     printR("GFD disconnected.")
                     break
                 handle_GFD_message(conn, message)
+            gfd_connected = False
             conn.close()
             printY("Waiting to connect to GFD")  # Wait for GFD reconnection if disconnected
         except (socket.error, json.JSONDecodeError) as e:
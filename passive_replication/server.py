@@ -4,76 +4,138 @@ import time
 import threading
 import os
 import sys
-from dotenv import load_dotenv
+from queue import Queue, Empty
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
 from communication_utils import *
+from connection_pool import ConnectionPool
+from kv_store import KVStore, CHANGELOG_SIZE, NoLease, apply_request, apply_read, request_key
+from sharding import load_shard_map
+from durability import open_storage
+from state_transfer import StateDonor, TransferInterrupted, receive_state
+from heartbeat import HeartbeatResponder, udp_heartbeats, check_lease
+from gossip import gossip_membership
+import metrics
 
-load_dotenv()
+load_env_file(__file__)
 
 # Configuration
 COMPONENT_ID = os.environ.get("MY_SERVER_ID")  # Unique ID for each server (e.g., 'S1', 'S2', ...)
-SERVER_IP = '0.0.0.0'
-SERVER_PORT = 12346
-CHECKPOINT_PORT = 12347
+SERVER_IP = listen_address(os.environ.get(COMPONENT_ID or ""))  # 0.0.0.0 unless this server's address is unix:
+SERVER_PORT = server_port(COMPONENT_ID, "SERVER_PORT", 12346)
+CHECKPOINT_PORT = server_port(COMPONENT_ID, "CHECKPOINT_PORT", 12347)
 PRIMARY_SERVER_ID = 'S1'  # Primary server starts as S1
 
 SERVER_IDS = ['S1', 'S2', 'S3']
 SERVER_IPS = {
-    'S1': '172.26.122.219',
-    'S2': '172.26.99.196',
-    'S3': '172.26.20.148',
+    'S1': os.environ.get('S1', '172.26.122.219'),
+    'S2': os.environ.get('S2', '172.26.99.196'),
+    'S3': os.environ.get('S3', '172.26.20.148'),
 }
 
 CHECKPOINT_INTERVAL = None
 LFD_IP = '127.0.0.1'
-LFD_PORT = 54321
+LFD_PORT = env_port("LFD_PORT", 54321)
+LFD_SOCKET = local_socket_path("LFD", LFD_PORT) if os.environ.get("LFD_TRANSPORT") == "unix" else None
+LFD_RETRY_MAX = 5  # Seconds between attempts to reach an LFD that is not up yet, at most
+PRIMARY_LEASE = float(os.environ.get("PRIMARY_LEASE", 0))  # > 0: serve only under a lease from the GFD
+LEASE_MARGIN = float(os.environ.get("LEASE_MARGIN", 0.1))  # Seconds; must cover the grant's delivery delay from the GFD
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 1))       # > 1: group requests and their replies
+BATCH_MAX_DELAY = float(os.environ.get("BATCH_MAX_DELAY", 0.001))  # Seconds a batch waits to fill up
 
-state = 0
+store = KVStore(int(os.environ.get("CHANGELOG_SIZE", CHANGELOG_SIZE)))
+storage = None  # durability.Storage when DATA_DIR is set
+donor = StateDonor(COMPONENT_ID, store)
+SHARD_MAP = load_shard_map()  # None unless this deployment is one of several replica groups
+SHARD_ID = os.environ.get("MY_SHARD_ID")
 role = 'backup'
+last_checkpoint_at = None  # time.time() of the last checkpoint applied, for backup read replies
+lease_until = None         # time.monotonic() at which the primary lease ends
+batch_queue = Queue()      # (client socket, message, received_at) waiting for the batch committer
+backup_versions = {}       # server ID -> (lineage, version) a backup last acknowledged, for delta checkpoints
 clients = {}
 client_lock = threading.Lock()
 lfd_socket = None
+serving = False  # Listening for clients and checkpoints
+heartbeat_responder = None  # Answers the LFD's UDP heartbeats (HEARTBEAT_TRANSPORT=udp)
+checkpoint_pool = ConnectionPool(max_idle=60)
+
+CONNECTED_CLIENTS = metrics.gauge("server_connected_clients", "Client connections currently open")
+STORE_KEYS = metrics.gauge("server_store_keys", "Keys in the replicated store")
+CHECKPOINTS_APPLIED = metrics.counter("server_checkpoints_applied", "Checkpoints applied by this backup")
+BATCHES = metrics.counter("server_batches", "Request batches committed (requests / batches = mean batch size)")
 
 
 def connect_to_lfd():
-    global lfd_socket, CHECKPOINT_INTERVAL
+    global lfd_socket, heartbeat_responder, CHECKPOINT_INTERVAL
+    delay = 0.1  # Doubles up to LFD_RETRY_MAX, so a server started just before its LFD is not held up long
     while not lfd_socket:
         try:
-            lfd_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            lfd_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            lfd_socket.connect((LFD_IP, LFD_PORT))
-            printG(f"Connected to LFD at {LFD_IP}:{LFD_PORT}")
-            registration_message = create_message(COMPONENT_ID, "register", checkpoint=CHECKPOINT_INTERVAL)
+            lfd_socket = connect_to_unix_socket(LFD_SOCKET) if LFD_SOCKET else connect_to_socket(LFD_IP, LFD_PORT)
+            if not lfd_socket:
+                raise ConnectionError(f"LFD at {LFD_SOCKET or f'{LFD_IP}:{LFD_PORT}'} unreachable")
+            printG(f"Connected to LFD at {LFD_SOCKET or f'{LFD_IP}:{LFD_PORT}'}")
+            heartbeat_fields = {}
+            if udp_heartbeats() or gossip_membership():
+                # With gossip, peer LFDs on other hosts probe it too before this server is declared dead
+                responder_ip = '0.0.0.0' if gossip_membership() else '127.0.0.1'
+                heartbeat_responder = heartbeat_responder or HeartbeatResponder(COMPONENT_ID, note_lease, ip=responder_ip)
+                heartbeat_fields["heartbeat_port"] = heartbeat_responder.port
+            registration_message = create_message(COMPONENT_ID, "register", checkpoint=CHECKPOINT_INTERVAL, **heartbeat_fields)
             send(lfd_socket, registration_message, "LFD")
         except Exception as e:
-            printR(f"Failed to connect to LFD: {e}. Retrying in 5 seconds...")
+            printR(f"Failed to connect to LFD: {e}. Retrying in {delay:.1f} seconds...")
             lfd_socket = None
-            time.sleep(5)
+            time.sleep(delay)
+            delay = min(LFD_RETRY_MAX, delay * 2)
+
+
+def has_lease():
+    return lease_until is not None and time.monotonic() < lease_until - LEASE_MARGIN
+
+
+def note_lease(message):
+    """
+    Takes the lease a heartbeat or new_primary from the LFD carries, if any. It is a
+    duration, counted from now on this host's monotonic clock, so the GFD's clock never
+    matters; LEASE_MARGIN covers the time the grant spent in transit.
+    """
+    global lease_until
+    if message.get("lease_seconds") is not None:
+        had_lease = has_lease()
+        lease_until = time.monotonic() + message["lease_seconds"]
+        if not had_lease and has_lease():
+            get_logger().info("lease acquired", server_id=COMPONENT_ID, lease_seconds=message["lease_seconds"])
 
 
 def handle_heartbeat():
     global role, PRIMARY_SERVER_ID
     while True:
+        message = None
         try:
             if lfd_socket:
                 message = receive(lfd_socket, COMPONENT_ID)
                 if message:
                     action = message.get("message")
+                    note_lease(message)
                     if action == "heartbeat":
                         # Acknowledge heartbeat
                         heartbeat_message = create_message(COMPONENT_ID, "heartbeat acknowledgment")
                         send(lfd_socket, heartbeat_message, "LFD")
                     elif action == "new_primary":
-                        # Promote self to primary
+                        # Promote self to primary. Writes from here on start a new lineage, so a backup
+                        # holding state from the old primary gets a full checkpoint, not a delta.
+                        store.fork()
                         role = 'primary'
                         PRIMARY_SERVER_ID = COMPONENT_ID
                         printG(f"Server {COMPONENT_ID} promoted to primary.")
+                        get_logger().info("promoted to primary", server_id=COMPONENT_ID)
                         threading.Thread(target=send_checkpoint, daemon=True).start()
                     else:
                         printY(f"Unknown message received from LFD: {message}")
         except Exception as e:
             printR(f"Error handling heartbeat or role change: {e}")
-        time.sleep(1)
+        if not message:
+            time.sleep(1)  # No LFD connection; receive() already blocks between heartbeats
 
 
 def accept_client_connections(server_socket):
@@ -83,112 +145,296 @@ def accept_client_connections(server_socket):
             printG(f"Client connected: {client_address}")
             with client_lock:
                 clients[client_socket] = client_address
+                CONNECTED_CLIENTS.set(len(clients))
             threading.Thread(target=handle_client_requests, args=(client_socket,), daemon=True).start()
         except Exception as e:
             printR(f"Error accepting client connections: {e}")
 
 
+def process_request(message):
+    """Primary: applies the request. Backup: answers get from the last checkpoint, rejects writes."""
+    request_number = message.get("request_number", "unknown")
+    try:
+        if SHARD_MAP:
+            SHARD_MAP.check(SHARD_ID, request_key(message))
+        if role == 'primary':
+            if PRIMARY_LEASE and not has_lease():
+                raise NoLease(f"{COMPONENT_ID} holds no primary lease")
+            response_type, fields = apply_request(store, message)
+        else:
+            response_type, fields = apply_read(store, message)
+            fields["checkpoint_age"] = None if last_checkpoint_at is None else time.time() - last_checkpoint_at
+        return create_message(COMPONENT_ID, response_type, request_number=request_number, **fields)
+    except ValueError as e:
+        printY(str(e))
+        return create_message(COMPONENT_ID, "error", error=str(e), reason=type(e).__name__, request_number=request_number)
+
+
+def record_request(message_type, received_at):
+    metrics.counter("server_requests", "Client requests served", type=message_type).inc()
+    metrics.histogram("server_request_seconds", "Request receipt to reply sent", type=message_type).observe(time.perf_counter() - received_at)
+
+
 def handle_client_requests(client_socket):
-    global state
     try:
         while True:
-            if role != 'primary':  # Only primary handles client requests
-                continue
             message = receive(client_socket, COMPONENT_ID)
             if not message:
                 printY("Client disconnected.")
                 break
 
-            message_type = message.get("message")
-            request_number = message.get("request_number", "unknown")
-            component_id = message.get("component_id", "unknown")
-
-            if message_type == "increase":
-                state += 1
-                response = create_message(COMPONENT_ID, "state increased", state=state, request_number=request_number)
-                send(client_socket, response, component_id)
-            elif message_type == "decrease":
-                state -= 1
-                response = create_message(COMPONENT_ID, "state decreased", state=state, request_number=request_number)
-                send(client_socket, response, component_id)
-            else:
-                printY(f"Unknown message type: {message_type}")
+            received_at = time.perf_counter()
+            if BATCH_MAX_SIZE > 1:
+                batch_queue.put((client_socket, message, received_at))
+                continue
+            response = process_request(message)
+            if storage:
+                storage.wait(response.get("version", 0))  # Reply only once the write is durable
+            send(client_socket, response, message.get("component_id", "unknown"))
+            STORE_KEYS.set(len(store))
+            record_request(message.get("message"), received_at)
     except Exception as e:
         printR(f"Error handling client request: {e}")
     finally:
         with client_lock:
             clients.pop(client_socket, None)
+            CONNECTED_CLIENTS.set(len(clients))
         client_socket.close()
 
 
+def commit_batches():
+    """
+    Group commit: takes up to BATCH_MAX_SIZE requests from all clients, waiting at most
+    BATCH_MAX_DELAY after the first, applies them in arrival order, then writes each
+    client's replies with a single vectored send.
+    """
+    while True:
+        commit_batch(next_batch())
+
+
+def next_batch():
+    """Blocks for a request, then returns it with those queued within BATCH_MAX_DELAY, up to BATCH_MAX_SIZE."""
+    batch = [batch_queue.get()]
+    deadline = time.perf_counter() + BATCH_MAX_DELAY
+    while len(batch) < BATCH_MAX_SIZE:
+        remaining = deadline - time.perf_counter()
+        try:
+            batch.append(batch_queue.get(timeout=remaining) if remaining > 0 else batch_queue.get_nowait())
+        except Empty:
+            break
+    return batch
+
+
+def commit_batch(batch):
+    """Applies a batch, makes it durable with one WAL wait, then replies to each client with one send_many()."""
+    replies = {}  # client socket -> (client ID, [responses] in request order)
+    for client_socket, message, received_at in batch:
+        component_id = message.get("component_id", "unknown")
+        replies.setdefault(client_socket, (component_id, []))[1].append(process_request(message))
+    STORE_KEYS.set(len(store))
+    BATCHES.inc()
+    if storage:
+        storage.wait(store.version)  # One WAL fsync covers the whole batch
+
+    for client_socket, (component_id, responses) in replies.items():
+        try:
+            send_many(client_socket, responses, component_id)
+        except OSError:
+            pass  # The client's reader thread notices the closed connection
+    for client_socket, message, received_at in batch:
+        record_request(message.get("message"), received_at)
+
+
+def delta_checkpoint_for(server_id, checkpoint_socket):
+    """
+    Builds a checkpoint with the changes since the version the backup last
+    acknowledged, or returns None if the change log cannot cover them and the whole
+    store must be streamed. A backup not heard from on this connection, e.g. one
+    that restarted from its snapshot file, is asked for its version.
+    """
+    if server_id not in backup_versions:
+        send(checkpoint_socket, create_message(COMPONENT_ID, "request_version"), f"Backup {server_id}")
+        reply = receive(checkpoint_socket, f"Backup {server_id}")
+        if reply and reply.get("message") == "version_response":
+            backup_versions[server_id] = (reply.get("lineage"), reply.get("version"))
+    lineage, since = backup_versions.get(server_id, (None, None))
+    delta = store.changes_since(lineage, since) if since is not None else None
+    if delta is None:
+        return None
+    changes, version = delta
+    return create_message(COMPONENT_ID, "checkpoint", delta=changes, since=since, version=version, lineage=lineage)
+
+
 def send_checkpoint():
-    global state, CHECKPOINT_INTERVAL
+    global CHECKPOINT_INTERVAL
     while role == 'primary':
         time.sleep(CHECKPOINT_INTERVAL)
+        transfer = None  # Full snapshot, taken at most once per round and shared by every backup that needs it
         for server_id, server_ip in SERVER_IPS.items():
             if server_id == COMPONENT_ID:
                 continue  # Skip self
+            checkpoint_socket = checkpoint_pool.lease(server_ip, server_port(server_id, "CHECKPOINT_PORT", 12347))
+            if not checkpoint_socket:
+                backup_versions.pop(server_id, None)
+                continue
+            started = time.perf_counter()
             try:
-                checkpoint_socket = connect_to_socket(server_ip, CHECKPOINT_PORT)
-                if checkpoint_socket:
-                    checkpoint_message = create_message(COMPONENT_ID, "checkpoint", state=state)
+                checkpoint_message = delta_checkpoint_for(server_id, checkpoint_socket)
+                if checkpoint_message:
                     send(checkpoint_socket, checkpoint_message, f"Backup {server_id}")
-                    ack = receive(checkpoint_socket, f"Backup {server_id}")
-                    if ack and ack.get("message") == "checkpoint_acknowledgment":
-                        printG(f"Checkpoint acknowledged by {server_id}.")
-                    checkpoint_socket.close()
+                else:
+                    transfer = transfer or donor.prepare()
+                    donor.stream(checkpoint_socket, f"Backup {server_id}", transfer=transfer)
+                ack = receive(checkpoint_socket, f"Backup {server_id}")
+                if ack and ack.get("message") == "checkpoint_acknowledgment":
+                    printG(f"Checkpoint acknowledged by {server_id}.")
+                    backup_versions[server_id] = (ack.get("lineage"), ack.get("version"))
+                    checkpoint_pool.release(checkpoint_socket)
+                    metrics.histogram("server_checkpoint_seconds", "Checkpoint send to acknowledgment", backup=server_id).observe(time.perf_counter() - started)
+                    metrics.counter("server_checkpoints_sent", "Checkpoints sent", backup=server_id,
+                                    kind="delta" if checkpoint_message else "full").inc()
+                else:
+                    backup_versions.pop(server_id, None)
+                    checkpoint_pool.discard(checkpoint_socket)
+                    metrics.counter("server_checkpoint_failures", "Checkpoints not acknowledged", backup=server_id).inc()
             except Exception as e:
                 printR(f"Failed to send checkpoint to {server_id}: {e}")
+                backup_versions.pop(server_id, None)
+                checkpoint_pool.discard(checkpoint_socket)
+                metrics.counter("server_checkpoint_failures", "Checkpoints not acknowledged", backup=server_id).inc()
+        if transfer:
+            donor.release(transfer)
 
 
 def accept_checkpoint_connections(checkpoint_socket):
-    global state
     while True:
         try:
             conn, addr = checkpoint_socket.accept()
-            message = receive(conn, "Primary")
-            if message and message.get("message") == "checkpoint":
-                state = message.get("state", state)
-                printG(f"State synchronized to {state} via checkpoint.")
-                acknowledgment = create_message(COMPONENT_ID, "checkpoint_acknowledgment")
-                send(conn, acknowledgment, "Primary")
-            conn.close()
+            threading.Thread(target=handle_checkpoint_connection, args=(conn,), daemon=True).start()
         except Exception as e:
             printR(f"Error accepting checkpoint: {e}")
 
 
+def handle_checkpoint_connection(conn):
+    """
+    Applies checkpoints from the primary until it closes the (pooled) connection: a
+    delta checkpoint message, or a full store streamed in chunks (state_begin).
+    Also answers request_state.
+    """
+    global last_checkpoint_at
+    try:
+        while True:
+            message = receive(conn, "Primary")
+            if not message:
+                break
+            if message.get("message") == "checkpoint" and "delta" in message:
+                try:
+                    store.apply_delta(message["delta"], message.get("since"), message.get("version", 0), message.get("lineage"))
+                    last_checkpoint_at = time.time()
+                    if storage:
+                        storage.wait(store.version)
+                    CHECKPOINTS_APPLIED.inc()
+                    printG(f"State synchronized via delta checkpoint: {len(message['delta'])} changed keys, now at version {store.version}.")
+                except ValueError as e:
+                    printY(str(e))  # The acknowledgment carries our real version, so the next checkpoint is full
+                STORE_KEYS.set(len(store))
+                acknowledgment = create_message(COMPONENT_ID, "checkpoint_acknowledgment", version=store.version, lineage=store.lineage)
+                send(conn, acknowledgment, "Primary")
+            elif message.get("message") == "state_begin":
+                try:
+                    incoming = receive_state(conn, message, COMPONENT_ID)
+                except TransferInterrupted as e:
+                    printY(f"Checkpoint stream from the primary stopped: {e}")
+                    break  # The primary sends a fresh checkpoint next round
+                store.load(incoming.data, incoming.version, incoming.lineage)
+                last_checkpoint_at = time.time()
+                if storage:
+                    storage.snapshot()
+                STORE_KEYS.set(len(store))
+                CHECKPOINTS_APPLIED.inc()
+                printG(f"State synchronized via checkpoint: {len(store)} keys at version {store.version}.")
+                acknowledgment = create_message(COMPONENT_ID, "checkpoint_acknowledgment", version=store.version, lineage=store.lineage)
+                send(conn, acknowledgment, "Primary")
+            elif message.get("message") == "request_version":
+                response = create_message(COMPONENT_ID, "version_response", version=store.version, lineage=store.lineage)
+                send(conn, response, "Primary")
+            elif message.get("message") == "request_state":
+                donor.stream(conn, message.get("component_id", "Requesting Server"), message)
+    except Exception as e:
+        printR(f"Error handling checkpoint connection: {e}")
+    finally:
+        conn.close()
+
+
 def synchronize_with_primary():
-    global state
-    primary_ip, checkpoint_port = SERVER_IPS[PRIMARY_SERVER_ID], CHECKPOINT_PORT
+    primary_ip, checkpoint_port = SERVER_IPS[PRIMARY_SERVER_ID], server_port(PRIMARY_SERVER_ID, "CHECKPOINT_PORT", 12347)
     try:
         checkpoint_socket = connect_to_socket(primary_ip, checkpoint_port, timeout=5)
         if checkpoint_socket:
             sync_request = create_message(COMPONENT_ID, "request_state")
             send(checkpoint_socket, sync_request, "Primary")
             response = receive(checkpoint_socket, "Primary")
-            if response and response.get("message") == "state_response":
-                state = response.get("state", state)
-                printG(f"State synchronized with primary: {state}")
+            if response and response.get("message") == "state_begin":
+                incoming = receive_state(checkpoint_socket, response, COMPONENT_ID)
+                store.load(incoming.data, incoming.version, incoming.lineage)
+                STORE_KEYS.set(len(store))
+                printG(f"State synchronized with primary: {len(store)} keys at version {store.version}")
             checkpoint_socket.close()
     except Exception as e:
         printR(f"Failed to synchronize with primary: {e}")
 
 
+def health():
+    """
+    Status for /health and /ready. A primary is ready while it may serve (holds its lease,
+    if leases are on); a backup once it has state to answer reads from (a checkpoint,
+    or a store recovered from disk).
+    """
+    if role == 'primary':
+        ready = serving and (not PRIMARY_LEASE or has_lease())
+    else:
+        ready = serving and (last_checkpoint_at is not None or bool(storage and store.version))
+    return {
+        "component": COMPONENT_ID,
+        "role": role,
+        "ready": ready,
+        "version": store.version,
+        "keys": len(store),
+        "checkpoints_applied": CHECKPOINTS_APPLIED.value,
+        "checkpoint_age": None if last_checkpoint_at is None else time.time() - last_checkpoint_at,
+        "backups": sorted(backup_versions) if role == 'primary' else None,
+        "lease_remaining": None if lease_until is None else lease_until - time.monotonic(),
+        "clients": len(clients),
+        "queued_requests": batch_queue.qsize(),
+        "lfd_connected": lfd_socket is not None,
+    }
+
+
 def main():
-    global CHECKPOINT_INTERVAL
+    global CHECKPOINT_INTERVAL, storage, serving
     parser = argparse.ArgumentParser(description="Server for passive replication.")
     parser.add_argument('--checkpoint_interval', type=int, default=10, help="Checkpoint interval in seconds.")
     args = parser.parse_args()
     CHECKPOINT_INTERVAL = args.checkpoint_interval
+    check_lease(PRIMARY_LEASE, LEASE_MARGIN)
+
+    storage = open_storage(store, COMPONENT_ID)
+    if storage:
+        printG(f"Recovered {len(store)} keys at version {store.version} from {storage.directory} ({storage.recovered} WAL records replayed).")
 
+    metrics.set_health(health)
+    metrics.start_metrics()
     connect_to_lfd()
     threading.Thread(target=handle_heartbeat, daemon=True).start()
 
     client_socket = initialize_component(COMPONENT_ID, "Client Handler", SERVER_IP, SERVER_PORT, 5)
     checkpoint_socket = initialize_component(COMPONENT_ID, "Checkpoint Handler", SERVER_IP, CHECKPOINT_PORT, 5)
 
+    if BATCH_MAX_SIZE > 1:
+        threading.Thread(target=commit_batches, daemon=True).start()
     threading.Thread(target=accept_client_connections, args=(client_socket,), daemon=True).start()
     threading.Thread(target=accept_checkpoint_connections, args=(checkpoint_socket,), daemon=True).start()
+    serving = True
 
     try:
         while True:
@@ -205,4 +451,5 @@ def main():
 
 
 if __name__ == "__main__":
+    wait_until_activated()
     main()
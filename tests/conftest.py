@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The components import each other as top-level modules from common/, as the scripts do
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'common'))
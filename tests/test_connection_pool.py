@@ -0,0 +1,40 @@
+import socket
+
+import pytest
+
+from communication_utils import receive
+from connection_pool import ConnectionPool
+
+
+@pytest.fixture
+def endpoint():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(4)
+    yield listener
+    listener.close()
+
+
+def test_released_connection_is_reused(endpoint):
+    pool = ConnectionPool()
+    sock = pool.lease(*endpoint.getsockname())
+    pool.release(sock)
+    assert pool.lease(*endpoint.getsockname()) is sock
+    pool.close_all()
+
+
+def test_connection_with_buffered_bytes_is_not_reused(endpoint):
+    pool = ConnectionPool()
+    sock = pool.lease(*endpoint.getsockname())
+    peer, _ = endpoint.accept()
+    # Two replies arrive in one segment; the caller reads only the first before releasing
+    peer.sendall(b"".join(b'{"message": "%s"}\n' % kind for kind in (b"first", b"late")))
+    sock.settimeout(1)
+    assert receive(sock, "S1", print_message=False)["message"] == "first"
+    pool.release(sock)
+
+    fresh = pool.lease(*endpoint.getsockname())
+    assert fresh is not sock
+    assert sock.fileno() < 0  # Closed rather than kept
+    pool.close_all()
+    peer.close()
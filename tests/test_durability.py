@@ -0,0 +1,103 @@
+import os
+
+from durability import Storage
+from kv_store import KVStore
+
+
+def open_store(directory, **options):
+    store = KVStore()
+    storage = Storage(store, str(directory), **options)
+    replayed = storage.recover()
+    return store, storage, replayed
+
+
+def test_recover_replays_the_wal(tmp_path):
+    store, storage, _ = open_store(tmp_path)
+    store.put("a", 1)
+    store.incr("a", 4)
+    store.put("b", 7)
+    store.delete("b")
+    storage.wait(store.version)
+
+    recovered, _, replayed = open_store(tmp_path)
+    assert replayed == 4
+    assert recovered.to_dict() == {"a": 5}
+    assert recovered.version == store.version
+
+
+def test_recover_ignores_a_torn_tail(tmp_path):
+    store, storage, _ = open_store(tmp_path)
+    store.put("a", 1)
+    store.put("b", 2)
+    storage.wait(store.version)
+    with open(storage.wal.name, "a") as f:
+        f.write('[3, "c"')  # Crash in the middle of a record
+
+    recovered, _, replayed = open_store(tmp_path)
+    assert replayed == 2
+    assert recovered.to_dict() == {"a": 1, "b": 2}
+
+
+def test_recover_from_snapshot_and_newer_segments(tmp_path):
+    store, storage, _ = open_store(tmp_path)
+    for i in range(50):
+        store.put(f"k{i}", i)
+    storage.wait(store.version)
+    storage.snapshot()
+    store.put("k0", 100)
+    store.delete("k1")
+    store.put("new", 1)
+    storage.wait(store.version)
+
+    files = sorted(os.listdir(tmp_path))
+    assert [name for name in files if name.startswith("snapshot-")] == ["snapshot-00000001.kvs"]
+    assert "wal-00000000.log" not in files  # Covered by the snapshot
+
+    recovered, _, replayed = open_store(tmp_path)
+    expected = {f"k{i}": i for i in range(50)}
+    expected.update({"k0": 100, "new": 1})
+    del expected["k1"]
+    assert replayed == 3
+    assert recovered.to_dict() == expected
+    assert recovered.version == store.version
+
+
+def test_lineage_change_survives_recovery(tmp_path):
+    store, storage, _ = open_store(tmp_path)
+    store.put("a", 1)
+    store.fork()
+    store.put("a", 2)
+    storage.wait(store.version)
+
+    recovered, _, _ = open_store(tmp_path)
+    assert recovered.lineage == store.lineage
+    assert recovered.get("a") == 2
+
+
+def test_records_of_a_new_lineage_replay_below_the_snapshot_version(tmp_path):
+    store, storage, _ = open_store(tmp_path, fsync_policy="always")
+    for i in range(5):
+        store.put(f"k{i}", i)
+    storage.snapshot()
+    # Another history, counting from a lower version than the snapshot's
+    storage.record(2, None, "other-lineage")
+    storage.record(3, "x", 9)
+
+    recovered, _, replayed = open_store(tmp_path)
+    assert replayed == 2
+    assert recovered.lineage == "other-lineage"
+    assert recovered.version == 3
+    assert recovered.get("x") == 9
+
+
+def test_background_snapshot_is_recoverable(tmp_path):
+    store, storage, _ = open_store(tmp_path, snapshot_every=10)
+    for i in range(25):
+        store.put(f"k{i}", i)
+        storage.wait(store.version)
+    with storage.snapshot_lock:  # Waits for a snapshot still being written
+        pass
+
+    assert any(name.startswith("snapshot-") for name in os.listdir(tmp_path))
+    recovered, _, _ = open_store(tmp_path)
+    assert recovered.to_dict() == {f"k{i}": i for i in range(25)}
@@ -0,0 +1,22 @@
+import os
+
+from communication_utils import load_env_file
+
+
+def test_env_file_is_found_above_the_script(tmp_path, monkeypatch):
+    monkeypatch.delenv("ENV_FILE_TEST", raising=False)
+    monkeypatch.setenv("ENV_FILE_KEEP", "from environment")
+    (tmp_path / ".env").write_text("ENV_FILE_TEST=loaded\nENV_FILE_KEEP=from file\n")
+    script = tmp_path / "active_replication" / "server.py"
+    script.parent.mkdir()
+    script.write_text("")
+
+    load_env_file(str(script))
+    assert os.environ["ENV_FILE_TEST"] == "loaded"
+    assert os.environ["ENV_FILE_KEEP"] == "from environment"  # Like load_dotenv(), never overrides
+
+
+def test_no_env_file_leaves_the_environment_alone(tmp_path):
+    before = dict(os.environ)
+    load_env_file(str(tmp_path / "server.py"))
+    assert dict(os.environ) == before
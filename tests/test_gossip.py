@@ -0,0 +1,111 @@
+import time
+
+import pytest
+
+import gfd
+import lfd
+from gossip import ALIVE, DEAD, GossipMember
+
+INTERVAL = 0.05
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def group():
+    members = []
+
+    def start(member_id, **kwargs):
+        seeds = [members[0].address] if members else []
+        member = GossipMember(member_id, seeds=seeds, interval=INTERVAL, ip='127.0.0.1', **kwargs).start()
+        members.append(member)
+        return member
+
+    yield start
+    for member in members:
+        if not member.stopped:
+            member.stop()
+
+
+def status(member, member_id):
+    return member.view().get(member_id, {}).get("status")
+
+
+def test_members_converge_and_spread_data(group):
+    changes = []
+    seed = group("GFD", on_change=lambda member_id, entry: changes.append((member_id, entry["data"])))
+    members = [group(f"LFD{i}", data={"replica": None}) for i in range(1, 4)]
+    assert wait_for(lambda: all(len(member.view()) == 4 for member in [seed] + members))
+
+    members[0].update_data(replica="S1")
+    assert wait_for(lambda: seed.view()["LFD1"]["data"]["replica"] == "S1")
+    assert ("LFD1", {"replica": "S1"}) in changes
+
+
+def test_a_stopped_member_is_declared_dead(group):
+    seed = group("GFD")
+    members = [group(f"LFD{i}") for i in range(1, 4)]
+    assert wait_for(lambda: all(status(seed, member.member_id) == ALIVE for member in members))
+
+    members[0].stop()
+    assert wait_for(lambda: status(seed, "LFD1") == DEAD)
+    assert status(members[1], "LFD1") in (DEAD, "suspect")
+    assert status(seed, "LFD2") == ALIVE
+
+
+def test_push_delivers_an_update_to_one_member(group):
+    seed = group("GFD")
+    member = group("LFD1")
+    assert wait_for(lambda: status(seed, "LFD1") == ALIVE and status(member, "GFD") == ALIVE)
+    seed.interval = member.interval = 60  # No more probes either way: only push() carries the update now
+    time.sleep(3 * INTERVAL)
+    seed.update_data(note="pushed")
+    seed.push("LFD1")
+    assert wait_for(lambda: member.view()["GFD"]["data"].get("note") == "pushed", timeout=1)
+
+
+def entry(status, replica=None, registration=None):
+    return {"status": status, "data": {"replica": replica, "registration": registration}}
+
+
+def test_gfd_membership_follows_registrations(monkeypatch):
+    events = []
+    monkeypatch.setattr(gfd, "gossip_replicas", {})
+    monkeypatch.setattr(gfd, "add_replica", lambda server_id: events.append(("add", server_id)))
+    monkeypatch.setattr(gfd, "delete_replica", lambda server_id: events.append(("delete", server_id)))
+
+    gfd.handle_gossip_change("LFD1", entry(ALIVE, "S1", 1))
+    gfd.handle_gossip_change("LFD1", entry(ALIVE, "S1", 1))  # e.g. a refuted suspicion
+    gfd.handle_gossip_change("LFD1", entry(ALIVE, "S1", 2))  # Restarted; its death was never gossiped
+    gfd.handle_gossip_change("LFD1", entry(DEAD, "S1", 2))
+    gfd.handle_gossip_change("RM", entry(ALIVE, "S9", 1))
+    assert events == [("add", "S1"), ("add", "S1"), ("delete", "S1"), ("add", "S1"), ("delete", "S1")]
+
+
+def gfd_entry(commands):
+    return {"status": ALIVE, "data": {"role": "gfd", "commands": commands}}
+
+
+def test_lfd_acts_on_each_gossiped_command_once(monkeypatch):
+    handled = []
+    monkeypatch.setattr(lfd, "COMPONENT_ID", "LFD1")
+    monkeypatch.setattr(lfd, "gfd_commands_seen", None)
+    monkeypatch.setattr(lfd, "handle_gfd_command", lambda message: handled.append((message["message"], message["server_id"])))
+
+    old = {"LFD1": {"recover_server": {"seq": 5, "server_id": "S1"}}}
+    lfd.handle_gossip_change("GFD", gfd_entry(old))  # Issued before this LFD joined: not replayed
+    new = {"LFD1": {"recover_server": {"seq": 5, "server_id": "S1"},
+                    "new_primary": {"seq": 7, "server_id": "S1"},
+                    "new_reliable": {"seq": 6, "server_id": "S1"}},
+           "LFD2": {"new_primary": {"seq": 8, "server_id": "S2"}}}
+    lfd.handle_gossip_change("GFD", gfd_entry(new))
+    lfd.handle_gossip_change("GFD", gfd_entry(new))  # Gossiped again
+    lfd.handle_gossip_change("LFD2", gfd_entry(new))
+    assert handled == [("new_reliable", "S1"), ("new_primary", "S1")]
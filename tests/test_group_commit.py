@@ -0,0 +1,94 @@
+import importlib.util
+import os
+import select
+import socket
+import threading
+import time
+from queue import Queue
+
+import pytest
+
+from communication_utils import receive
+from kv_store import KVStore
+
+
+def load_server():
+    path = os.path.join(os.path.dirname(__file__), '..', 'passive_replication', 'server.py')
+    spec = importlib.util.spec_from_file_location("passive_server", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+server = load_server()
+
+
+@pytest.fixture
+def primary(monkeypatch):
+    monkeypatch.setattr(server, "batch_queue", Queue())
+    monkeypatch.setattr(server, "store", KVStore())
+    monkeypatch.setattr(server, "role", "primary")
+    monkeypatch.setattr(server, "storage", None)
+    monkeypatch.setattr(server, "PRIMARY_LEASE", 0)
+    return server
+
+
+def put(key, value, number):
+    return {"component_id": "C1", "message": "put", "key": key, "value": value, "request_number": number}
+
+
+def test_batch_flushes_at_max_size(primary, monkeypatch):
+    monkeypatch.setattr(primary, "BATCH_MAX_SIZE", 4)
+    monkeypatch.setattr(primary, "BATCH_MAX_DELAY", 5)
+    for i in range(10):
+        primary.batch_queue.put((None, put("k", i, i), time.perf_counter()))
+    start = time.perf_counter()
+    batch = primary.next_batch()
+    assert time.perf_counter() - start < 1  # Full, so it does not wait out the delay
+    assert [message["value"] for _, message, _ in batch] == [0, 1, 2, 3]
+    assert primary.batch_queue.qsize() == 6
+
+
+def test_batch_flushes_after_max_delay(primary, monkeypatch):
+    monkeypatch.setattr(primary, "BATCH_MAX_SIZE", 100)
+    monkeypatch.setattr(primary, "BATCH_MAX_DELAY", 0.2)
+    primary.batch_queue.put((None, put("k", 0, 0), time.perf_counter()))
+    late = threading.Timer(0.05, primary.batch_queue.put, ((None, put("k", 1, 1), time.perf_counter()),))
+    late.start()
+    start = time.perf_counter()
+    batch = primary.next_batch()
+    elapsed = time.perf_counter() - start
+    assert [message["value"] for _, message, _ in batch] == [0, 1]  # Arrived within the delay
+    assert 0.2 <= elapsed < 1
+
+
+class RecordingStorage:
+    """Records the version waited for and whether any reply had reached a client by then."""
+
+    def __init__(self, readers):
+        self.readers = readers
+        self.waits = []
+
+    def wait(self, version):
+        readable, _, _ = select.select(self.readers, [], [], 0)
+        self.waits.append((version, readable))
+
+
+def test_batch_is_durable_before_replies(primary, monkeypatch):
+    pairs = [socket.socketpair() for _ in range(2)]
+    storage = RecordingStorage([reader for _, reader in pairs])
+    monkeypatch.setattr(primary, "storage", storage)
+    try:
+        batch = [(pairs[i % 2][0], put(f"k{i}", i, i), time.perf_counter()) for i in range(6)]
+        primary.commit_batch(batch)
+
+        assert storage.waits == [(6, [])]  # One wait for the whole batch, before any reply
+        for client, (_, reader) in enumerate(pairs):
+            reader.settimeout(1)
+            replies = [receive(reader, "C1", print_message=False) for _ in range(3)]
+            assert [reply["request_number"] for reply in replies] == [client, client + 2, client + 4]
+            assert all(reply["message"] == "put_response" for reply in replies)
+        assert primary.store.version == 6
+    finally:
+        for sock in sum(pairs, ()):
+            sock.close()
@@ -0,0 +1,106 @@
+import random
+
+from kv_store import KVStore
+from snapshot_file import MappedSnapshot, write_snapshot
+
+
+def read_all(view, position=0, limit=3):
+    entries = []
+    while True:
+        more, position = view.entries(position, limit)
+        if not more and position >= view.size:
+            return entries
+        entries.extend(more)
+
+
+def mutate(store, rng, keys=40):
+    for _ in range(rng.randint(0, 6)):
+        key = f"k{rng.randrange(keys)}"
+        if rng.random() < 0.6:
+            store.put(key, rng.randrange(1000))
+        else:
+            store.delete(key)
+
+
+def mapped_store(tmp_path, data):
+    path = str(tmp_path / "base.kvs")
+    with open(path, "wb") as f:
+        write_snapshot(f, data, 1)
+    store = KVStore()
+    store.load_mapped(MappedSnapshot(path))
+    return store
+
+
+def test_view_keeps_the_store_as_of_when_it_was_taken():
+    store = KVStore()
+    store.load({"a": 1, "b": 2, "c": 3})
+    view = store.view()
+    store.put("a", 10)
+    store.delete("b")
+    store.put("d", 4)  # Reuses b's slot
+    store.put("b", 20)
+
+    assert dict(read_all(view)) == {"a": 1, "b": 2, "c": 3}
+    assert view.count == 3
+    assert store.to_dict() == {"a": 10, "b": 20, "c": 3, "d": 4}
+
+
+def test_view_over_a_mapped_base(tmp_path):
+    store = mapped_store(tmp_path, {f"k{i}": i for i in range(10)})
+    store.put("k0", 100)
+    view = store.view()
+    store.put("k1", 101)   # Hides a base key after the view was taken
+    store.delete("k2")
+    store.put("k0", 200)   # Changes a slot
+
+    expected = {f"k{i}": i for i in range(10)}
+    expected["k0"] = 100
+    assert dict(read_all(view)) == expected
+
+
+def test_random_writes_between_chunks(tmp_path):
+    rng = random.Random(36)
+    for trial in range(200):
+        data = {f"k{i}": i for i in range(rng.randrange(30))}
+        if trial % 2:
+            store = mapped_store(tmp_path, data)
+        else:
+            store = KVStore()
+            store.load(data)
+        mutate(store, rng)
+        expected = store.to_dict()
+        view = store.view()
+        entries, position = [], 0
+        while True:
+            mutate(store, rng)
+            more, position = view.entries(position, rng.randint(1, 5))
+            if not more and position >= view.size:
+                break
+            entries.extend(more)
+        assert len(entries) == view.count == len(expected)
+        assert dict(entries) == expected
+        view.close()
+
+
+def test_entries_can_be_read_again_from_a_cursor():
+    store = KVStore()
+    store.load({f"k{i}": i for i in range(10)})
+    view = store.view()
+    first, cursor = view.entries(0, 4)
+    rest = read_all(view, cursor)
+    store.put("k8", 80)
+    assert read_all(view, cursor) == rest
+    assert dict(first + rest) == {f"k{i}": i for i in range(10)}
+
+
+def test_closed_and_fully_read_views_stop_tracking_writes():
+    store = KVStore()
+    store.load({"a": 1})
+    view = store.view()
+    view.close()
+    assert store.views == [] and not view.open
+
+    view = store.view()
+    while view.read(10):
+        pass
+    assert store.views == []
@@ -0,0 +1,47 @@
+import errno
+import socket
+import threading
+import time
+
+import pytest
+
+import communication_utils
+from communication_utils import create_listener, create_unix_listener, retry_bind
+
+
+@pytest.fixture(autouse=True)
+def short_bind_timeout(monkeypatch):
+    monkeypatch.setattr(communication_utils, "BIND_TIMEOUT", 2)
+    monkeypatch.setattr(communication_utils, "BIND_RETRY", 0.01)
+
+
+def test_unix_listener_waits_for_the_previous_owner(tmp_path):
+    path = str(tmp_path / "lfd.sock")
+    holder = create_unix_listener(path, 1)
+    threading.Timer(0.2, holder.close).start()  # The process being replaced exits
+
+    start = time.monotonic()
+    listener = retry_bind(lambda: create_unix_listener(path, 1), path)
+    assert 0.2 <= time.monotonic() - start < 2
+    listener.close()
+
+
+def test_unix_listener_gives_up_after_the_bind_timeout(tmp_path, monkeypatch):
+    monkeypatch.setattr(communication_utils, "BIND_TIMEOUT", 0.2)
+    holder = create_listener("unix:" + str(tmp_path / "s1"), 12346, 1)
+    with pytest.raises(OSError) as raised:
+        create_listener("unix:" + str(tmp_path / "s1"), 12346, 1)
+    assert raised.value.errno == errno.EADDRINUSE
+    holder.close()
+
+
+def test_stale_socket_file_is_replaced_at_once(tmp_path):
+    path = str(tmp_path / "lfd.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()  # Leaves the file behind with nobody listening
+
+    start = time.monotonic()
+    listener = retry_bind(lambda: create_unix_listener(path, 1), path)
+    assert time.monotonic() - start < 0.1
+    listener.close()
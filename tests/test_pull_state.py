@@ -0,0 +1,66 @@
+import importlib.util
+import os
+import socket
+import threading
+
+import pytest
+
+from communication_utils import receive
+from kv_store import KVStore
+from state_transfer import StateDonor, TransferInterrupted
+
+
+def load_server():
+    path = os.path.join(os.path.dirname(__file__), '..', 'active_replication', 'server.py')
+    spec = importlib.util.spec_from_file_location("active_server", path)
+    module = importlib.util.module_from_spec(spec)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("MY_SERVER_ID", "S2")  # Read at import time
+        spec.loader.exec_module(module)
+    return module
+
+
+server = load_server()
+
+
+@pytest.fixture
+def reliable(monkeypatch):
+    """A reliable server that streams `donor_store` in full, whatever the request asks for."""
+    donor_store = KVStore()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    def serve():
+        conn, _ = listener.accept()
+        try:
+            request = receive(conn, "S1", print_message=False)
+            StateDonor("S1", donor_store).stream(conn, "S2", request)
+        except (TransferInterrupted, OSError):
+            pass  # A replica keeping its own state hangs up mid-stream
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    monkeypatch.setattr(server, "RELIABLE_SERVER_IP", '127.0.0.1')
+    monkeypatch.setattr(server, "RELIABLE_SERVER_PORT", listener.getsockname()[1])
+    monkeypatch.setattr(server, "store", KVStore())
+    monkeypatch.setattr(server, "storage", None)
+    yield donor_store
+    thread.join(5)
+    listener.close()
+
+
+def test_newer_local_state_of_the_same_lineage_is_kept(reliable):
+    server.store.load({"a": 1, "b": 2}, version=5)
+    reliable.load({"a": 0}, version=3, lineage=server.store.lineage)
+    server.pull_state()
+    assert server.store.snapshot() == ({"a": 1, "b": 2}, 5, reliable.lineage)
+
+
+def test_other_lineage_installs_the_reliable_snapshot_despite_a_lower_version(reliable):
+    server.store.load({"a": 1, "b": 2}, version=5)
+    reliable.load({"a": 0}, version=3)
+    server.pull_state()
+    assert server.store.snapshot() == ({"a": 0}, 3, reliable.lineage)
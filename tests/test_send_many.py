@@ -0,0 +1,92 @@
+import json
+import socket
+import threading
+
+import communication_utils
+from communication_utils import create_message, send_many
+
+
+class TrickleSocket:
+    """Accepts at most `limit` bytes per sendmsg(), like a socket whose send buffer is nearly full."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = bytearray()
+        self.calls = []
+
+    def sendmsg(self, buffers):
+        self.calls.append(len(buffers))
+        sent = 0
+        for buffer in buffers:
+            take = bytes(buffer[:self.limit - sent])
+            self.data += take
+            sent += len(take)
+            if sent == self.limit:
+                break
+        return sent
+
+
+class CountingSocket:
+    """Wraps a real socket, counting sendmsg() calls that wrote less than they were given."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.short_writes = 0
+
+    def sendmsg(self, buffers):
+        sent = self.sock.sendmsg(buffers)
+        if sent < sum(len(buffer) for buffer in buffers):
+            self.short_writes += 1
+        return sent
+
+
+def messages(count, size=0):
+    return [create_message("S1", "put_response", key=f"k{i}", value=i, padding="x" * size) for i in range(count)]
+
+
+def decode(data):
+    return [json.loads(line) for line in bytes(data).split(b"\n") if line]
+
+
+def test_partial_writes_resume_mid_buffer():
+    sent = messages(5)
+    sock = TrickleSocket(limit=7)
+    send_many(sock, sent, "C1", print_message=False)
+    assert decode(sock.data) == sent
+    assert len(sock.calls) > len(sent)  # Every message needed several writes
+
+
+def test_chunks_at_iov_max(monkeypatch):
+    monkeypatch.setattr(communication_utils, "IOV_MAX", 3)
+    sent = messages(10)
+    sock = TrickleSocket(limit=1 << 20)
+    send_many(sock, sent, "C1", print_message=False)
+    assert decode(sock.data) == sent
+    assert sock.calls == [3, 3, 3, 1]
+
+
+def test_small_send_buffer_socketpair():
+    sender, reader = socket.socketpair()
+    sender.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    sender.settimeout(5)  # Non-blocking underneath, so sendmsg() returns short counts instead of waiting
+    sent = messages(200, size=1000)
+    received = bytearray()
+
+    def read():
+        while True:
+            chunk = reader.recv(997)
+            if not chunk:
+                break
+            received.extend(chunk)
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    counting = CountingSocket(sender)
+    try:
+        send_many(counting, sent, "C1", print_message=False)
+    finally:
+        sender.close()
+        thread.join(5)
+        reader.close()
+    assert counting.short_writes > 0
+    assert decode(received) == sent
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from sharding import HashRing, ShardMap, WrongShard, load_shard_map, request_keys
+
+KEYS = [f"key-{i}" for i in range(5000)]
+
+
+def test_ring_spreads_keys_over_every_group():
+    ring = HashRing(["G1", "G2", "G3"])
+    counts = {}
+    for key in KEYS:
+        group = ring.group_for(key)
+        counts[group] = counts.get(group, 0) + 1
+    assert set(counts) == {"G1", "G2", "G3"}
+    assert min(counts.values()) > len(KEYS) / 3 * 0.7
+
+
+def test_removing_a_group_only_moves_its_keys():
+    before = HashRing(["G1", "G2", "G3"])
+    after = HashRing(["G1", "G2"])
+    for key in KEYS:
+        if before.group_for(key) != "G3":
+            assert after.group_for(key) == before.group_for(key)
+
+
+def test_ring_needs_a_group():
+    with pytest.raises(ValueError):
+        HashRing([])
+
+
+def test_shard_map_routes_and_checks(tmp_path):
+    config = {"vnodes": 50, "groups": {
+        "G1": {"rm": "127.0.0.1:13579", "servers": {"S1": "127.0.0.1:12346"}},
+        "G2": {"rm": "unix:/tmp/rm:13580", "servers": {"S1": "10.0.0.2:22346", "S2": "10.0.0.3:22346"}},
+    }}
+    path = tmp_path / "shards.json"
+    path.write_text(json.dumps(config))
+    shard_map = load_shard_map(str(path))
+
+    assert shard_map.to_json() == config
+    assert shard_map.rm_address("G2") == ("unix:/tmp/rm", 13580)
+    assert shard_map.server_addresses("G2") == {"S1": ("10.0.0.2", 22346), "S2": ("10.0.0.3", 22346)}
+    key = KEYS[0]
+    owner = shard_map.group_for(key)
+    other = "G2" if owner == "G1" else "G1"
+    shard_map.check(owner, key)
+    with pytest.raises(WrongShard):
+        shard_map.check(other, key)
+    assert ShardMap(config["groups"], 50).group_for(key) == owner  # Same map, same routing anywhere
+
+
+def test_unsharded_without_a_config(monkeypatch):
+    monkeypatch.delenv("SHARD_CONFIG", raising=False)
+    assert load_shard_map() is None
+
+
+def test_request_keys(monkeypatch):
+    monkeypatch.delenv("CLIENT_KEYS", raising=False)
+    assert request_keys() == ["state"]
+    monkeypatch.setenv("CLIENT_KEYS", "a,b,,c")
+    assert request_keys() == ["a", "b", "c"]
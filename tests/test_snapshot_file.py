@@ -0,0 +1,40 @@
+import pytest
+
+from snapshot_file import MappedSnapshot, write_snapshot
+
+
+def write(path, data, version=7, lineage="abc"):
+    with open(path, "wb") as f:
+        write_snapshot(f, data, version, lineage)
+    return MappedSnapshot(str(path))
+
+
+def test_round_trip(tmp_path):
+    data = {f"key-{i}": i * 7919 - 500 for i in range(1000)}
+    data["ünïcode"] = 2 ** 63 - 1
+    data["min"] = -2 ** 63
+    snapshot = write(tmp_path / "s.kvs", data)
+
+    assert len(snapshot) == len(data)
+    assert snapshot.version == 7
+    assert snapshot.lineage == "abc"
+    assert dict(snapshot.items()) == data
+    for key, value in data.items():
+        assert snapshot.get(key) == value
+        assert snapshot.item(snapshot.find(key)) == (key, value)
+    assert "missing" not in snapshot
+    assert snapshot.get("missing", -1) == -1
+
+
+def test_empty_store_without_lineage(tmp_path):
+    snapshot = write(tmp_path / "s.kvs", {}, version=0, lineage=None)
+    assert len(snapshot) == 0
+    assert snapshot.lineage is None
+    assert snapshot.find("a") is None
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "not.kvs"
+    path.write_bytes(b"x" * 100)
+    with pytest.raises(ValueError):
+        MappedSnapshot(str(path))
@@ -0,0 +1,134 @@
+import json
+import socket
+import threading
+import time
+import zlib
+
+import pytest
+
+from communication_utils import create_message, receive, receive_frame, send_framed
+from kv_store import KVStore
+import state_transfer
+from state_transfer import StateDonor, TransferInterrupted, receive_state
+
+
+@pytest.fixture
+def store():
+    store = KVStore()
+    store.load({f"key-{i}": i for i in range(100)})
+    return store
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(state_transfer, "CHUNK_KEYS", 8)
+    monkeypatch.setattr(state_transfer, "WINDOW", 2)
+
+
+def stream_in_background(donor, sock, **kwargs):
+    errors = []
+
+    def run():
+        try:
+            donor.stream(sock, "S2", **kwargs)
+        except (TransferInterrupted, OSError) as e:
+            errors.append(e)
+        finally:
+            sock.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, errors
+
+
+def test_stream_delivers_the_snapshot_despite_later_writes(store):
+    donor = StateDonor("S1", store)
+    donor_sock, receiver_sock = socket.socketpair()
+    transfer = donor.prepare()
+    store.put("key-0", -1)
+    store.delete("key-1")
+    thread, errors = stream_in_background(donor, donor_sock, transfer=transfer)
+
+    state = receive_state(receiver_sock, receive(receiver_sock, "S2", False), "S2")
+    thread.join(5)
+    assert not errors
+    assert state.data == {f"key-{i}": i for i in range(100)}
+    assert state.version == transfer.version
+
+
+def test_interrupted_transfer_resumes_from_its_offset(store):
+    donor = StateDonor("S1", store)
+    donor_sock, receiver_sock = socket.socketpair()
+    thread, _ = stream_in_background(donor, donor_sock, request={"retries": 1})
+    begin = receive(receiver_sock, "S2", False)
+    partial = state_transfer.IncomingState(begin)
+    for _ in range(state_transfer.WINDOW):  # Take the chunks sent ahead of any ack, then drop the connection
+        header = receive(receiver_sock, "S2", False)
+        assert header["message"] == "state_chunk" and header["offset"] == partial.offset
+        partial.data.update(json.loads(receive_frame(receiver_sock)))
+        partial.offset += header["keys"]
+    receiver_sock.close()
+    thread.join(5)
+    store.put("key-99", -99)  # Written while the receiver was away
+
+    donor_sock, receiver_sock = socket.socketpair()
+    thread, errors = stream_in_background(donor, donor_sock, request=partial.resume_fields())
+    resumed = receive(receiver_sock, "S2", False)
+    assert resumed["transfer_id"] == begin["transfer_id"]
+    assert resumed["offset"] == partial.offset
+    state = receive_state(receiver_sock, resumed, "S2", partial)
+    thread.join(5)
+    assert not errors
+    assert state.offset == 100
+    assert state.data == {f"key-{i}": i for i in range(100)}
+    assert donor.transfers == {}  # Released once complete
+    assert store.views == []
+
+
+def test_failed_transfer_without_retries_is_released_at_once(store):
+    donor = StateDonor("S1", store)
+    donor_sock, receiver_sock = socket.socketpair()
+    thread, errors = stream_in_background(donor, donor_sock, request={"retries": 0})
+    receive(receiver_sock, "S2", False)
+    receiver_sock.close()
+    thread.join(5)
+    assert errors
+    assert donor.transfers == {}
+    assert store.views == []
+
+
+def test_idle_transfers_expire_without_further_requests(store, monkeypatch):
+    monkeypatch.setattr(state_transfer, "TRANSFER_TTL", 0.05)
+    donor = StateDonor("S1", store)
+    donor.prepare()
+    assert len(store.views) == 1
+    deadline = time.monotonic() + 5
+    while store.views and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert donor.transfers == {}
+    assert store.views == []
+
+
+def test_resume_needs_a_chunk_boundary(store):
+    donor = StateDonor("S1", store)
+    transfer = donor.prepare()
+    transfer.entries(0, 8)
+    assert donor._resumed({"transfer_id": transfer.transfer_id, "offset": 8})
+    assert donor._resumed({"transfer_id": transfer.transfer_id, "offset": 5}) is None
+    with pytest.raises(TransferInterrupted):
+        transfer.entries(5, 13)
+    donor.release(transfer)
+    assert donor._resumed({"transfer_id": transfer.transfer_id, "offset": 8}) is None
+
+
+def test_chunk_crc_covers_the_payload_bytes():
+    donor_sock, receiver_sock = socket.socketpair()
+    begin = create_message("S1", "state_begin", transfer_id="t", version=1, lineage="l", keys=2, offset=0)
+    payload = json.dumps({"a": 1, "b": 2}).encode()
+    header = create_message("S1", "state_chunk", transfer_id="t", offset=0, keys=2, crc=zlib.crc32(payload))
+    send_framed(donor_sock, header, payload.replace(b"2", b"3"), "S2", False)
+
+    with pytest.raises(TransferInterrupted, match="Bad state chunk"):
+        receive_state(receiver_sock, begin, "S2")
+    donor_sock.close()
+    receiver_sock.close()